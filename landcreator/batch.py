@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# generates many lands in one process, with one pool of workers for all of them:
+# the variants of a base land description given by a sweep file, like
+#
+#   [sweep]
+#   base = epubre.ini
+#   topography.perlin_seed = 0.1 | 0.2 | 0.3
+#   topography.change_distances = 0.70 0.95 | 0.60 0.90
+#
+# every option section.option lists values separated by "|", and a land is
+# generated for every combination of them. the outputs of a stage already
+# generated for a previous variant from the same inputs (the same stage key)
+# are copied instead of generated again, as the noise when only the topography
+# varies. a summary table with the land fraction and the biome histogram of
+# every land (as fractions of its land pixels) is written to a csv file.
+
+import logging
+import argparse
+import configparser
+import csv
+import itertools
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import time
+import numpy
+import main
+import shared
+
+SweepSection = "sweep"
+SweepSeparator = "|"
+
+# terrain7 biomes, by weight index
+Biomes = {main.Terr7MtnWhite: "mtn_white", main.Terr7MtnIce: "mtn_ice", main.Terr7DryDirt: "dry_dirt",
+          main.Terr7WetDirt: "wet_dirt", main.Terr7DryGrass: "dry_grass", main.Terr7WetGrass: "wet_grass",
+          main.Terr7Snow: "snow", main.Terr7Sand: "sand"}
+
+
+def read_sweep(file_path):
+    # base land description and the values of every option swept, by (section, option)
+    sweep = configparser.ConfigParser()
+    if not sweep.read(file_path) or SweepSection not in sweep:
+        raise ValueError("no [%s] section in %s" % (SweepSection, file_path))
+    base = configparser.ConfigParser()
+    base.read_dict(main._defaul_config)
+    base_path = os.path.join(os.path.dirname(file_path), sweep[SweepSection].get("base"))
+    if not base.read(base_path):
+        raise ValueError("base land file can not be read: " + base_path)
+    grid = dict()
+    for key, values in sweep[SweepSection].items():
+        if key == "base" or key == "name":
+            continue
+        section, option = key.split(".", 1)
+        if section not in base:
+            raise ValueError("unknown section in sweep: " + section)
+        grid[(section, option)] = [value.strip() for value in values.split(SweepSeparator)]
+    name = sweep[SweepSection].get("name", base["global"].get("name"))
+    return base, name, grid
+
+
+def variants(base, name, grid):
+    # land descriptions of every combination of the values swept, with their values
+    keys = list(grid)
+    for i, values in enumerate(itertools.product(*[grid[key] for key in keys])):
+        config = configparser.ConfigParser()
+        config.read_dict(base)
+        for (section, option), value in zip(keys, values):
+            config[section][option] = value
+        config["global"]["name"] = "%s_%03i" % (name, i)
+        yield config, {"%s.%s" % key: value for key, value in zip(keys, values)}
+
+
+def reuse_stages(targets, built):
+    # copies the outputs, and their sidecars, of the stages built for a previous
+    # land from the same key; returns the stages copied
+    reused = list()
+    for name in main.Stages:
+        if name not in targets or main.stage_fresh(name):
+            continue
+        key = main.stage_key(name)
+        if key is None or key not in built:
+            continue
+        for file_name in main.Stages[name]["outputs"]:
+            for copied in (file_name, main.SidecarFileName % file_name):
+                # copy2 keeps the modification time the sidecar was written with
+                shutil.copy2(os.path.join(built[key], copied), os.path.join(main.directory, copied))
+        reused.append(name)
+    return reused
+
+
+def record_built(targets, built):
+    for name in main.Stages:
+        if name not in targets:
+            continue
+        sidecar = main.read_sidecar(main.Stages[name]["outputs"][0])
+        if sidecar is not None and sidecar.get("key") is not None:
+            built.setdefault(sidecar["key"], main.directory)
+
+
+def statistics_band(rows, topography, normals, temperature, humidity, noise_array):
+    # land pixels, and land pixels by biome of most weight (the last count, pixels without biome)
+    slopes = main.generate_slopes_data(normals[rows])
+    weights, bad = main.calculate_alpha_weights(topography[rows], slopes, temperature[rows], humidity[rows], noise_array[rows])
+    biomes = numpy.where(weights.any(axis=-1), weights.argmax(axis=-1), len(Biomes))
+    land = topography[rows] > main.ocean_altitude
+    return numpy.count_nonzero(land), numpy.bincount(biomes[land], minlength=len(Biomes) + 1)
+
+
+def statistics():
+    arrays = [main.get_data(file_name) for file_name in (main.TopoDataFileName, main.NormalsDataFileName, main.TempDataFileName,
+                                                         main.HumidityDataFileName, main.NoiseDataFileName)]
+    if any(array is None or array.ndim < 2 for array in arrays):
+        return dict()
+    results = main.for_each_band(statistics_band, arrays[0].shape[0], *arrays)
+    land = sum(result[0] for result in results)
+    counts = sum(result[1] for result in results)
+    stats = {"land_fraction": land / float(arrays[0].size)}
+    # biome histogram, as fractions of the land
+    for index, biome in Biomes.items():
+        stats[biome] = counts[index] / max(1.0, float(land))
+    stats["no_biome"] = counts[len(Biomes)] / max(1.0, float(land))
+    return stats
+
+
+def run_lands(base, name, grid, targets, workers, jobs):
+    # generates every variant, yields the summary row of each land, None for
+    # the lands that failed. the pool is shared by the lands, the shared memory
+    # of each one is released before the next one (the workers detach it when
+    # their first task of the next land comes). targets None are the default
+    # stages of each land
+    built = dict()
+    if workers > 1:
+        main.pool = multiprocessing.Pool(workers)
+    try:
+        for row in run_variants(base, name, grid, targets, jobs, built):
+            yield row
+    finally:
+        main.stop_workers()
+        main.pool = None
+
+
+def run_variants(base, name, grid, targets, jobs, built):
+    # the lands of run_lands, in the pool of main if any
+    for config, values in variants(base, name, grid):
+        start = time.perf_counter()
+        if not main.configure(config):
+            yield None
+            return
+        logging.info("land %s: %s" % (main.directory, ", ".join("%s=%s" % item for item in values.items())))
+        with open(os.path.join(main.directory, main.directory + ".ini"), "w") as file:
+            config.write(file)
+        main.loaded.clear()
+        main.metrics.clear()
+        main.value_ranges.clear()
+        stages = targets if targets is not None else main.default_stages()
+        required = main.required_stages(stages)
+        row = None
+        try:
+            try:
+                reused = reuse_stages(required, built)
+            except Exception as e:
+                logging.exception(str(e))
+                reused = list()
+            if reused:
+                logging.info("reused from previous lands: " + ", ".join(reused))
+            if main.run_stages(stages, set(), dict(), max(1, jobs), 0):
+                record_built(required, built)
+                row = {"land": main.directory}
+                row.update(values)
+                row.update({"seconds": time.perf_counter() - start, "stages_run": len(main.metrics), "stages_reused": len(reused)})
+                row.update(statistics())
+            else:
+                logging.error("land %s failed" % main.directory)
+        finally:
+            main.loaded.clear()
+            shared.release_all()
+        yield row
+
+
+def execute():
+    print("Land Creator batch")
+    logging.basicConfig(level=logging.INFO)
+    argp = argparse.ArgumentParser()
+    argp.add_argument('sweep_file', help='sweep description file')
+    argp.add_argument('-s', '--stages', help='comma separated stages to generate, all of them but the optional ones by default')
+    argp.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes, shared by the lands')
+    argp.add_argument('-j', '--jobs', type=int, default=1, help='number of stages run at the same time')
+    argp.add_argument('--out-of-core', action='store_true', help='map data files in memory and work on them in place')
+    argp.add_argument('-z', '--png_level', type=int, default=main.pngwriter.DefaultLevel, choices=range(10), metavar='[0-9]', help='png compression level')
+    argp.add_argument('-o', '--output', help='summary file, the sweep file name with .csv by default')
+    args = argp.parse_args()
+    try:
+        base, name, grid = read_sweep(args.sweep_file)
+    except Exception as e:
+        logging.exception(str(e))
+        sys.exit(1)
+    if args.stages:
+        targets = args.stages.split(",")
+        for target in targets:
+            if target not in main.Stages:
+                logging.error("unknown stage: " + target)
+                sys.exit(1)
+    else:
+        targets = None
+    main.out_of_core = args.out_of_core
+    main.png_level = args.png_level
+    if args.workers > 1:
+        logging.info("workers: %i" % args.workers)
+    #
+    rows = list()
+    failed = False
+    for row in run_lands(base, name, grid, targets, args.workers, args.jobs):
+        if row is None:
+            failed = True
+        else:
+            rows.append(row)
+    # summary
+    output = args.output or os.path.splitext(args.sweep_file)[0] + ".csv"
+    logging.info("save summary: " + output)
+    fields = list()
+    for row in rows:
+        fields += [field for field in row if field not in fields]
+    with open(output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fields)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({field: ("%.4f" % value if isinstance(value, float) else value) for field, value in row.items()})
+    for row in rows:
+        print("%s land %.3f %s" % (row["land"], row.get("land_fraction", 0.0),
+                                   " ".join("%s %.3f" % (biome, row.get(biome, 0.0)) for biome in Biomes.values())))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    execute()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# benchmark of the landcreator stages over synthetic lands of growing size.
+# every stage runs in a process of its own, reading the outputs of the stages
+# before it, so its peak memory is measured alone. results go to a json file,
+# that can be given as baseline to later runs: a stage slower than the baseline
+# by more than the threshold fails the benchmark. the baseline by default is
+# the one of sizes 257 and 1025 shipped with landcreator, the environment it
+# was measured in is in it. the array implementations are
+# checked against the scalar reference ones on samples of the smallest land.
+
+import logging
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import os.path
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import numpy
+import fbm
+import main
+
+BenchSizes = [257, 1025, 4097]
+BenchLargeSize = 8193
+BenchThreshold = 0.25
+BenchSamples = 2000
+BaselineFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# stages benchmarked, in build order
+BenchStages = ["noise", "topography", "normals", "shore_distance", "temperature", "humidity", "topography_image",
+               "slopes_image", "pack_images_thn", "pack_images_bld", "pack_images_alpha", "pyramid"]
+
+# synthetic land, the costliest type of each layer
+_bench_config = {"global": {"name": "bench", "noise_horiz_scale": "1.0"},
+                 "topography": {"type": main.TopoTypeIsland},
+                 "temperature": {"type": main.TempTypeNoise},
+                 "humidity": {"type": main.HumidityTypeNoise}}
+
+
+def setup(directory, size, out_of_core):
+    # globals of main as execute() sets them
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    config.read_dict(_bench_config)
+    main.config = config
+    main.directory = directory
+    main.size_total = size
+    main.noise_horiz_scale = config['global'].getfloat('noise_horiz_scale')
+    main.ocean_altitude = config['global'].getfloat('ocean_altitude')
+    main.out_of_core = out_of_core
+
+
+def stage_process(connection, directory, size, name, workers, out_of_core):
+    # runs in a process of its own, sends back the measures
+    sys.stdout = open(os.devnull, "w")
+    logging.basicConfig(level=logging.WARNING)
+    setup(directory, size, out_of_core)
+    if workers > 1:
+        main.pool = multiprocessing.Pool(workers, initializer=main.init_worker,
+                                         initargs=(main.worker_state(),))
+    # inputs are loaded before timing the stage
+    for depend in main.stage_depends(name):
+        for file_name in main.Stages[depend]["outputs"]:
+            main.get_data(file_name)
+    node, stages = (main.PackStage, [name]) if name in main.PackStages else (name, [name])
+    start = time.perf_counter()
+    success = main.run_stage(node, stages, dict())
+    seconds = time.perf_counter() - start
+    main.stop_workers()
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    connection.send({"success": success, "seconds": seconds, "peak_rss_kb": peak_rss})
+
+
+def bench_stage(directory, size, name, workers, out_of_core):
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=stage_process, args=(sender, directory, size, name, workers, out_of_core))
+    process.start()
+    result = receiver.recv() if receiver.poll(None) else None
+    process.join()
+    if result is None or process.exitcode != 0:
+        return {"success": False, "seconds": 0.0, "peak_rss_kb": 0}
+    return result
+
+
+def scalar_fractal(fractal, x, y):
+    # fractal value of one pixel with the noise package, as landcreator used to compute it
+    import noise
+    value = 0.0
+    for freq, amp in fractal.layers:
+        value += amp * noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=fractal.repeat, repeaty=fractal.repeat, base=fractal.seed)
+    return (value / fractal.amp_normalizer) * 0.5 + 0.5
+
+
+def classify_terrain(topography, slopes, temperature, humidity, noise_array):
+    # all the terrain data in one pass:
+    # terrain7 weights, terrain5 indices and blend factors, and the count of bad pixels
+    weights, bad_alpha = main.calculate_alpha_weights(topography, slopes, temperature, humidity, noise_array)
+    indices, blend_factors, bad_bld = main.calculate_bld_data(slopes, temperature, humidity)
+    return weights, indices, blend_factors, bad_alpha + bad_bld
+
+
+def check_references(directory, size, samples):
+    # largest differences between array and scalar implementations over sample
+    # pixels; None for the checks that can not run here
+    setup(directory, size, False)
+    rng = numpy.random.default_rng(0)
+    xs, ys = rng.integers(0, size, samples), rng.integers(0, size, samples)
+    checks = dict()
+    # fractal noise, against the noise package if installed
+    try:
+        import noise
+    except ImportError:
+        logging.warning("noise package not installed, fractal noise not checked")
+        checks["fractal"] = None
+    else:
+        error = 0.0
+        for section, repeat, horiz_scale in (("noise", 32, 1.0), ("topography", 1024, main.noise_horiz_scale)):
+            fractal = fbm.Fractal.from_config(main.config[section], repeat, horiz_scale)
+            for x, y in zip(xs, ys):
+                value = fractal.sample(numpy.array([x]), numpy.array([y]))[0, 0]
+                error = max(error, abs(value - scalar_fractal(fractal, float(x), float(y))))
+        checks["fractal"] = {"error": error, "tolerance": fbm.NoiseTolerance}
+    # terrain classification, against calculate_data_bld and calculate_data_alpha
+    topography = main.load_data(main.TopoDataFileName)[xs, ys]
+    slopes = main.generate_slopes_data(main.load_data(main.NormalsDataFileName)[xs, ys])
+    temperature = main.load_data(main.TempDataFileName)[xs, ys]
+    humidity = main.load_data(main.HumidityDataFileName)[xs, ys]
+    noise_array = main.load_data(main.NoiseDataFileName)[xs, ys]
+    weights, indices, blend_factors, bad = classify_terrain(topography, slopes, temperature, humidity, noise_array)
+    bld_error, alpha_error = 0.0, 0.0
+    for i in range(samples):
+        scalar_indices, scalar_factor = main.calculate_data_bld(topography[i], slopes[i], temperature[i], humidity[i])
+        bld_error = max(bld_error, abs(scalar_indices - indices[i]), abs(scalar_factor - int(255 * blend_factors[i])))
+        scalar_weights = main.calculate_data_alpha(topography[i], slopes[i], temperature[i], humidity[i], noise_array[i])
+        alpha_error = max(alpha_error, numpy.abs(scalar_weights - 255 * weights[i]).max())
+    checks["bld"] = {"error": float(bld_error), "tolerance": 0.0}
+    checks["alpha"] = {"error": float(alpha_error), "tolerance": 1e-9}
+    return checks
+
+
+def compare(results, baseline, threshold):
+    # stages slower than in baseline by more than threshold
+    previous = {(r["size"], r["stage"]): r for r in baseline["results"]}
+    regressions = list()
+    for result in results:
+        base = previous.get((result["size"], result["stage"]))
+        if base is None or base["seconds"] <= 0.0:
+            continue
+        ratio = result["seconds"] / base["seconds"]
+        if ratio > 1.0 + threshold:
+            regressions.append("%s at %i: %.3fs, baseline %.3fs (x%.2f)" % (result["stage"], result["size"], result["seconds"], base["seconds"], ratio))
+    return regressions
+
+
+def execute():
+    print("Land Creator benchmark")
+    logging.basicConfig(level=logging.INFO)
+    argp = argparse.ArgumentParser()
+    argp.add_argument('-s', '--sizes', default=",".join(str(size) for size in BenchSizes), help='comma separated land sizes')
+    argp.add_argument('--large', action='store_true', help='add size %i' % BenchLargeSize)
+    argp.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes of each stage')
+    argp.add_argument('--out-of-core', action='store_true', help='run the stages in out-of-core mode')
+    argp.add_argument('-o', '--output', default="benchmark.json", help='results file')
+    argp.add_argument('-b', '--baseline', default=BaselineFileName, help='results file of a previous run to compare with, "none" not to compare')
+    argp.add_argument('-t', '--threshold', type=float, default=BenchThreshold, help='slowdown over the baseline that fails, 0.25 is 25%%')
+    argp.add_argument('--samples', type=int, default=BenchSamples, help='pixels checked against the reference implementations')
+    argp.add_argument('--keep', action='store_true', help='keep the generated lands')
+    args = argp.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if args.large:
+        sizes.append(BenchLargeSize)
+    baseline = None
+    if args.baseline and args.baseline != "none":
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except Exception as e:
+            logging.exception(str(e))
+            sys.exit(1)
+        logging.info("baseline: " + args.baseline)
+    #
+    report = {"environment": {"python": platform.python_version(), "numpy": numpy.__version__,
+                              "machine": platform.machine(), "cpus": os.cpu_count(),
+                              "workers": args.workers, "out_of_core": args.out_of_core},
+              "results": list(),
+              "references": None}
+    if baseline is not None and baseline.get("environment") != report["environment"]:
+        logging.warning("baseline measured in another environment: %s" % json.dumps(baseline.get("environment")))
+    failed = False
+    for size in sizes:
+        directory = tempfile.mkdtemp(prefix="landcreator_bench_%i_" % size)
+        for name in BenchStages:
+            result = bench_stage(directory, size, name, args.workers, args.out_of_core)
+            if not result["success"]:
+                logging.error("%s failed at %i" % (name, size))
+                failed = True
+                break
+            result = {"size": size, "stage": name, "seconds": result["seconds"],
+                      "pixels_per_second": size * size / max(result["seconds"], 1e-9), "peak_rss_kb": result["peak_rss_kb"]}
+            logging.info("%i %s: %.3fs %.0f px/s %i KB" % (size, name, result["seconds"], result["pixels_per_second"], result["peak_rss_kb"]))
+            report["results"].append(result)
+        # reference checks on the smallest land
+        if report["references"] is None and not failed:
+            report["references"] = check_references(directory, size, min(args.samples, size * size))
+            for check, values in report["references"].items():
+                if values is not None and values["error"] > values["tolerance"]:
+                    logging.error("%s differs from the reference implementation by %g" % (check, values["error"]))
+                    failed = True
+        if args.keep:
+            logging.info("land kept in " + directory)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+        if failed:
+            break
+    # baseline
+    if baseline is not None:
+        regressions = compare(report["results"], baseline, args.threshold)
+        for regression in regressions:
+            logging.error("regression: " + regression)
+        failed = failed or len(regressions) > 0
+    #
+    logging.info("save results: " + args.output)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    execute()
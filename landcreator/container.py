@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# single file container of the layers of a land. layout:
+#   header, 64 bytes: magic, version, table offset and table length
+#   payloads, each one starting at a multiple of Alignment bytes
+#   layer table, json: name, kind, dtype, shape, offset, length, compression,
+#   quantization range and attributes of every layer
+# array layers are stored row major, quantized to unsigned integers if asked
+# (value = min + q * (max - min) / qmax) and compressed with zlib if asked;
+# file layers are the bytes of a file. the container is memory mapped by
+# Container, the uncompressed array layers are read (whole or a sub-rectangle)
+# without copies.
+
+import json
+import os
+import struct
+import zlib
+import numpy
+
+Magic = b"LANDPACK"
+Version = 1
+Alignment = 64
+# magic, version, table offset, table length
+_HEADER = struct.Struct("<8sIQQ")
+
+Quantizations = {"none": None, "uint8": numpy.dtype(numpy.uint8), "uint16": numpy.dtype("<u2")}
+Compressions = ["none", "zlib"]
+
+
+def _pad(file):
+    file.write(b"\x00" * (-file.tell() % Alignment))
+
+
+def _quantize(band, dtype, valmin, valmax):
+    qmax = numpy.iinfo(dtype).max
+    amp = 0.0 if valmax == valmin else qmax / (valmax - valmin)
+    return numpy.rint((band - valmin) * amp).astype(dtype)
+
+
+class Writer:
+
+    def __init__(self, file_path):
+        # the container is written to a temporary file, that replaces file_path on close
+        self.file_path = file_path
+        self.temp_path = file_path + ".tmp"
+        self.file = open(self.temp_path, "wb")
+        self.file.write(b"\x00" * Alignment)
+        self.table = list()
+
+    def add_array(self, name, array, quantization="none", compression="none", band_rows=256, attributes=None):
+        # array written in bands of rows
+        if quantization not in Quantizations or compression not in Compressions:
+            raise ValueError("unknown quantization %s or compression %s" % (quantization, compression))
+        dtype = Quantizations[quantization] or numpy.dtype(array.dtype).newbyteorder("<")
+        entry = {"name": name, "kind": "array", "dtype": dtype.str, "source_dtype": numpy.dtype(array.dtype).str, "shape": list(array.shape),
+                 "compression": compression, "range": None, "attributes": attributes or dict()}
+        if Quantizations[quantization] is not None:
+            valmin, valmax = float(numpy.min(array)), float(numpy.max(array))
+            entry["range"] = [valmin, valmax]
+        _pad(self.file)
+        entry["offset"] = self.file.tell()
+        compressor = zlib.compressobj() if compression == "zlib" else None
+        for x0 in range(0, array.shape[0], band_rows):
+            band = array[x0:x0 + band_rows]
+            if entry["range"] is not None:
+                band = _quantize(band, dtype, *entry["range"])
+            data = numpy.ascontiguousarray(band, dtype=dtype).tobytes()
+            self.file.write(compressor.compress(data) if compressor else data)
+        if compressor:
+            self.file.write(compressor.flush())
+        entry["length"] = self.file.tell() - entry["offset"]
+        self.table.append(entry)
+
+    def add_file(self, name, file_path, attributes=None):
+        with open(file_path, "rb") as file:
+            self.add_bytes(name, file.read(), attributes)
+
+    def add_bytes(self, name, data, attributes=None):
+        _pad(self.file)
+        self.table.append({"name": name, "kind": "file", "offset": self.file.tell(), "length": len(data),
+                           "attributes": attributes or dict()})
+        self.file.write(data)
+
+    def close(self):
+        try:
+            _pad(self.file)
+            table = json.dumps({"layers": self.table}).encode()
+            offset = self.file.tell()
+            self.file.write(table)
+            self.file.seek(0)
+            self.file.write(_HEADER.pack(Magic, Version, offset, len(table)))
+        finally:
+            self.file.close()
+        os.replace(self.temp_path, self.file_path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+
+class Container:
+
+    def __init__(self, file_path):
+        self.buffer = numpy.memmap(file_path, dtype=numpy.uint8, mode='r')
+        magic, version, offset, length = _HEADER.unpack(self.buffer[:_HEADER.size].tobytes())
+        if magic != Magic or version != Version:
+            raise ValueError("not a land container of version %i: %s" % (Version, file_path))
+        self.layers = {entry["name"]: entry for entry in json.loads(self.buffer[offset:offset + length].tobytes())["layers"]}
+        self.decompressed = dict()
+
+    def raw(self, name, rows=slice(None), cols=slice(None)):
+        # stored values of an array layer or of a sub-rectangle of it, a view of
+        # the mapped file if the layer is not compressed
+        entry = self.layers[name]
+        if entry["kind"] != "array":
+            raise ValueError("%s is not an array layer" % name)
+        dtype = numpy.dtype(entry["dtype"])
+        if entry["compression"] == "none":
+            array = numpy.ndarray(entry["shape"], dtype=dtype, buffer=self.buffer, offset=entry["offset"])
+        else:
+            if name not in self.decompressed:
+                data = zlib.decompress(self.buffer[entry["offset"]:entry["offset"] + entry["length"]])
+                self.decompressed[name] = numpy.frombuffer(data, dtype=dtype).reshape(entry["shape"])
+            array = self.decompressed[name]
+        return array[rows, cols]
+
+    def read(self, name, rows=slice(None), cols=slice(None), dtype=None):
+        # values of an array layer or of a sub-rectangle of it, dequantized to
+        # dtype or to the type of the array stored
+        entry = self.layers[name]
+        raw = self.raw(name, rows, cols)
+        dtype = numpy.dtype(dtype or entry["source_dtype"])
+        if entry["range"] is None:
+            return raw if raw.dtype == dtype else raw.astype(dtype)
+        valmin, valmax = entry["range"]
+        values = raw.astype(dtype)
+        values *= (valmax - valmin) / numpy.iinfo(raw.dtype).max
+        values += valmin
+        return values
+
+    def file(self, name):
+        # bytes of a file layer
+        entry = self.layers[name]
+        return self.buffer[entry["offset"]:entry["offset"] + entry["length"]].tobytes()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# block compressed DDS textures with their mip chains. images are encoded a
+# band of 4-row blocks at a time, all the blocks of the band at once:
+#   bc1 (DXT1), 8 bytes per block: rgb endpoints in 565 and 2 bit indices;
+#     endpoints are the ends of the block colors along their principal axis,
+#     refined by least squares for the indices they give
+#   bc3 (DXT5), 16 bytes per block: alpha as a bc4 block, and rgb as bc1
+#   bc4 (ATI1), 8 bytes per block: a single channel, endpoints the minimum and
+#     the maximum of the block and 3 bit indices to 8 levels between them
+#   bc5 (ATI2), 16 bytes per block: two channels as bc4 blocks
+# sizes need not be multiples of 4, the last row and column of pixels are
+# repeated to fill the blocks. every mip level is half the size (rounded down)
+# of the one before, down to 1x1, a box filter of its 2x2 pixels.
+
+import struct
+import numpy
+
+# format: fourcc, bytes per block, channels
+Formats = {"bc1": (b"DXT1", 8, 3),
+           "bc3": (b"DXT5", 16, 4),
+           "bc4": (b"ATI1", 8, 1),
+           "bc5": (b"ATI2", 16, 2)}
+
+# flags of the header: caps, height, width, pixel format, mipmap count, linear size
+_FLAGS = 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000
+# caps: complex, texture, mipmap
+_CAPS = 0x8 | 0x1000 | 0x400000
+_FOURCC = 0x4
+# magic, size, flags, height, width, linear size, depth, mipmap count, 11 reserved,
+# pixel format (size, flags, fourcc, bit count and 4 masks), caps, caps2, caps3, caps4, reserved
+_HEADER = struct.Struct("<4s7I44x2I4s5I5I")
+
+# iterations of the principal axis of the colors of bc1 blocks
+PowerIterations = 8
+
+_StepIndices = numpy.array([0, 2, 3, 1])
+_BC1 = numpy.dtype([("c0", "<u2"), ("c1", "<u2"), ("indices", "<u4")])
+
+
+def level_sizes(width, height):
+    # (width, height) of every mip level, the first one included
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width, height = max(1, width // 2), max(1, height // 2)
+        sizes.append((width, height))
+    return sizes
+
+
+def downsample(image):
+    # next mip level of an image (rows, cols) or (rows, cols, channels)
+    rows, cols = max(1, image.shape[0] // 2), max(1, image.shape[1] // 2)
+    x = numpy.arange(2 * rows).clip(0, image.shape[0] - 1)
+    y = numpy.arange(2 * cols).clip(0, image.shape[1] - 1)
+    pixels = image[numpy.ix_(x, y)].astype(numpy.float32)
+    pixels = pixels.reshape((rows, 2, cols, 2) + image.shape[2:]).mean(axis=(1, 3))
+    return numpy.rint(pixels).astype(numpy.uint8)
+
+
+def header(format, width, height, levels):
+    fourcc, block_bytes, channels = Formats[format]
+    linear_size = ((width + 3) // 4) * ((height + 3) // 4) * block_bytes
+    return _HEADER.pack(b"DDS ", 124, _FLAGS, height, width, linear_size, 0, levels,
+                        32, _FOURCC, fourcc, 0, 0, 0, 0, 0, _CAPS, 0, 0, 0, 0)
+
+
+def blocks(pixels):
+    # (n, 16, channels) blocks of the rows of an image, row by row and left to
+    # right, the last row and column of pixels repeated to fill them
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    rows, cols = -(-pixels.shape[0] // 4), -(-pixels.shape[1] // 4)
+    x = numpy.arange(4 * rows).clip(0, pixels.shape[0] - 1)
+    y = numpy.arange(4 * cols).clip(0, pixels.shape[1] - 1)
+    pixels = pixels[numpy.ix_(x, y)]
+    pixels = pixels.reshape((rows, 4, cols, 4, pixels.shape[-1])).transpose(0, 2, 1, 3, 4)
+    return pixels.reshape((rows * cols, 16, pixels.shape[-1]))
+
+
+def _quantize565(colors):
+    # packed 565 of (n, 3) colors in [0, 255]
+    scale = numpy.array([31, 63, 31], dtype=numpy.float32) / 255
+    channels = numpy.rint(numpy.clip(colors, 0, 255) * scale).astype(numpy.uint32)
+    return (channels[:, 0] << 11) | (channels[:, 1] << 5) | channels[:, 2]
+
+
+def _expand565(packed):
+    r = (packed >> 11) & 31
+    g = (packed >> 5) & 63
+    b = packed & 31
+    return numpy.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1).astype(numpy.float32)
+
+
+def _fit_bc1(colors, high, low):
+    # endpoints in 565 (c0 >= c1), indices and squared error of every block,
+    # given its ends of the line of colors
+    c0, c1 = _quantize565(high), _quantize565(low)
+    swap = c0 < c1
+    c0, c1 = numpy.where(swap, c1, c0), numpy.where(swap, c0, c1)
+    e0, e1 = _expand565(c0), _expand565(c1)
+    # the palette is on a line, the nearest color is the nearest step along it
+    line = e1 - e0
+    length = numpy.maximum(numpy.einsum("ni,ni->n", line, line), 1e-6)
+    offsets = colors - e0[:, None, :]
+    steps = numpy.rint(numpy.clip(numpy.einsum("nki,ni->nk", offsets, line) / length[:, None], 0.0, 1.0) * 3)
+    offsets -= (steps / 3)[..., None] * line[:, None, :]
+    error = numpy.einsum("nki,nki->n", offsets, offsets)
+    # steps from e0 to e1 are indices 0, 2, 3 and 1
+    indices = _StepIndices[steps.astype(numpy.intp)]
+    indices[c0 == c1] = 0
+    return c0, c1, indices, error
+
+
+def encode_bc1(colors):
+    # bc1 blocks of (n, 16, 3) colors, in 4 color mode (c0 > c1) or of a single
+    # color: the ends of the colors along their principal axis, refined once by
+    # least squares for the indices they give
+    colors = colors.astype(numpy.float32)
+    mean = numpy.einsum("nki->ni", colors) / 16
+    centered = colors - mean[:, None, :]
+    covariance = numpy.matmul(centered.transpose(0, 2, 1), centered)
+    # principal axis by power iteration, from the channel of largest variance
+    axis = numpy.eye(3, dtype=numpy.float32)[numpy.einsum("nii->ni", covariance).argmax(axis=1)]
+    for i in range(PowerIterations):
+        axis = numpy.einsum("nij,nj->ni", covariance, axis)
+        axis /= numpy.maximum(numpy.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    projection = numpy.einsum("nki,ni->nk", centered, axis)
+    high = mean + axis * projection.max(axis=1)[:, None]
+    low = mean + axis * projection.min(axis=1)[:, None]
+    c0, c1, indices, error = _fit_bc1(colors, high, low)
+    # least squares ends for the indices: the weights of c0 by index
+    w0 = numpy.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=numpy.float32)[indices]
+    w1 = 1.0 - w0
+    a, b, c = numpy.einsum("nk,nk->n", w0, w0), numpy.einsum("nk,nk->n", w0, w1), numpy.einsum("nk,nk->n", w1, w1)
+    determinant = a * c - b * b
+    solvable = determinant > 1e-6
+    determinant[~solvable] = 1.0
+    x0, x1 = numpy.einsum("nk,nki->ni", w0, colors), numpy.einsum("nk,nki->ni", w1, colors)
+    refined = _fit_bc1(colors, (c[:, None] * x0 - b[:, None] * x1) / determinant[:, None],
+                       (a[:, None] * x1 - b[:, None] * x0) / determinant[:, None])
+    better = solvable & (refined[3] < error)
+    c0, c1, indices = [numpy.where(better[(slice(None),) + (None,) * (r.ndim - 1)], r, o)
+                       for r, o in zip(refined[:3], (c0, c1, indices))]
+    out = numpy.empty(len(colors), dtype=_BC1)
+    out["c0"], out["c1"] = c0, c1
+    out["indices"] = (indices.astype(numpy.uint32) << (2 * numpy.arange(16, dtype=numpy.uint32))).sum(axis=1, dtype=numpy.uint32)
+    return out.view(numpy.uint8).reshape((-1, 8))
+
+
+def encode_bc4(values):
+    # bc4 blocks of (n, 16) values, in 8 level mode (a0 > a1) or of a single value
+    values = values.astype(numpy.float32)
+    a1, a0 = values.min(axis=1), values.max(axis=1)
+    span = numpy.maximum(a0 - a1, 1e-6)
+    level = numpy.rint((values - a1[:, None]) / span[:, None] * 7).astype(numpy.uint64)
+    # level 7 is a0 (code 0), level 0 is a1 (code 1), levels 6 to 1 codes 2 to 7
+    codes = numpy.where(level == 7, 0, numpy.where(level == 0, 1, 8 - level)).astype(numpy.uint64)
+    codes[a0 == a1] = 0
+    bits = (codes << (3 * numpy.arange(16, dtype=numpy.uint64))).sum(axis=1, dtype=numpy.uint64)
+    out = numpy.empty((len(values), 8), dtype=numpy.uint8)
+    out[:, 0], out[:, 1] = a0, a1
+    out[:, 2:] = bits.astype("<u8").view(numpy.uint8).reshape((-1, 8))[:, :6]
+    return out
+
+
+def encode(pixels, format):
+    # bytes of the blocks of the rows of an image
+    block = blocks(pixels)
+    if format == "bc1":
+        data = encode_bc1(block[..., 0:3])
+    elif format == "bc3":
+        data = numpy.concatenate((encode_bc4(block[..., 3]), encode_bc1(block[..., 0:3])), axis=1)
+    elif format == "bc4":
+        data = encode_bc4(block[..., 0])
+    elif format == "bc5":
+        data = numpy.concatenate((encode_bc4(block[..., 0]), encode_bc4(block[..., 1])), axis=1)
+    else:
+        raise ValueError("unknown block compression format " + format)
+    return data.tobytes()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# exact euclidean distance transform of a grid, to the nearest of its feature
+# pixels, in linear time (Felzenszwalb and Huttenlocher, distance transforms of
+# sampled functions): the distance along every column to the nearest feature
+# of the column, and then, along every row, the lower envelope of the parabolas
+# (y - j)^2 + g(j)^2 of the column distances g. both passes are vectorized over
+# the lines: the columns of a block at once, and the rows of a band at once,
+# the envelopes of all of them built a column at a time. squared distances are
+# integers, so they are exact whatever the blocks of columns and bands of rows.
+
+import numpy
+
+
+def column_distances(features, far):
+    # distance along axis 0 to the nearest feature of each column, far for the
+    # columns without features
+    rows = features.shape[0]
+    index = numpy.arange(rows, dtype=numpy.int64)[:, None]
+    before = numpy.where(features, index, -far)
+    numpy.maximum.accumulate(before, axis=0, out=before)
+    after = numpy.where(features, index, rows + far)
+    after = numpy.minimum.accumulate(after[::-1], axis=0)[::-1]
+    return numpy.minimum(numpy.minimum(index - before, after - index), far)
+
+
+def row_envelope(g):
+    # squared distances of a band of rows (lines, n) from their column distances
+    lines, n = g.shape
+    f = g.astype(numpy.float64)
+    f *= f
+    flat = f.reshape(-1)
+    base = numpy.arange(lines) * n
+    line = numpy.arange(lines)
+    # parabolas of the envelope of every line (positions v) and where they start (z)
+    v = numpy.zeros((lines, n), dtype=numpy.int64)
+    z = numpy.empty((lines, n + 1))
+    z[:, 0] = -numpy.inf
+    z[:, 1] = numpy.inf
+    k = numpy.zeros(lines, dtype=numpy.int64)
+    for q in range(1, n):
+        fq = f[:, q] + q * q
+        while True:
+            vk = v[line, k]
+            s = (fq - (flat[base + vk] + vk * vk)) / (2 * (q - vk))
+            hidden = s <= z[line, k]
+            if not hidden.any():
+                break
+            k -= hidden
+        k += 1
+        v[line, k] = q
+        z[line, k] = s
+        z[line, k + 1] = numpy.inf
+    # minimum of the envelope at every column
+    out = numpy.empty((lines, n))
+    k[:] = 0
+    for q in range(n):
+        while True:
+            ahead = z[line, k + 1] < q
+            if not ahead.any():
+                break
+            k += ahead
+        vk = v[line, k]
+        out[:, q] = (q - vk) ** 2 + flat[base + vk]
+    return out
+
+
+def transform(features):
+    # distance of every pixel to the nearest feature, the whole grid at once
+    far = sum(features.shape)
+    return numpy.sqrt(row_envelope(column_distances(features, far)))
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# grid based erosion, as whole array updates. the state of a grid is a
+# (Channels, rows, cols) float32 array: terrain and water heights, suspended
+# sediment and the outflow flux to the 4 neighbors of every cell, heights in
+# cells. hydraulic erosion follows the virtual pipes model (Mei et al., fast
+# hydraulic erosion simulation and visualization on GPU): rain, water flowing
+# down the differences of water surface, sediment dissolved or deposited
+# against the capacity of the flow and carried back along the velocity field,
+# and evaporation; thermal erosion moves the material above the talus slope to
+# the lower neighbors. a cell of an iteration depends on the cells up to
+# Radius cells around it at the iteration before, so a band of rows with
+# Radius * n rows more on each side (the halo) gives the band after n
+# iterations as the whole grid would; the edges of the grid are walls.
+
+import numpy
+
+# channels of the state
+Terrain = 0
+Water = 1
+Sediment = 2
+# outflow flux to the row before and after, and to the column before and after
+Flux = slice(3, 7)
+Channels = 7
+
+# cells around a cell its next iteration depends on
+Radius = 4
+
+# fraction of the water surface difference flowing through a pipe per iteration
+PipeRate = 0.25
+# sine of the tilt below which the flow carries as if it were that steep, so
+# flat terrain still erodes a little
+MinTilt = 0.01
+
+
+def _shift(array, axis, step, edge):
+    # values of the neighbor step (-1 or 1) cells away along axis (0 or 1), the
+    # edge cells repeated or 0 out of the array
+    out = numpy.empty_like(array)
+    src = [slice(None), slice(None)]
+    dst = [slice(None), slice(None)]
+    border = [slice(None), slice(None)]
+    if step < 0:
+        dst[axis], src[axis], border[axis] = slice(1, None), slice(None, -1), slice(0, 1)
+    else:
+        dst[axis], src[axis], border[axis] = slice(None, -1), slice(1, None), slice(-1, None)
+    out[tuple(dst)] = array[tuple(src)]
+    out[tuple(border)] = array[tuple(border)] if edge else 0.0
+    return out
+
+
+def _neighbors(array, edge=True):
+    # values of the row before and after and of the column before and after
+    return (_shift(array, 0, -1, edge), _shift(array, 0, 1, edge),
+            _shift(array, 1, -1, edge), _shift(array, 1, 1, edge))
+
+
+def hydraulic_step(state, rain, evaporation, capacity, dissolving, deposition):
+    terrain, water, sediment, flux = state[Terrain], state[Water], state[Sediment], state[Flux]
+    # rain
+    water += rain
+    # outflow flux, down the difference of water surface, scaled to the water there is
+    surface = terrain + water
+    for f, neighbor in zip(flux, _neighbors(surface)):
+        f += PipeRate * (surface - neighbor)
+        numpy.maximum(f, 0.0, out=f)
+    outflow = flux.sum(axis=0)
+    scale = numpy.minimum(1.0, water / numpy.maximum(outflow, 1e-12))
+    flux *= scale
+    outflow *= scale
+    # inflow, the outflow of the neighbors towards each cell
+    from_before_row = _shift(flux[1], 0, -1, False)
+    from_after_row = _shift(flux[0], 0, 1, False)
+    from_before_col = _shift(flux[3], 1, -1, False)
+    from_after_col = _shift(flux[2], 1, 1, False)
+    depth = water.copy()
+    water += from_before_row + from_after_row + from_before_col + from_after_col - outflow
+    numpy.maximum(water, 0.0, out=water)
+    # velocity, cells per iteration, from the water through each cell
+    depth += water
+    depth *= 0.5
+    depth = numpy.maximum(depth, 1e-6)
+    u = numpy.clip((from_before_row - flux[0] + flux[1] - from_after_row) * 0.5 / depth, -1.0, 1.0)
+    v = numpy.clip((from_before_col - flux[2] + flux[3] - from_after_col) * 0.5 / depth, -1.0, 1.0)
+    del from_before_row, from_after_row, from_before_col, from_after_col, depth, outflow, surface
+    # sediment dissolved where the flow carries less than its capacity, deposited otherwise
+    before_row, after_row, before_col, after_col = _neighbors(terrain)
+    gx = (after_row - before_row) * 0.5
+    gy = (after_col - before_col) * 0.5
+    del before_row, after_row, before_col, after_col
+    gradient = gx * gx + gy * gy
+    tilt = numpy.maximum(numpy.sqrt(gradient / (1.0 + gradient)), MinTilt)
+    carried = capacity * tilt * numpy.sqrt(u * u + v * v)
+    del gx, gy, gradient, tilt
+    change = numpy.where(carried > sediment, dissolving * (carried - sediment), deposition * (carried - sediment))
+    terrain -= change
+    sediment += change
+    del carried, change
+    # sediment carried along the velocity, a bilinear sample of the cell and of
+    # its neighbors the flow comes from
+    ax, ay = numpy.abs(u), numpy.abs(v)
+    back_row, back_col = u > 0, v > 0
+    del u, v
+    row_before, row_after = _shift(sediment, 0, -1, True), _shift(sediment, 0, 1, True)
+    sx = numpy.where(back_row, row_before, row_after)
+    sy = numpy.where(back_col, _shift(sediment, 1, -1, True), _shift(sediment, 1, 1, True))
+    sxy = numpy.where(back_col,
+                      numpy.where(back_row, _shift(row_before, 1, -1, True), _shift(row_after, 1, -1, True)),
+                      numpy.where(back_row, _shift(row_before, 1, 1, True), _shift(row_after, 1, 1, True)))
+    del row_before, row_after
+    sediment[...] = (1.0 - ax) * ((1.0 - ay) * sediment + ay * sy) + ax * ((1.0 - ay) * sx + ay * sxy)
+    # evaporation
+    water *= 1.0 - evaporation
+
+
+def thermal_step(terrain, talus, rate):
+    # the material over the talus slope (height per cell) slides to the lower
+    # neighbors, half of the largest excess times rate, shared by their excess
+    neighbors = _neighbors(terrain)
+    excess = numpy.stack([numpy.maximum(terrain - neighbor - talus, 0.0) for neighbor in neighbors])
+    del neighbors
+    total = excess.sum(axis=0)
+    moved = rate * 0.5 * excess.max(axis=0)
+    numpy.divide(moved, total, out=moved, where=total > 0)
+    excess *= moved
+    terrain -= excess.sum(axis=0)
+    # what each cell receives, from the neighbors that moved material towards it
+    terrain += _shift(excess[1], 0, -1, False)
+    terrain += _shift(excess[0], 0, 1, False)
+    terrain += _shift(excess[3], 1, -1, False)
+    terrain += _shift(excess[2], 1, 1, False)
+
+
+def simulate(state, iterations, rain, evaporation, capacity, dissolving, deposition, talus, thermal_rate):
+    # iterations of hydraulic and thermal erosion of state, in place
+    for i in range(iterations):
+        hydraulic_step(state, rain, evaporation, capacity, dissolving, deposition)
+        thermal_step(state[Terrain], talus, thermal_rate)
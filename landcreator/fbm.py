@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# vectorized fractal noise, evaluates whole grids (or row blocks) at once.
+#
+# it is a port of the code path taken by the calls landcreator used to do per
+# pixel, snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=seed)
+# from the noise package (1.2.x): with repeatx and repeaty given, the 2D point
+# is wrapped around a torus with fast_sin/fast_cos and sampled with 4D simplex
+# noise. all the intermediate math is done in float32 like the C code, so
+# values match the scalar calls within NoiseTolerance (in practice they are
+# equal, the tolerance covers compilers contracting float ops differently).
+
+import numpy
+
+NoiseTolerance = 1e-6
+
+# tables from noise/_noise.h
+_PERM = numpy.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225, 140,
+    36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148, 247, 120,
+    234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32, 57, 177, 33,
+    88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175, 74, 165, 71,
+    134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122, 60, 211, 133,
+    230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54, 65, 25, 63, 161,
+    1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169, 200, 196, 135, 130,
+    116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64, 52, 217, 226, 250,
+    124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212, 207, 206, 59, 227,
+    47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213, 119, 248, 152, 2, 44,
+    154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9, 129, 22, 39, 253, 19, 98,
+    108, 110, 79, 113, 224, 232, 178, 185, 112, 104, 218, 246, 97, 228, 251, 34,
+    242, 193, 238, 210, 144, 12, 191, 179, 162, 241, 81, 51, 145, 235, 249, 14,
+    239, 107, 49, 192, 214, 31, 181, 199, 106, 157, 184, 84, 204, 176, 115, 121,
+    50, 45, 127, 4, 150, 254, 138, 236, 205, 93, 222, 114, 67, 29, 24, 72, 243,
+    141, 128, 195, 78, 66, 215, 61, 156, 180] * 2, dtype=numpy.intp)
+
+_GRAD4 = numpy.array([
+    (0, 1, 1, 1), (0, 1, 1, -1), (0, 1, -1, 1), (0, 1, -1, -1),
+    (0, -1, 1, 1), (0, -1, 1, -1), (0, -1, -1, 1), (0, -1, -1, -1),
+    (1, 0, 1, 1), (1, 0, 1, -1), (1, 0, -1, 1), (1, 0, -1, -1),
+    (-1, 0, 1, 1), (-1, 0, 1, -1), (-1, 0, -1, 1), (-1, 0, -1, -1),
+    (1, 1, 0, 1), (1, 1, 0, -1), (1, -1, 0, 1), (1, -1, 0, -1),
+    (-1, 1, 0, 1), (-1, 1, 0, -1), (-1, -1, 0, 1), (-1, -1, 0, -1),
+    (1, 1, 1, 0), (1, 1, -1, 0), (1, -1, 1, 0), (1, -1, -1, 0),
+    (-1, 1, 1, 0), (-1, 1, -1, 0), (-1, -1, 1, 0), (-1, -1, -1, 0)], dtype=numpy.float32)
+
+_SIMPLEX = numpy.array([
+    (0, 1, 2, 3), (0, 1, 3, 2), (0, 0, 0, 0), (0, 2, 3, 1), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0),
+    (1, 2, 3, 0), (0, 2, 1, 3), (0, 0, 0, 0), (0, 3, 1, 2), (0, 3, 2, 1), (0, 0, 0, 0), (0, 0, 0, 0),
+    (0, 0, 0, 0), (1, 3, 2, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0),
+    (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (1, 2, 0, 3), (0, 0, 0, 0), (1, 3, 0, 2), (0, 0, 0, 0),
+    (0, 0, 0, 0), (0, 0, 0, 0), (2, 3, 0, 1), (2, 3, 1, 0), (1, 0, 2, 3), (1, 0, 3, 2), (0, 0, 0, 0),
+    (0, 0, 0, 0), (0, 0, 0, 0), (2, 0, 3, 1), (0, 0, 0, 0), (2, 1, 3, 0), (0, 0, 0, 0), (0, 0, 0, 0),
+    (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (2, 0, 1, 3),
+    (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (3, 0, 1, 2), (3, 0, 2, 1), (0, 0, 0, 0), (3, 1, 2, 0),
+    (2, 1, 0, 3), (0, 0, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0), (3, 1, 0, 2), (0, 0, 0, 0), (3, 2, 0, 1),
+    (3, 2, 1, 0)], dtype=numpy.int32)
+
+_F4 = numpy.float32(0.30901699437494745)
+_G4 = numpy.float32(0.1381966011250105)
+_ONE = numpy.float32(1.0)
+_SIX_TENTHS = numpy.float32(0.6)
+
+
+def read_layers(section):
+    # perlin_layer_0, perlin_layer_1, ... until the first missing one
+    layers = list()
+    i_layer = 0
+    while True:
+        var_name = "perlin_layer_%i" % i_layer
+        if var_name not in section:
+            break
+        freq, amp = section.get(var_name).split()
+        layers.append((float(freq), float(amp)))
+        i_layer += 1
+    return layers
+
+
+def _fast_sin(x):
+    # x in half turns, same wrap and polynomial as noise/_noise.h
+    magic = numpy.float32(25165824.0)
+    x = x - ((x + magic) - magic)
+    y = x - x * numpy.abs(x)
+    return y * (numpy.float32(3.1) + numpy.float32(3.6) * numpy.abs(y))
+
+
+def _torus(coord, repeat, base):
+    # maps 1D coordinates onto a circle, returns (position, offset) as the
+    # tiled branch of snoise2 does for each axis
+    coord = numpy.asarray(coord, dtype=numpy.float32)
+    repeat = numpy.float32(repeat)
+    turns = (coord.astype(numpy.float64) * 2.0 / numpy.float64(repeat)).astype(numpy.float32)
+    radius = numpy.float32(numpy.float64(repeat) * (1.0 / numpy.pi) * 0.5)
+    position = _fast_sin(turns) * radius
+    offset = numpy.float32(base) + _fast_sin(turns + numpy.float32(0.5)) * radius
+    return position, offset
+
+
+def _corner(i, j, k, l, x, y, z, w):
+    gi = _PERM[i + _PERM[j + _PERM[k + _PERM[l]]]] & 0x1f
+    grad = _GRAD4[gi]
+    t = _SIX_TENTHS - x * x - y * y - z * z - w * w
+    numpy.maximum(t, 0.0, out=t)
+    t *= t
+    return t * t * (grad[..., 0] * x + grad[..., 1] * y + grad[..., 2] * z + grad[..., 3] * w)
+
+
+def noise4(x, y, z, w):
+    # 4D simplex noise over float32 arrays (broadcastable)
+    s = (x + y + z + w) * _F4
+    i = numpy.floor(x + s)
+    j = numpy.floor(y + s)
+    k = numpy.floor(z + s)
+    l = numpy.floor(w + s)
+    t = (i + j + k + l) * _G4
+    x0 = x - (i - t)
+    y0 = y - (j - t)
+    z0 = z - (k - t)
+    w0 = w - (l - t)
+    I = i.astype(numpy.intp) & 255
+    J = j.astype(numpy.intp) & 255
+    K = k.astype(numpy.intp) & 255
+    L = l.astype(numpy.intp) & 255
+    del s, i, j, k, l, t
+    c = (x0 > y0) * 32 + (x0 > z0) * 16 + (y0 > z0) * 8 + (x0 > w0) * 4 + (y0 > w0) * 2 + (z0 > w0)
+    simplex = _SIMPLEX[c]
+    del c
+    total = _corner(I, J, K, L, x0, y0, z0, w0)
+    for n in (3, 2, 1):
+        o = [simplex[..., a] >= n for a in range(4)]
+        offset = numpy.float32(4 - n) * _G4
+        total += _corner(I + o[0], J + o[1], K + o[2], L + o[3],
+                         x0 - o[0].astype(numpy.float32) + offset, y0 - o[1].astype(numpy.float32) + offset,
+                         z0 - o[2].astype(numpy.float32) + offset, w0 - o[3].astype(numpy.float32) + offset)
+    offset = numpy.float32(4.0) * _G4
+    total += _corner(I + 1, J + 1, K + 1, L + 1,
+                     x0 - _ONE + offset, y0 - _ONE + offset, z0 - _ONE + offset, w0 - _ONE + offset)
+    return (27.0 * total.astype(numpy.float64)).astype(numpy.float32)
+
+
+def snoise2(x, y, repeat, base):
+    # vectorized snoise2(x, y, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=base),
+    # x along the first axis and y along the second one of the result
+    x_pos, z = _torus(x, repeat, base)
+    y_pos, w = _torus(y, repeat, base)
+    return noise4(x_pos[:, None], y_pos[None, :], z[:, None], w[None, :])
+
+
+class Fractal:
+
+    def __init__(self, layers, seed, repeat, horiz_scale=1.0):
+        if len(layers) == 0:
+            raise ValueError("no perlin layers")
+        self.layers = [(freq * horiz_scale, amp) for freq, amp in layers]
+        self.seed = seed
+        self.repeat = repeat
+        self.amp_normalizer = sum(amp for freq, amp in layers)
+
+    @classmethod
+    def from_config(cls, section, repeat, horiz_scale=1.0):
+        return cls(read_layers(section), section.getfloat('perlin_seed'), repeat, horiz_scale)
+
+    def sample(self, xs, ys, out=None):
+        # fractal value in [0, 1] for every (x, y) pixel coordinate pair
+        xs = numpy.asarray(xs, dtype=numpy.float64)
+        ys = numpy.asarray(ys, dtype=numpy.float64)
+        if out is None:
+            out = numpy.zeros((len(xs), len(ys)), dtype=numpy.float64)
+        else:
+            out.fill(0.0)
+        for freq, amp in self.layers:
+            out += amp * snoise2(xs / freq, ys / freq, self.repeat, self.seed).astype(numpy.float64)
+        out /= self.amp_normalizer
+        out *= 0.5
+        out += 0.5
+        return out
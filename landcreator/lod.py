@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# levels of detail of land grids of power-of-two-plus-one size. every level is
+# a grid of that kind too, with half the cells of the level before it: vertex
+# (i, j) of a level is vertex (2i, 2j) of the level before, and its value comes
+# from the 3x3 vertices around that one. grids are given padded with a vertex
+# of NaN on the sides the grid ends (pad), so a band of rows is reduced as the
+# whole grid would be, and the vertices out of the grid are left out.
+
+import numpy
+
+# weights of the vertices before, at and after the one kept, along each axis
+BoxWeights = (1.0, 1.0, 1.0)
+TentWeights = (0.5, 1.0, 0.5)
+
+
+def level_sizes(size, min_size):
+    # sizes of the levels after size, down to min_size
+    sizes = list()
+    while size > 2 and (size - 1) % 2 == 0 and (size - 1) // 2 + 1 >= min_size:
+        size = (size - 1) // 2 + 1
+        sizes.append(size)
+    return sizes
+
+
+def pad(array, rows=(1, 1), cols=(1, 1)):
+    # array with rows and columns of NaN before and after it
+    widths = [rows, cols] + [(0, 0)] * (array.ndim - 2)
+    return numpy.pad(array.astype(numpy.result_type(array.dtype, numpy.float32)), widths, constant_values=numpy.nan)
+
+
+def _parts(padded):
+    # vertices before, at and after the ones kept, along the first axis
+    return padded[0:-2:2], padded[1:-1:2], padded[2::2]
+
+
+def reduce(padded, weights):
+    # separable weighted average of the vertices around the ones kept, the
+    # weights renormalized over the vertices in the grid
+    with numpy.errstate(invalid='ignore'):
+        for axis in (0, 1):
+            p = numpy.moveaxis(padded, axis, 0)
+            total = numpy.zeros_like(p[1:-1:2])
+            norm = numpy.zeros_like(total)
+            for weight, part in zip(weights, _parts(p)):
+                valid = ~numpy.isnan(part)
+                total += numpy.where(valid, part, 0.0) * weight
+                norm += valid * weight
+            padded = numpy.moveaxis(total / norm, 0, axis)
+    return padded
+
+
+def extreme(padded, function):
+    # numpy.fmin or numpy.fmax of the vertices around the ones kept
+    for axis in (0, 1):
+        before, at, after = _parts(numpy.moveaxis(padded, axis, 0))
+        padded = numpy.moveaxis(function(function(before, at), after), 0, axis)
+    return padded
+
+
+def renormalize(weights):
+    # weights (..., n) scaled to add up to 1 where they are not all 0
+    total = weights.sum(axis=-1, keepdims=True)
+    numpy.divide(weights, total, out=weights, where=total > 0)
+    return weights
@@ -3,15 +3,32 @@
 
 import logging
 import argparse
+import contextlib
+import cProfile
+import pstats
+import resource
+import hashlib
+import itertools
+import json
 import os
 import os.path
 import sys
 import configparser
 import re
+import multiprocessing
+import threading
+import time
 import numpy
-import noise
 import math
-import png
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import container
+import dds
+import distance
+import erosion
+import fbm
+import lod
+import pngwriter
+import shared
 
 # topography constants
 TopoDataFileName = "topography.npy"
@@ -20,6 +37,11 @@ TopoTypeRegular = "regular"
 TopoTypeValley = "valley"
 TopoTypeIsland = "island"
 
+# erosion constants, iterations run by a band between exchanges of halos, and
+# least rows of a band, in halos
+ErosionExchangeIterations = 4
+ErosionBandHalos = 4
+
 # temperature constants
 TempDataFileName = "temperature.npy"
 TempImageFileName = "temperature.png"
@@ -27,12 +49,28 @@ TempTypeNoise = "noise"
 TempTypeElevation = "elevation"
 TempTypeDistCtr = "dist_ctr"  # distance to center
 TempTypeElevDistCtr = "elevation_dist_ctr"  # elevation and distance to center
+TempTypeNoiseShore = "noise_shore"  # noise, distance to the shore and distance to center
+TempTypeElevShore = "elevation_shore"  # elevation and distance to the shore
+# types of raw perlin noise, and types that take the distance to the shore
+TempNoiseTypes = [TempTypeNoise, TempTypeNoiseShore]
+TempShoreTypes = [TempTypeNoiseShore, TempTypeElevShore]
 
 # humidity constants
 HumidityDataFileName = "humidity.npy"
 HumidityImageFileName = "humidity.png"
 HumidityTypeNoise = "noise"
 HumidityTypeElevation = "elevation"
+HumidityTypeNoiseShore = "noise_shore"  # noise, drier inland
+HumidityNoiseTypes = [HumidityTypeNoise, HumidityTypeNoiseShore]
+HumidityShoreTypes = [HumidityTypeNoiseShore]
+# humidity taken away inland, at shore_range and further
+HumidityShoreFactor = 0.5
+
+# shore constants, distance to the shoreline and its texture, and least lines
+# of the blocks of the distance transform
+ShoreDataFileName = "shore_distance.npy"
+ShorelineImageFileName = "shoreline.png"
+ShoreBandLines = 512
 
 # noise constants
 NoiseDataFileName = "noise.npy"
@@ -71,12 +109,29 @@ Terr7TempSandTransitionStart = 0.85
 Terr7TempSandTransitionEnd = 0.9
 Terr7HumidityBlendStart = 0.45
 Terr7HumidityBlendEnd = 0.55
+Terr7NoiseBlendStart = 0.4
+Terr7NoiseBlendEnd = 0.6
 
 # data images
 THNImageFileName = "land_data_thn.png"
 BLDImageFileName = "land_data_bld.png"
 ALPHAImageFileName0 = "land_data_alpha0.png"
 ALPHAImageFileName1 = "land_data_alpha1.png"
+# the heaviest terrain7 materials of every pixel and their weights: red has the
+# first two indices, a nibble each as in the bld map, green the third one,
+# blue and alpha the weights of the first two, the last one being what the
+# others leave of 255
+SparseImageFileName = "land_data_sparse.png"
+SparseMaterials = [2, 3]
+
+# biome lookup table, terrain7 weights by temperature, humidity and slope; a
+# nudge over the breakpoints, and pixels checked with the scalar classifier
+BiomeLutManifestFileName = "biome_lut.json"
+BiomeLutImageFileName0 = "biome_lut0.png"
+BiomeLutImageFileName1 = "biome_lut1.png"
+BiomeLutValidationFileName = "biome_lut_validation.json"
+BiomeLutNudge = 1e-9
+BiomeLutSamples = 2000
 
 # slopes
 SlopesImageFileName = "slopes.png"
@@ -86,6 +141,114 @@ SlopeTransitionEnd = 0.085
 # normals
 NormalsDataFileName = "normals.npy"
 
+# levels of detail
+PyramidFileName = "pyramid.json"
+PyramidMinSize = 33
+TopoBoundsImageFileName = "topography_bounds.png"
+# terrain7 weights, temperature, blend factor, slope and noise
+PyramidSplatChannels = 12
+
+# terrain tiles, the tiles of a layer are stored one after the other in a file
+TilesDirName = "tiles"
+TilesManifestFileName = "tiles.json"
+TileLayerFileName = "%s.tiles"
+# layers and their png modes
+TileLayers = {"topography": "L8", "normals": "RGBA8", "thn": "RGBA8", "bld": "RGBA8", "alpha0": "RGBA8", "alpha1": "RGBA8"}
+
+# preview, the land sampled every world_step pixels in a directory of its
+# own, and a composite image of terrain7 colors, relief and sea
+PreviewDirName = "preview_%i"
+PreviewImageFileName = "preview.png"
+PreviewColors = {Terr7MtnWhite: (200, 200, 195), Terr7MtnIce: (180, 200, 215), Terr7DryDirt: (150, 120, 85),
+                 Terr7WetDirt: (105, 80, 55), Terr7DryGrass: (160, 165, 80), Terr7WetGrass: (70, 125, 50),
+                 Terr7Snow: (245, 245, 250), Terr7Sand: (225, 205, 150)}
+PreviewSeaColors = ((20, 40, 90), (60, 120, 170))
+PreviewLight = (-0.5, -0.7, -0.5)
+
+# dds textures, block compressed with their mip chains, and their formats;
+# rgba ones are bc1 if all their pixels are opaque, bc3 otherwise
+DdsTopoFileName = "topography.dds"
+DdsNormalsFileName = "normals.dds"
+DdsSlopesFileName = "slopes.dds"
+DdsShorelineFileName = "shoreline.dds"
+DdsTHNFileName = "land_data_thn.dds"
+DdsAlphaFileName0 = "land_data_alpha0.dds"
+DdsAlphaFileName1 = "land_data_alpha1.dds"
+DdsFormats = {DdsTopoFileName: "bc4", DdsNormalsFileName: "bc5", DdsSlopesFileName: "bc4", DdsShorelineFileName: "bc4",
+              DdsTHNFileName: "rgba", DdsAlphaFileName0: "rgba", DdsAlphaFileName1: "rgba"}
+
+# single file container of the data files and images
+ContainerFileName = "land.pack"
+
+# pixels processed per band of rows by the array passes, so the memory used
+# by a band does not grow with size_total
+BandPixels = 256 * 1024
+
+# shards
+ShardsDirName = "shards"
+ShardManifestFileName = "shard_%i_%i.json"
+ShardDataFileName = "%s_%i_%i.npy"
+ShardMergedFileName = "%s_merged.npy"
+
+# stage cache, a sidecar file next to each output holds the key of the stage
+# inputs it was generated from and the hash of its content
+SidecarFileName = "%s.hash"
+CacheVersion = 1
+
+# stages in build order, named as their command line options: output files,
+# config sections and global values they are generated from, stages they depend
+# on, and bytes per pixel of memory they use (the erosion adds to it, see
+# stage_memory)
+Stages = {
+    "noise": {"outputs": [NoiseDataFileName], "sections": ["noise"], "globals": ["size_total", "world_step"], "depends": [], "memory": 8},
+    "topography": {"outputs": [TopoDataFileName], "sections": ["topography", "erosion"], "globals": ["size_total", "world_step", "noise_horiz_scale", "ocean_altitude"], "depends": [], "memory": 8},
+    "normals": {"outputs": [NormalsDataFileName], "sections": [], "globals": ["world_step"], "depends": ["topography"], "memory": 12},
+    "topography_image": {"outputs": [TopoImageFileName], "sections": [], "globals": [], "depends": ["topography"], "memory": 1},
+    "shore_distance": {"outputs": [ShoreDataFileName], "sections": [], "globals": ["world_step", "ocean_altitude"], "depends": ["topography"], "memory": 12},
+    "shoreline_image": {"outputs": [ShorelineImageFileName], "sections": ["shoreline"], "globals": [], "depends": ["shore_distance"], "memory": 1},
+    "temperature": {"outputs": [TempDataFileName], "sections": ["temperature"], "globals": ["size_total", "world_step", "noise_horiz_scale", "ocean_altitude"], "depends": ["topography", "shore_distance"], "memory": 8},
+    "temperature_image": {"outputs": [TempImageFileName], "sections": [], "globals": [], "depends": ["temperature"], "memory": 1},
+    "humidity": {"outputs": [HumidityDataFileName], "sections": ["humidity"], "globals": ["size_total", "world_step"], "depends": ["topography", "shore_distance"], "memory": 8},
+    "humidity_image": {"outputs": [HumidityImageFileName], "sections": [], "globals": [], "depends": ["humidity"], "memory": 1},
+    "noise_image": {"outputs": [NoiseImageFileName], "sections": [], "globals": [], "depends": ["noise"], "memory": 1},
+    "slopes_image": {"outputs": [SlopesImageFileName], "sections": [], "globals": [], "depends": ["normals"], "memory": 1},
+    "pack_images_thn": {"outputs": [THNImageFileName], "sections": [], "globals": [], "depends": ["normals", "temperature", "humidity", "noise"], "memory": 4},
+    "pack_images_bld": {"outputs": [BLDImageFileName], "sections": [], "globals": [], "depends": ["normals", "temperature", "humidity", "noise"], "memory": 4},
+    "pack_images_alpha": {"outputs": [ALPHAImageFileName0, ALPHAImageFileName1], "sections": [], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "temperature", "humidity", "noise"], "memory": 8},
+    "pack_images_sparse": {"outputs": [SparseImageFileName], "sections": ["sparse"], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "temperature", "humidity", "noise"], "memory": 8},
+    "biome_lut": {"outputs": [BiomeLutManifestFileName, BiomeLutImageFileName0, BiomeLutImageFileName1], "sections": ["biome_lut"], "globals": ["ocean_altitude"], "depends": [], "memory": 0},
+    "pyramid": {"outputs": [PyramidFileName], "sections": [], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "temperature", "humidity", "noise"], "memory": 20},
+    "terrain_tiles": {"outputs": [TilesManifestFileName], "sections": ["tiles"], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "temperature", "humidity", "noise"], "memory": 1},
+    "preview_image": {"outputs": [PreviewImageFileName], "sections": [], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "temperature", "humidity", "noise"], "memory": 4},
+    "dds_textures": {"outputs": list(DdsFormats), "sections": ["shoreline"], "globals": ["ocean_altitude"], "depends": ["topography", "normals", "shore_distance", "temperature", "humidity", "noise"], "memory": 24},
+    "container": {"outputs": [ContainerFileName], "sections": ["container"], "globals": [], "depends": ["noise", "topography", "normals", "shore_distance", "temperature", "humidity", "topography_image", "shoreline_image", "temperature_image", "humidity_image", "noise_image", "slopes_image", "pack_images_thn", "pack_images_bld", "pack_images_alpha"], "memory": 1},
+    }
+
+# stages generated only when asked for, the shore ones also when a temperature
+# or humidity type needs the distance to the shore
+ShoreStages = ["shore_distance", "shoreline_image"]
+OptionalStages = ShoreStages + ["pack_images_sparse", "biome_lut", "pyramid", "terrain_tiles", "preview_image", "dds_textures", "container"]
+
+# stages generated together by do_pack_images, in one scheduled stage
+PackStages = ["slopes_image", "pack_images_thn", "pack_images_bld", "pack_images_alpha", "pack_images_sparse"]
+PackStage = "pack_images"
+
+# stages a region regenerates whole
+RegionWholeStages = ["shore_distance", "shoreline_image", "biome_lut", "pyramid", "terrain_tiles", "dds_textures"]
+
+# critical path of the last build
+CriticalPathFileName = "critical_path.json"
+
+# metrics, phases of the stages timed apart (compute is the rest of the time of a
+# stage), cProfile dump of the slowest stage with --profile
+MetricsPhases = ["setup", "compute", "normalize", "histogram", "io"]
+ProfileFileName = "profile_%s.prof"
+
+# seconds between progress updates
+ProgressInterval = 0.25
+# seconds between samples of the memory in use while a stage runs
+RssInterval = 0.05
+
 # default config dict
 _defaul_config={"global": {
                             "name":"land",
@@ -98,15 +261,43 @@ _defaul_config={"global": {
                             "perlin_seed":"0.634",
                             "perlin_layer_0":"256.0 1.0"
                             },
+                "erosion": {
+                            "iterations":"0",  # no erosion
+                            "rain":"0.01",  # water per iteration, in pixels
+                            "evaporation":"0.02",  # fraction of the water per iteration
+                            "capacity":"1.0",  # sediment carried by the flow
+                            "dissolving":"0.3",
+                            "deposition":"0.3",
+                            "talus_angle":"40.0",  # degrees
+                            "thermal_rate":"0.5"
+                            },
                 "temperature": {
                             "type":"elevation",
                             "perlin_seed":"0.156",
-                            "perlin_layer_0":"1024.0 1.0"
+                            "perlin_layer_0":"1024.0 1.0",
+                            "shore_range":"256.0"  # pixels inland, of the *_shore types
                             },
                 "humidity": {
                             "type":"elevation",
                             "perlin_seed":"0.456",
-                            "perlin_layer_0":"512.0 1.0"
+                            "perlin_layer_0":"512.0 1.0",
+                            "shore_range":"256.0"  # pixels inland, of the *_shore types
+                            },
+                "shoreline": {
+                            "range":"32.0"  # pixels to each side of the shoreline, in the texture
+                            },
+                "biome_lut": {
+                            "steps":"8"  # texels per the narrowest transition of each axis
+                            },
+                "sparse": {
+                            "materials":"3"  # heaviest materials per pixel in the sparse splat map, 2 or 3
+                            },
+                "tiles": {
+                            "size":"257"
+                            },
+                "container": {
+                            "quantize":"uint16",  # none, uint8 or uint16
+                            "compression":"none"  # none or zlib
                             },
                 "noise": {
                             "perlin_seed":"0.159",
@@ -125,70 +316,248 @@ _defaul_config={"global": {
 config = None
 directory = "."
 size_total = 2
+# pixels of the full size land between two pixels, more than 1 in previews
+world_step = 1
 noise_horiz_scale = 1
 ocean_altitude = 0.1
+pool = None
+# data loaded for the stages, by file name
+loaded = dict()
+loaded_lock = threading.Lock()
+# metrics of the stages run, by stage name, and of the stage a thread runs
+metrics = dict()
+current_stage = threading.local()
+# lists of the workers, by the samplers of the memory in use and the estimates
+rss_lock = threading.Lock()
+# (min, max) the layers generated were normalized with, by file name
+value_ranges = dict()
+progress_time = 0.0
+out_of_core = False
+png_level = pngwriter.DefaultLevel
 
 def delete_file(file_path):
     if not os.path.exists(file_path):
         return True
     logging.warning("%s exists, it will be deleted" % file_path)
     try:
-        os.remove(file_path)
+        with measure("setup"):
+            os.remove(file_path)
     except Exception as e:
         logging.exception(str(e))
         return False
     return True
 
 def progress(n, N):
+    # throttled to one update per ProgressInterval, and the last one
+    global progress_time
+    now = time.monotonic()
+    if n < N and now - progress_time < ProgressInterval:
+        return
+    progress_time = now
     p = 100 * n / N
     sys.stdout.write("%.2f%%\r" % p)
 
-def normalize(array):
+@contextlib.contextmanager
+def measure(phase):
+    # adds the time spent in the block to a phase of the stage run by the thread
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = getattr(current_stage, "phases", None)
+        if phases is not None:
+            phases[phase] += time.perf_counter() - start
+
+def peak_rss():
+    # KB, the most this process or the biggest worker had resident since it started
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+def current_rss():
+    # KB resident now, of this process or of the biggest worker; None without /proc
+    biggest = 0
+    with rss_lock:
+        children = multiprocessing.active_children()
+    for pid in ["self"] + [str(child.pid) for child in children]:
+        try:
+            with open("/proc/%s/statm" % pid) as file:
+                biggest = max(biggest, int(file.read().split()[1]))
+        except (OSError, ValueError, IndexError):
+            if pid == "self":
+                return None
+    return biggest * (os.sysconf("SC_PAGE_SIZE") // 1024)
+
+@contextlib.contextmanager
+def sample_rss(sample):
+    # the most KB resident while the block runs to sample["peak_rss_kb"], sampled
+    # every RssInterval by a thread; the stages running at the same time count
+    # too. peak_rss() where it can not be sampled
+    stop = threading.Event()
+    def sampler():
+        while True:
+            rss = current_rss()
+            if rss is None:
+                return
+            sample["peak_rss_kb"] = max(sample.get("peak_rss_kb", 0), rss)
+            if stop.wait(RssInterval):
+                return
+    thread = threading.Thread(target=sampler, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        rss = current_rss()
+        if rss is None:
+            sample["peak_rss_kb"] = peak_rss()
+        else:
+            sample["peak_rss_kb"] = max(sample.get("peak_rss_kb", 0), rss)
+
+def init_worker(state):
+    global directory, size_total, world_step, noise_horiz_scale, ocean_altitude
+    directory, size_total, world_step, noise_horiz_scale, ocean_altitude = state
+
+def stop_workers():
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+def worker_state():
+    return directory, size_total, world_step, noise_horiz_scale, ocean_altitude
+
+def run_band(task):
+    # the state of the land goes with every task, so a pool can be shared by
+    # lands; the blocks of the previous land are detached when it changes
+    kernel, rows, args, state = task
+    if state != worker_state():
+        shared.detach(set(shared.block_names(args)))
+    init_worker(state)
+    return kernel(rows, *args)
+
+def map_bands(kernel, size, *args):
+    # calls kernel(rows, *args) for every band of rows, in the pool of workers
+    # if there is one; yields the results in band order
+    band_rows = max(1, BandPixels // size_total)
+    bands = [slice(x0, min(size, x0 + band_rows)) for x0 in range(0, size, band_rows)]
+    return map_slices(kernel, bands, size, *args)
+
+def map_slices(kernel, bands, size, *args):
+    # map_bands over the given bands of rows, that may overlap
+    if pool is None:
+        results = (kernel(rows, *args) for rows in bands)
+    else:
+        results = pool.imap(run_band, [(kernel, rows, args, worker_state()) for rows in bands])
+    for rows, result in zip(bands, results):
+        yield result
+        progress(rows.stop, size)
+
+def for_each_band(kernel, size, *args):
+    # map_bands, returns the results in a list
+    return list(map_bands(kernel, size, *args))
+
+def new_array(shape, dtype, file_path=None):
+    # arrays written by band kernels live in shared memory when there are workers;
+    # in out-of-core mode they are mapped from file_path, a .npy file, if given
+    with measure("setup"):
+        if out_of_core and file_path is not None:
+            return shared.map_array(file_path, shape, dtype, 'w+')
+        if pool is None:
+            return numpy.zeros(shape, dtype=dtype)
+        return shared.new_array(shape, dtype)
+
+def save_array(file_path, array):
+    # arrays mapped from their file only need to be flushed
+    with measure("io"):
+        if shared.mapped_file(array) == os.path.abspath(file_path):
+            shared.flush(array)
+        else:
+            numpy.save(file_path, array)
+
+def center_distance(rows, coords_sq, cols=slice(None)):
+    # distance to center for a band of rows, from squared normalized coordinates
+    return numpy.sqrt(coords_sq[rows, None] + coords_sq[None, cols])
+
+def minmax_band(rows, array):
+    band = array[rows]
+    return band.min(), band.max()
+
+def reduce_minmax(array):
+    # two-phase min/max, per band and then over the bands
+    values = for_each_band(minmax_band, array.shape[0], array)
+    return min(v[0] for v in values), max(v[1] for v in values)
+
+def normalize_band(rows, array, valmin, amp):
+    band = array[rows]
+    band -= valmin
+    band *= amp
+
+def normalize(array, value_range=None):
+    # value_range is the (min, max) of array when already known; returns the
+    # (min, max) the array was normalized with
     logging.info("normalize array")
-    valmin, valmax = array.min(), array.max()
-    amp = 1 if valmax == 0 else 1 / (valmax - valmin)
-    for x in range(size_total):
-        for y in range(size_total):
-            value = array[x][y]
-            value -= valmin
-            value *= amp
-            array[x][y] = value
-        progress(x, size_total)
+    with measure("normalize"):
+        valmin, valmax = reduce_minmax(array) if value_range is None else value_range
+        amp = 1 if valmax == 0 else 1 / (valmax - valmin)
+        for_each_band(normalize_band, array.shape[0], array, valmin, amp)
+    return float(valmin), float(valmax)
+
+def histogram_band(rows, array, value_range):
+    return numpy.histogram(array[rows], bins=10, range=value_range)
 
 def histogram(array):
+    # same bins as numpy.histogram(array, bins=10), counted per band
+    logging.info("histogram:")
+    with measure("histogram"):
+        valmin, valmax = reduce_minmax(array)
+        results = for_each_band(histogram_band, array.shape[0], array, (valmin, valmax))
+        values, bins = sum(r[0] for r in results), results[0][1]
+    print_histogram(values, bins)
+
+def histogram_pixels(counts):
+    # same output as histogram(array) for a uint8 array, from the count of each value in it
     logging.info("histogram:")
-    values, bins = numpy.histogram(array, bins=10)
+    with measure("histogram"):
+        levels = numpy.flatnonzero(counts)
+        values, bins = numpy.histogram(numpy.arange(256), bins=10, range=(levels[0], levels[-1]), weights=counts)
+    print_histogram(values, bins)
+
+def print_histogram(values, bins):
     values = values / values.max()
     print(str(str(values) + " " + str(bins)))
 
-def get_altitude(topography, x, y, scale):
-    _x, _y = x, y
-    if x < 0:
-        _x = 0
-    if x >= size_total:
-        _x = size_total - 1
-    if y < 0:
-        _y = 0
-    if y >= size_total:
-        _y = size_total - 1
-    return topography[_x][_y] * scale
-
-def calculate_normal(v0, v1, v2):
-    U = numpy.subtract(v1, v0)
-    V = numpy.subtract(v2, v0)
-    return numpy.cross(U, V)
+def get_altitudes(topography, rows, scale, cols=None):
+    # altitudes of a band of rows (of all columns or of cols) plus a one pixel
+    # border, clamped at the edges
+    size = topography.shape[0]
+    indices = numpy.clip(numpy.arange(rows.start - 1, rows.stop + 1), 0, size - 1)
+    if cols is None:
+        return numpy.pad(topography[indices] * scale, ((0, 0), (1, 1)), mode='edge')
+    columns = numpy.clip(numpy.arange(cols.start - 1, cols.stop + 1), 0, topography.shape[1] - 1)
+    return topography[numpy.ix_(indices, columns)] * scale
+
+def calculate_normals(topography, rows, out, cols=None):
+    # average of the normals of the 4 triangles around each vertex v0=(x, h, y):
+    # (v1-v0)x(v2-v0), (v3-v0)x(v1-v0), (v2-v0)x(v4-v0) and (v5-v0)x(v6-v0),
+    # with v1=(x+1,y) v2=(x,y+1) v3=(x+1,y-1) v4=(x-1,y+1) v5=(x-1,y) v6=(x,y-1)
+    # altitude differences per pixel of the full size land
+    h = get_altitudes(topography, rows, 255 / world_step, cols)
+    h0 = h[1:-1, 1:-1]
+    d1 = h[2:, 1:-1] - h0
+    d2 = h[1:-1, 2:] - h0
+    d3 = h[2:, :-2] - h0
+    d4 = h[:-2, 2:] - h0
+    d5 = h[:-2, 1:-1] - h0
+    d6 = h[1:-1, :-2] - h0
+    nx = (d1 + d1 + (d2 - d4) - d5) / 4
+    nz = (d2 + (d1 - d3) + d2 - d6) / 4
+    length = numpy.sqrt(nx * nx + nz * nz + 1.0)
+    out[..., 0] = nx / length
+    out[..., 1] = -1.0 / length
+    out[..., 2] = nz / length
 
 def generate_slopes_data(normals):
-    logging.info("generating slopes data...")
-    size = normals.shape[0]
-    slopes = numpy.zeros((size, size), dtype=numpy.float)
-    for x in range(size):
-        for y in range(size):
-            slope = abs(numpy.dot(normals[x][y], (0, 1, 0)))
-            slopes[x][y] = slope
-        progress(x, size_total)
-    histogram(slopes)
-    return slopes
+    # vertical component of the normals (of a band of rows)
+    return numpy.abs(normals[..., 1], dtype=numpy.float)
 
 def load_data(file_name):
     #
@@ -197,100 +566,205 @@ def load_data(file_name):
     try:
         if os.path.exists(file_path):
             logging.info("load data from file: " + file_path)
-            array = numpy.load(file_path)
-            return array
+            with measure("io"):
+                if out_of_core:
+                    return shared.map_array(file_path)
+                array = numpy.load(file_path, allow_pickle=False)
+                if pool is not None:
+                    array = shared.copy_array(array)
+                return array
+        # from the container, if the file is in it
+        land = open_container()
+        if land is not None and file_name in land.layers:
+            logging.info("load data from container: " + file_name)
+            with measure("io"):
+                array = land.read(file_name)
+                if pool is not None:
+                    array = shared.copy_array(array)
+                return array
+        logging.error("data file does not exist: " + file_path)
     except Exception as e:
         logging.exception(str(e))
         return numpy.array(0)
 
-def do_topography(size, noise_array):
-    logging.info("generate topography data file")
-    file_path = os.path.join(directory, TopoDataFileName)
+def world_size():
+    # size of the full size land
+    return (size_total - 1) * world_step + 1
+
+def world_coordinates(first=0, count=None):
+    # coordinates in the full size land of count pixels from first, of all of them by default
+    return (numpy.arange(count if count is not None else size_total) + first) * world_step
+
+def fractal_band(rows, fractal, array, first_row, first_col=0):
+    fractal.sample(world_coordinates(rows.start + first_row, rows.stop - rows.start), world_coordinates(first_col, array.shape[1]), out=array[rows])
+
+def invert_band(rows, source, array):
+    numpy.subtract(1.0, source[rows], out=array[rows])
+
+def shape_topography_band(rows, array, type, change_dist_start, change_dist_end, first_row, first_col=0):
+    band = array[rows]
+    coords_sq = (((world_coordinates() / world_size()) * 2) - 1) ** 2
+    dist_to_center = center_distance(slice(rows.start + first_row, rows.stop + first_row), coords_sq,
+                                     slice(first_col, first_col + band.shape[1]))
+    outside = dist_to_center > change_dist_end
+    transition = dist_to_center > change_dist_start
+    transition &= ~outside
+    dist_to_center -= change_dist_start
+    dist_to_center /= (change_dist_end - change_dist_start)
+    if type == TopoTypeValley:
+        numpy.copyto(band, band + (1.0 - band) * dist_to_center, where=transition)
+    elif type == TopoTypeIsland:
+        numpy.copyto(band, band - band * dist_to_center, where=transition)
+    # ~ island: value += 1.4 * value * (1.0 - dist_to_center / change_dist_start) inside change_dist_start
+    band[outside] = 1.0 if type==TopoTypeValley else 0.0
+
+def modulate_topography_band(rows, array):
+    band = array[rows]
+    band -= ocean_altitude
+    band *= numpy.abs(band)
+    band += ocean_altitude
+    # ~ band += 0.333 * noise_array[rows]
+
+def normals_band(rows, topography, array, first_row=0, cols=None):
+    calculate_normals(topography, slice(rows.start + first_row, rows.stop + first_row), array[rows], cols)
+
+def temperature_band(rows, topography, array, type, first_row=0, first_col=0, shore=None, shore_range=1.0):
+    band = array[rows]
+    # distance to ocean, to the shore or as the altitude
+    if type in TempShoreTypes:
+        distance_to_ocean = inland_distance(shore[rows], shore_range)
+        distance_to_ocean *= 0.2
+        band -= distance_to_ocean
+    elif type == TempTypeNoise or type == TempTypeElevation or type == TempTypeElevDistCtr:
+        distance_to_ocean = topography[rows] - ocean_altitude
+        distance_to_ocean /= (1.0 - ocean_altitude)
+        numpy.maximum(distance_to_ocean, 0.0, out=distance_to_ocean)
+        distance_to_ocean *= 0.2
+        band -= distance_to_ocean
+    # distance to center
+    if type == TempTypeNoise or type == TempTypeNoiseShore or type == TempTypeDistCtr or type == TempTypeElevDistCtr:
+        coords_sq = (2.0 * (0.5 - world_coordinates() / world_size())) ** 2
+        dist_to_center = center_distance(slice(rows.start + first_row, rows.stop + first_row), coords_sq,
+                                         slice(first_col, first_col + band.shape[1]))
+        numpy.minimum(dist_to_center, 1.0, out=dist_to_center)
+        numpy.subtract(1.0, dist_to_center, out=dist_to_center)
+        dist_to_center *= 1.25
+        band *= dist_to_center
+    #
+    numpy.clip(band, 0.0, 1.0, out=band)
+
+def humidity_band(rows, array, shore, shore_range):
+    # drier inland
+    band = array[rows]
+    distance_to_ocean = inland_distance(shore[rows], shore_range)
+    distance_to_ocean *= HumidityShoreFactor
+    band -= distance_to_ocean
+    numpy.maximum(band, 0.0, out=band)
+
+def image_band(rows, array_data):
+    band = numpy.empty(array_data[rows].shape, dtype=numpy.uint8)
+    numpy.multiply(array_data[rows], 255, out=band, casting='unsafe')
+    return band
+
+def generate_topography(array, first_row, first_col=0):
+    # raw topography (not normalized) for array, whose first pixel is (first_row, first_col)
     # type
     type = config['topography'].get('type')
     logging.info("topography type: " + type)
     # change normalized distances
     change_dist_start, change_dist_end = config['topography'].get('change_distances').split()
     change_dist_start, change_dist_end = float(change_dist_start), float(change_dist_end)
-    # perlin noise seed
-    seed = config['topography'].getfloat('perlin_seed')
     # perlin noise layers
-    layers = list()
-    i_layer = 0
-    try:
-        while i_layer >= 0:
-            var_name = "perlin_layer_%i" % i_layer
-            if var_name in config['topography']:
-                freq, amp = config['topography'].get(var_name).split()
-                layers.append((float(freq), float(amp)))
-                i_layer += 1
-                continue
-            i_layer = -1
-    except Exception as e:
-        logging.exception(str(e))
-        return False
-    # delete file
-    if not delete_file(file_path):
-        return False
-    # array
-    array = numpy.zeros((size, size), dtype=numpy.float)
-    # normalizer divisor for perlin levels amplitudes
-    amp_normalizer = 0.0
-    for freq, amp in layers:
-        amp_normalizer += amp
+    fractal = fbm.Fractal.from_config(config['topography'], 1024, noise_horiz_scale)
     # generate data
     logging.info("generate regular topography data")
-    repeat = 1024
-    for x in range(size_total):
-        for y in range(size_total):
-            value = 0.0
-            # for each perlin level
-            for freq, amp in layers:
-                freq *= noise_horiz_scale
-                value += amp * noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=seed)
-            value /= amp_normalizer
-            value = (value * 0.5) + 0.5
-            array[x][y] = value
-        progress(x, size_total)
+    for_each_band(fractal_band, array.shape[0], fractal, array, first_row, first_col)
     # type
     if type == TopoTypeValley or type == TopoTypeIsland:
         logging.info("shape topography data to type " + type)
-        for x in range(size_total):
-            for y in range(size_total):
-                _x, _y = ((x / size_total) * 2) - 1, ((y / size_total) * 2) - 1
-                dist_to_center = math.sqrt(_x ** 2 + _y ** 2)
-                value = array[x][y]
-                if dist_to_center > change_dist_end:
-                    value = 1.0 if type==TopoTypeValley else 0.0
-                    array[x][y] = value
-                elif dist_to_center > change_dist_start:
-                    if type == TopoTypeValley:
-                        value += (1.0 - value) * ((dist_to_center - change_dist_start) / (change_dist_end - change_dist_start))
-                    elif type == TopoTypeIsland:
-                        value -= value * ((dist_to_center - change_dist_start) / (change_dist_end - change_dist_start))
-                    array[x][y] = value
-                elif dist_to_center < change_dist_start:
-                    if type == TopoTypeIsland:
-                        value += 1.4 * value * (1.0 - dist_to_center / change_dist_start)
-            progress(x, size_total)
+        for_each_band(shape_topography_band, array.shape[0], array, type, change_dist_start, change_dist_end, first_row, first_col)
     # modulate altitude
     logging.info("modulate topography data")
-    for x in range(size_total):
-        for y in range(size_total):
-            altitude = array[x][y]
-            d = altitude - ocean_altitude
-            altitude = ocean_altitude + (d / abs(d)) * math.pow(d, 2)
-            # ~ altitude += 0.333 * noise_array[x][y]
-            array[x][y] = altitude
-        progress(x, size_total)
+    for_each_band(modulate_topography_band, array.shape[0], array)
+
+def erosion_parameters():
+    # iterations and the parameters of erosion.simulate, from the erosion section
+    section = config['erosion']
+    parameters = {"rain": section.getfloat('rain'),
+                  "evaporation": section.getfloat('evaporation'),
+                  "capacity": section.getfloat('capacity'),
+                  "dissolving": section.getfloat('dissolving'),
+                  "deposition": section.getfloat('deposition'),
+                  "talus": math.tan(math.radians(section.getfloat('talus_angle'))),
+                  "thermal_rate": section.getfloat('thermal_rate')}
+    return section.getint('iterations'), parameters
+
+def erosion_band_rows():
+    # rows of the bands eroded at a time, without their halos
+    return max(BandPixels // size_total, ErosionBandHalos * erosion.Radius * ErosionExchangeIterations)
+
+def erosion_band(rows, source, target, iterations, parameters, halo):
+    # iterations of a band of rows of the erosion state, from the band and its halo
+    size = source.shape[1]
+    x0, x1 = max(0, rows.start - halo), min(size, rows.stop + halo)
+    state = numpy.array(source[:, x0:x1])
+    erosion.simulate(state, iterations, **parameters)
+    target[:, rows] = state[:, rows.start - x0:rows.stop - x0]
+
+def erode_topography(array):
+    # hydraulic and thermal erosion of the normalized topography, in bands of rows
+    # that exchange their halos every ErosionExchangeIterations iterations
+    iterations, parameters = erosion_parameters()
+    logging.info("erode topography data, %i iterations" % iterations)
+    size = array.shape[0]
+    # heights in pixels of the grid, as the normals take them
+    scale = 255 / world_step
+    source = new_array((erosion.Channels, size, size), numpy.float32)
+    target = new_array((erosion.Channels, size, size), numpy.float32)
+    numpy.multiply(array, scale, out=source[erosion.Terrain], casting='unsafe')
+    band_rows = erosion_band_rows()
+    bands = [slice(x0, min(size, x0 + band_rows)) for x0 in range(0, size, band_rows)]
+    done = 0
+    while done < iterations:
+        count = min(ErosionExchangeIterations, iterations - done)
+        logging.info("erosion iterations %i to %i" % (done, done + count))
+        for result in map_slices(erosion_band, bands, size, source, target, count, parameters, erosion.Radius * count):
+            pass
+        source, target = target, source
+        done += count
+    numpy.multiply(source[erosion.Terrain], 1 / scale, out=array)
+
+def do_topography(size, noise_array, array=None, value_range=None):
+    # array and value_range are given when merging shards
+    logging.info("generate topography data file")
+    file_path = os.path.join(directory, TopoDataFileName)
+    # delete file
+    if not delete_file(file_path):
+        return False
+    # array
+    if array is None:
+        array = new_array((size, size), numpy.float, file_path)
+        try:
+            generate_topography(array, 0)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
     # normalize
-    normalize(array)
+    value_ranges[TopoDataFileName] = normalize(array, value_range)
+    # erosion, normalized again
+    if config['erosion'].getint('iterations') > 0:
+        try:
+            erode_topography(array)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+        normalize(array)
     # histogram
     histogram(array)
     # write array
     logging.info("save topography file: " + file_path)
     try:
-        numpy.save(file_path, array)
+        save_array(file_path, array)
     except Exception as e:
         logging.exception(str(e))
         return False
@@ -303,179 +777,193 @@ def do_normals(topography):
     if not delete_file(file_path):
         return False
     # array
-    array = numpy.zeros(topography.shape, dtype=tuple)
+    array = new_array(topography.shape + (3,), numpy.float32, file_path)
     # generate data
     logging.info("generate normals data")
-    for x in range(size_total):
-        for y in range(size_total):
-            v0 = (x, get_altitude(topography, x, y, 255), y)
-            v1 = (x + 1, get_altitude(topography, x + 1, y, 255), y)
-            v2 = (x, get_altitude(topography, x, y + 1, 255), y + 1)
-            v3 = (x + 1, get_altitude(topography, x + 1, y - 1, 255), y - 1)
-            v4 = (x - 1, get_altitude(topography, x - 1, y + 1, 255), y + 1)
-            v5 = (x - 1, get_altitude(topography, x - 1, y, 255), y)
-            v6 = (x, get_altitude(topography, x, y - 1, 255), y - 1)
-            n0 = calculate_normal(v0, v1, v2)
-            n1 = calculate_normal(v0, v3, v1)
-            n2 = calculate_normal(v0, v2, v4)
-            n3 = calculate_normal(v0, v5, v6)
-            n = (n0 + n1 + n2 + n3) / 4
-            n /= numpy.linalg.norm(n)
-            array[x][y] = n
-        progress(x, size_total)
+    for_each_band(normals_band, topography.shape[0], topography, array)
     # write array
     logging.info("save normals file: " + file_path)
     try:
-        numpy.save(file_path, array)
+        save_array(file_path, array)
     except Exception as e:
         logging.exception(str(e))
         return False
     return True
 
-def do_temperature(topography):
-    logging.info("generate temperature data file")
-    file_path = os.path.join(directory, TempDataFileName)
-    # type
-    type = config['temperature'].get('type')
-    # perlin noise seed
-    seed = config['temperature'].getfloat('perlin_seed')
-    # perlin noise layers
-    layers = list()
-    i_layer = 0
+def shore_columns_band(cols, topography, land_columns, sea_columns, far):
+    # distances along the columns of a block of columns, of the land pixels to the
+    # sea and of the sea pixels to the land
+    sea = topography[:, cols] < ocean_altitude
+    land_columns[:, cols] = distance.column_distances(sea, far)
+    sea_columns[:, cols] = distance.column_distances(~sea, far)
+
+def shore_rows_band(rows, topography, land_columns, sea_columns, array):
+    # signed distance to the shoreline of a band of rows, from the pixel centers
+    # to half a pixel off the shore pixels
+    land = numpy.sqrt(distance.row_envelope(land_columns[rows]))
+    sea = numpy.sqrt(distance.row_envelope(sea_columns[rows]))
+    shore = numpy.where(topography[rows] < ocean_altitude, 0.5 - sea, land - 0.5)
+    numpy.multiply(shore, world_step, out=array[rows], casting='unsafe')
+
+def do_shore_distance(topography):
+    # exact signed distance to the shoreline, in pixels of the full size land,
+    # positive on land and negative in the sea
+    logging.info("generate shore distance data file")
+    file_path = os.path.join(directory, ShoreDataFileName)
+    # delete file
+    if not delete_file(file_path):
+        return False
+    # array
+    size = topography.shape[0]
+    array = new_array((size, size), numpy.float32, file_path)
+    # generate data, by blocks of columns and then by bands of rows
+    logging.info("generate shore distance data")
+    land_columns = new_array((size, size), numpy.int32)
+    sea_columns = new_array((size, size), numpy.int32)
+    band = max(BandPixels // size_total, ShoreBandLines)
+    bands = [slice(x0, min(size, x0 + band)) for x0 in range(0, size, band)]
+    for result in map_slices(shore_columns_band, bands, size, topography, land_columns, sea_columns, 2 * size):
+        pass
+    for result in map_slices(shore_rows_band, bands, size, topography, land_columns, sea_columns, array):
+        pass
+    del land_columns, sea_columns
+    # histogram
+    histogram(array)
+    # write array
+    logging.info("save shore distance file: " + file_path)
     try:
-        while i_layer >= 0:
-            var_name = "perlin_layer_%i" % i_layer
-            if var_name in config['temperature']:
-                freq, amp = config['temperature'].get(var_name).split()
-                layers.append((float(freq), float(amp)))
-                i_layer += 1
-                continue
-            i_layer = -1
+        save_array(file_path, array)
     except Exception as e:
         logging.exception(str(e))
         return False
+    return True
+
+def shoreline_band(rows, shore, shore_range):
+    # signed distance to the shoreline, in [-shore_range, shore_range] to [0, 255]
+    band = numpy.clip(shore[rows] / (2.0 * shore_range) + 0.5, 0.0, 1.0)
+    return numpy.rint(band * 255).astype(numpy.uint8)
+
+def do_shoreline_image(shore):
+    # signed distance texture of the shoreline, for shore effects of the water
+    file_path = os.path.join(directory, ShorelineImageFileName)
+    logging.info("generate image: " + file_path)
+    # delete file
+    if not delete_file(file_path):
+        return False
+    # check data
+    if shore is None or shore.ndim < 2:
+        logging.error("no shore distance data")
+        return False
+    shore_range = config['shoreline'].getfloat('range')
+    # pixels are written as their bands are generated
+    size = shore.shape[0]
+    try:
+        with measure("io"):
+            writer = pngwriter.Writer(file_path, size, size, "L8", png_level)
+        try:
+            for band in map_bands(shoreline_band, size, shore, shore_range):
+                with measure("io"):
+                    writer.write(band)
+        except:
+            writer.abort()
+            raise
+        with measure("io"):
+            writer.close()
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def inland_distance(shore, shore_range):
+    # distance to the sea of the land pixels, of shore_range and more to 1
+    distance_to_ocean = shore / shore_range
+    numpy.clip(distance_to_ocean, 0.0, 1.0, out=distance_to_ocean)
+    return distance_to_ocean
+
+def generate_temperature_noise(array, first_row, first_col=0):
+    # perlin noise of the noise temperature type
+    fractal = fbm.Fractal.from_config(config['temperature'], 1024, noise_horiz_scale)
+    for_each_band(fractal_band, array.shape[0], fractal, array, first_row, first_col)
+
+def generate_temperature(array, topography, type, first_row=0, first_col=0):
+    # temperature before the topography data is applied, for array and topography
+    # whose first pixel is (first_row, first_col)
+    if type in TempNoiseTypes:
+        generate_temperature_noise(array, first_row, first_col)
+    elif type == TempTypeElevation or type == TempTypeElevDistCtr or type == TempTypeElevShore:
+        for_each_band(invert_band, array.shape[0], topography, array)
+    elif type == TempTypeDistCtr:
+        array.fill(1.0)
+
+def do_temperature(topography, shore, array=None):
+    # array holds the perlin noise merged from shards, if any; shore is used by
+    # the *_shore types
+    logging.info("generate temperature data file")
+    file_path = os.path.join(directory, TempDataFileName)
+    # type
+    type = config['temperature'].get('type')
     # delete file
     if not delete_file(file_path):
         return False
-    # array
-    array = numpy.zeros(topography.shape, dtype=numpy.float)
-    # normalizer divisor for perlin levels amplitudes
-    amp_normalizer = 0.0
-    for freq, amp in layers:
-        amp_normalizer += amp
     # generate data
     logging.info("generate temperature data, type=" + type)
-    if type == TempTypeNoise:
-        repeat = 1024
-        for x in range(size_total):
-            for y in range(size_total):
-                value = 0.0
-                # for each perlin level
-                for freq, amp in layers:
-                    freq *= noise_horiz_scale
-                    value += amp * noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=seed)
-                value /= amp_normalizer
-                value = (value * 0.5) + 0.5
-                array[x][y] = value
-            progress(x, size_total)
-    elif type == TempTypeElevation or type == TempTypeElevDistCtr:
-        for x in range(size_total):
-            for y in range(size_total):
-                value = 1.0 - topography[x][y]
-                array[x][y] = value
-            progress(x, size_total)
-    elif type == TempTypeDistCtr:
-        for x in range(size_total):
-            for y in range(size_total):
-                array[x][y] = 1.0
-            progress(x, size_total)
+    if type not in TempNoiseTypes or array is None:
+        array = new_array(topography.shape, numpy.float, file_path)
+        try:
+            generate_temperature(array, topography, type)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
     # apply topography data
     logging.info("apply topography data to temperature")
-    for x in range(size_total):
-        for y in range(size_total):
-            value = array[x][y]
-            # distance to ocean
-            if type == TempTypeNoise or type == TempTypeElevation or type == TempTypeElevDistCtr:
-                altitude = topography[x][y]
-                distance_to_ocean = 0.0
-                if altitude > ocean_altitude:
-                    distance_to_ocean = (altitude - ocean_altitude) / (1.0 - ocean_altitude)
-                else:
-                    distance_to_ocean = 0.0  # 1.0 - altitude / ocean_altitude
-                value -= 0.2 * distance_to_ocean
-            # distance to center
-            if type == TempTypeNoise or type == TempTypeDistCtr or type == TempTypeElevDistCtr:
-                _x, _y = 2.0 * (0.5 - x / size_total), 2.0 * (0.5 - y / size_total)
-                dist_to_center = min(1.0, math.sqrt(_x ** 2 + _y ** 2))
-                value *= 1.25 * (1.0 - dist_to_center)
-            #
-            value = max(0.0, min(1.0, value))
-            array[x][y] = value
-        progress(x, size_total)
+    if type in TempShoreTypes and (shore is None or shore.ndim < 2):
+        logging.error("no shore distance data")
+        return False
+    for_each_band(temperature_band, size_total, topography, array, type, 0, 0, shore, config['temperature'].getfloat('shore_range'))
     # normalize
-    normalize(array)
+    value_ranges[TempDataFileName] = normalize(array)
     # histogram
     histogram(array)
     # write array
     logging.info("save temperature file: " + file_path)
     try:
-        numpy.save(file_path, array)
+        save_array(file_path, array)
     except Exception as e:
         logging.exception(str(e))
         return False
     return True
 
-def do_humidity(topography):
+def generate_humidity_noise(array, first_row, first_col=0):
+    # perlin noise of the noise humidity type
+    fractal = fbm.Fractal.from_config(config['humidity'], 1024)
+    for_each_band(fractal_band, array.shape[0], fractal, array, first_row, first_col)
+
+def generate_humidity(array, topography, type, first_row=0, first_col=0):
+    # humidity for array and topography whose first pixel is (first_row, first_col)
+    if type in HumidityNoiseTypes:
+        generate_humidity_noise(array, first_row, first_col)
+    elif type == HumidityTypeElevation:
+        for_each_band(invert_band, array.shape[0], topography, array)
+
+def do_humidity(topography, shore, array=None, value_range=None):
+    # array and value_range are given when merging shards; shore is used by the
+    # *_shore types
     logging.info("generate humidity data file")
     file_path = os.path.join(directory, HumidityDataFileName)
     # type
     type = config['humidity'].get('type')
-    # perlin noise seed
-    seed = config['humidity'].getfloat('perlin_seed')
-    # perlin noise layers
-    layers = list()
-    i_layer = 0
-    try:
-        while i_layer >= 0:
-            var_name = "perlin_layer_%i" % i_layer
-            if var_name in config['humidity']:
-                freq, amp = config['humidity'].get(var_name).split()
-                layers.append((float(freq), float(amp)))
-                i_layer += 1
-                continue
-            i_layer = -1
-    except Exception as e:
-        logging.exception(str(e))
-        return False
     # delete file
     if not delete_file(file_path):
         return False
-    # array
-    array = numpy.zeros(topography.shape, dtype=numpy.float)
-    # normalizer divisor for perlin levels amplitudes
-    amp_normalizer = 0.0
-    for freq, amp in layers:
-        amp_normalizer += amp
     # generate data
     logging.info("generate humidity data, type=" + type)
-    if type == HumidityTypeNoise:
-        repeat = 1024
-        for x in range(size_total):
-            for y in range(size_total):
-                value = 0.0
-                # for each perlin level
-                for freq, amp in layers:
-                    value += amp * noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=seed)
-                value /= amp_normalizer
-                value = (value * 0.5) + 0.5
-                array[x][y] = value
-            progress(x, size_total)
-    elif type == HumidityTypeElevation:
-        for x in range(size_total):
-            for y in range(size_total):
-                value = 1.0 - topography[x][y]
-                array[x][y] = value
-            progress(x, size_total)
+    if type not in HumidityNoiseTypes or array is None:
+        array, value_range = new_array(topography.shape, numpy.float, file_path), None
+        try:
+            generate_humidity(array, topography, type)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
     # apply topography data
     # ~ if type == HumidityTypeNoise:
         # ~ logging.info("apply topography data to humidity")
@@ -495,70 +983,837 @@ def do_humidity(topography):
                 # ~ array[x][y] = value
             # ~ progress(x, size_total)
     # normalize
-    normalize(array)
+    value_ranges[HumidityDataFileName] = normalize(array, value_range)
+    # apply distance to the shore, to the normalized noise
+    if type in HumidityShoreTypes:
+        if shore is None or shore.ndim < 2:
+            logging.error("no shore distance data")
+            return False
+        logging.info("apply shore distance data to humidity")
+        for_each_band(humidity_band, size_total, array, shore, config['humidity'].getfloat('shore_range'))
     # histogram
     histogram(array)
     # write array
     logging.info("save humidity file: " + file_path)
     try:
-        numpy.save(file_path, array)
+        save_array(file_path, array)
     except Exception as e:
         logging.exception(str(e))
         return False
     return True
 
-def do_noise():
+def generate_noise(array, first_row, first_col=0):
+    fractal = fbm.Fractal.from_config(config['noise'], 32)
+    logging.info("generate noise data")
+    for_each_band(fractal_band, array.shape[0], fractal, array, first_row, first_col)
+
+def do_noise(array=None, value_range=None):
+    # array and value_range are given when merging shards
     logging.info("generate noise data file")
     file_path = os.path.join(directory, NoiseDataFileName)
-    # perlin noise seed
-    seed = config['noise'].getfloat('perlin_seed')
-    # perlin noise layers
-    layers = list()
-    i_layer = 0
-    try:
-        while i_layer >= 0:
-            var_name = "perlin_layer_%i" % i_layer
-            if var_name in config['noise']:
-                freq, amp = config['noise'].get(var_name).split()
-                layers.append((float(freq), float(amp)))
-                i_layer += 1
-                continue
-            i_layer = -1
-    except Exception as e:
-        logging.exception(str(e))
-        return False
     # delete file
     if not delete_file(file_path):
         return False
     # array
-    array = numpy.zeros((size_total, size_total), dtype=numpy.float)
-    # normalizer divisor for perlin levels amplitudes
-    amp_normalizer = 0.0
-    for freq, amp in layers:
-        amp_normalizer += amp
-    # generate data
-    logging.info("generate noise data")
-    repeat = 32
-    for x in range(size_total):
-        for y in range(size_total):
-            value = 0.0
-            # for each perlin level
-            for freq, amp in layers:
-                value += amp * noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=seed)
-            value /= amp_normalizer
-            value = (value * 0.5) + 0.5
-            array[x][y] = value
-        progress(x, size_total)
+    if array is None:
+        array = new_array((size_total, size_total), numpy.float, file_path)
+        try:
+            generate_noise(array, 0)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
     # normalize
-    normalize(array)
+    value_ranges[NoiseDataFileName] = normalize(array, value_range)
     # histogram
     histogram(array)
     # write array
     logging.info("save noise file: " + file_path)
     try:
-        numpy.save(file_path, array)
+        save_array(file_path, array)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def config_digest():
+    # fingerprint of the land description, to match shards with their land
+    sections = {name: dict(config[name]) for name in config.sections()}
+    return hashlib.sha1(json.dumps(sections, sort_keys=True).encode()).hexdigest()
+
+def file_hash(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_sidecar(file_name):
+    # sidecar of an output, None if either is missing or the output changed
+    # since; the one in the container if the output is missing and is in it
+    file_path = os.path.join(directory, file_name)
+    if file_name != ContainerFileName and not os.path.exists(file_path):
+        land = open_container()
+        if land is None or file_name not in land.layers:
+            return None
+        return land.layers[file_name]["attributes"].get("sidecar")
+    try:
+        with open(os.path.join(directory, SidecarFileName % file_name)) as file:
+            sidecar = json.load(file)
+        stat = os.stat(file_path)
+    except (OSError, ValueError):
+        return None
+    if sidecar.get("size") != stat.st_size or sidecar.get("mtime_ns") != stat.st_mtime_ns:
+        return None
+    return sidecar
+
+def shore_needed():
+    # whether the temperature or the humidity type depends on the distance to the shore
+    return config['temperature'].get('type') in TempShoreTypes or config['humidity'].get('type') in HumidityShoreTypes
+
+def stage_depends(name):
+    # stages a stage depends on, for the types of the land: the distance to the
+    # shore only if the temperature or humidity type needs it
+    depends = Stages[name]["depends"]
+    if name == "temperature" and config['temperature'].get('type') not in TempShoreTypes:
+        return [depend for depend in depends if depend != "shore_distance"]
+    if name == "humidity" and config['humidity'].get('type') not in HumidityShoreTypes:
+        return [depend for depend in depends if depend != "shore_distance"]
+    if name == "container" and not shore_needed():
+        return [depend for depend in depends if depend not in ShoreStages]
+    return depends
+
+def default_stages():
+    # stages generated when none is asked for, all of them but the optional ones
+    return [name for name in Stages if name not in OptionalStages or (name in ShoreStages and shore_needed())]
+
+def container_inputs(name):
+    # data files a stage reads quantized from the container, their files missing
+    land = None
+    inputs = list()
+    for depend in stage_depends(name):
+        for file_name in Stages[depend]["outputs"]:
+            if file_name.endswith(".npy") and not os.path.exists(os.path.join(directory, file_name)):
+                land = land or open_container()
+                if land is not None and file_name in land.layers and land.layers[file_name].get("range") is not None:
+                    inputs.append(file_name)
+    return inputs
+
+def stage_memory(name):
+    # bytes a stage is estimated to use; the erosion of the topography adds its
+    # source and target states and a band with its halos per worker
+    memory = size_total * size_total * Stages[name]["memory"]
+    if name == "topography" and config['erosion'].getint('iterations') > 0:
+        state = erosion.Channels * numpy.dtype(numpy.float32).itemsize
+        with rss_lock:
+            workers = len(multiprocessing.active_children()) if pool is not None else 1
+        band_rows = min(size_total, erosion_band_rows() + 2 * erosion.Radius * ErosionExchangeIterations)
+        memory += 2 * size_total * size_total * state + max(1, workers) * band_rows * size_total * state
+    return memory
+
+def stage_key(name):
+    # fingerprint of everything the outputs of a stage are generated from, None
+    # if an upstream output is not in the cache
+    stage = Stages[name]
+    values = {"size_total": size_total, "world_step": world_step, "noise_horiz_scale": noise_horiz_scale, "ocean_altitude": ocean_altitude}
+    key = {"version": CacheVersion,
+           "stage": name,
+           "sections": {section: dict(config[section]) for section in stage["sections"]},
+           "globals": {value: values[value] for value in stage["globals"]},
+           "inputs": dict()}
+    for depend in stage_depends(name):
+        for file_name in Stages[depend]["outputs"]:
+            sidecar = read_sidecar(file_name)
+            if sidecar is None:
+                return None
+            key["inputs"][file_name] = sidecar["hash"]
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def stage_fresh(name):
+    # whether the outputs of a stage are in the cache, generated from its current
+    # inputs; not if generated from data quantized in the container and the
+    # exact files are back
+    key = stage_key(name)
+    if key is None:
+        return False
+    exact = None
+    for file_name in Stages[name]["outputs"]:
+        sidecar = read_sidecar(file_name)
+        if sidecar is None or sidecar["key"] != key:
+            return False
+        if sidecar.get("source") == "container":
+            if exact is None:
+                exact = len(container_inputs(name)) == 0
+            if exact:
+                return False
+    return True
+
+def record_stage(name):
+    # writes the sidecars of the outputs of a stage just generated, marked if
+    # generated from data quantized in the container
+    key = stage_key(name)
+    source = "container" if len(container_inputs(name)) > 0 else None
+    for file_name in Stages[name]["outputs"]:
+        file_path = os.path.join(directory, file_name)
+        try:
+            stat = os.stat(file_path)
+            sidecar = {"key": key, "hash": file_hash(file_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            if file_name in value_ranges:
+                sidecar["value_range"] = value_ranges[file_name]
+            if source is not None:
+                sidecar["source"] = source
+            with open(os.path.join(directory, SidecarFileName % file_name), "w") as file:
+                json.dump(sidecar, file, indent=1)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+    return True
+
+def required_stages(targets):
+    # targets and the stages they depend on
+    required = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in required:
+            required.add(name)
+            pending += stage_depends(name)
+    return required
+
+def get_data(file_name):
+    # load_data, once for all the stages that read file_name
+    with loaded_lock:
+        if loaded.get(file_name) is None:
+            loaded[file_name] = load_data(file_name)
+        return loaded[file_name]
+
+def run_stage(name, stages, merged):
+    # generates the outputs of a scheduled stage; stages are the pack stages
+    # to generate for the pack stage
+    if name == "noise":
+        return do_noise(*merged.get("noise", (None, None)))
+    elif name == "topography":
+        # the noise is not used by the topography
+        return do_topography(size_total, None, *merged.get("topography", (None, None)))
+    elif name == "normals":
+        return do_normals(get_data(TopoDataFileName))
+    elif name == "shore_distance":
+        return do_shore_distance(get_data(TopoDataFileName))
+    elif name == "shoreline_image":
+        return do_shoreline_image(get_data(ShoreDataFileName))
+    elif name == "temperature":
+        shore = get_data(ShoreDataFileName) if config['temperature'].get('type') in TempShoreTypes else None
+        return do_temperature(get_data(TopoDataFileName), shore, merged.get("temperature", (None, None))[0])
+    elif name == "humidity":
+        shore = get_data(ShoreDataFileName) if config['humidity'].get('type') in HumidityShoreTypes else None
+        return do_humidity(get_data(TopoDataFileName), shore, *merged.get("humidity", (None, None)))
+    elif name == "topography_image":
+        return do_image(get_data(TopoDataFileName), TopoImageFileName)
+    elif name == "temperature_image":
+        return do_image(get_data(TempDataFileName), TempImageFileName)
+    elif name == "humidity_image":
+        return do_image(get_data(HumidityDataFileName), HumidityImageFileName)
+    elif name == "noise_image":
+        return do_image(get_data(NoiseDataFileName), NoiseImageFileName)
+    elif name == PackStage:
+        # slopes image; pack temperature, humidity and noise data into image; pack terrain
+        # indices, blend factor and noise into image; generate 2 alpha blend maps
+        alpha = "pack_images_alpha" in stages
+        sparse = "pack_images_sparse" in stages
+        return do_pack_images(get_data(TopoDataFileName) if alpha or sparse else None, get_data(NormalsDataFileName),
+                              get_data(TempDataFileName), get_data(HumidityDataFileName), get_data(NoiseDataFileName),
+                              "pack_images_thn" in stages, "pack_images_bld" in stages, alpha, "slopes_image" in stages, sparse)
+    elif name == "biome_lut":
+        return do_biome_lut()
+    elif name == "pyramid":
+        return do_pyramid(get_data(TopoDataFileName), get_data(NormalsDataFileName), get_data(TempDataFileName),
+                          get_data(HumidityDataFileName), get_data(NoiseDataFileName))
+    elif name == "preview_image":
+        return do_preview_image(get_data(TopoDataFileName), get_data(NormalsDataFileName), get_data(TempDataFileName),
+                                get_data(HumidityDataFileName), get_data(NoiseDataFileName))
+    elif name == "dds_textures":
+        return do_dds_textures(get_data(TopoDataFileName), get_data(NormalsDataFileName), get_data(ShoreDataFileName),
+                               get_data(TempDataFileName), get_data(HumidityDataFileName), get_data(NoiseDataFileName))
+    elif name == "container":
+        return do_container()
+    elif name == "terrain_tiles":
+        return do_terrain_tiles(get_data(TopoDataFileName), get_data(NormalsDataFileName), get_data(TempDataFileName),
+                                get_data(HumidityDataFileName), get_data(NoiseDataFileName))
+    return False
+
+def run_scheduled_stage(name, stages, merged, times, profile):
+    # runs in a thread of the scheduler, with its metrics; returns True on success
+    stage_metrics = {phase: 0.0 for phase in MetricsPhases}
+    metrics[name] = stage_metrics
+    current_stage.phases = stage_metrics
+    profiler = cProfile.Profile() if profile else None
+    times[name] = [time.perf_counter(), None]
+    try:
+        with loaded_lock:
+            for stage in stages:
+                for file_name in Stages[stage]["outputs"]:
+                    loaded.pop(file_name, None)
+        if profiler is not None:
+            profiler.enable()
+        try:
+            with sample_rss(stage_metrics):
+                success = run_stage(name, stages, merged)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        for stage in stages:
+            with measure("io"):
+                success = success and record_stage(stage)
+    except Exception as e:
+        logging.exception(str(e))
+        success = False
+    times[name][1] = time.perf_counter()
+    current_stage.phases = None
+    # metrics
+    seconds = times[name][1] - times[name][0]
+    stage_metrics["compute"] = max(0.0, seconds - sum(stage_metrics[phase] for phase in MetricsPhases))
+    stage_metrics["seconds"] = seconds
+    stage_metrics["bytes_written"] = 0
+    for stage in stages:
+        for file_name in Stages[stage]["outputs"]:
+            file_path = os.path.join(directory, file_name)
+            if os.path.exists(file_path):
+                stage_metrics["bytes_written"] += os.path.getsize(file_path)
+    stage_metrics["profile"] = profiler
+    logging.info("%s %s in %.2fs (%s)" % (name, "done" if success else "failed", seconds,
+                                         ", ".join("%s %.2fs" % (phase, stage_metrics[phase]) for phase in MetricsPhases)))
+    return success
+
+def critical_path(graph, times):
+    # chain of stages that ended last, each one waiting for the dependency that ended last
+    path = list()
+    names = [name for name in times if times[name][1] is not None]
+    name = max(names, key=lambda name: times[name][1]) if names else None
+    while name is not None:
+        path.insert(0, name)
+        depends = [depend for depend in graph[name] if depend in names]
+        name = max(depends, key=lambda depend: times[depend][1]) if depends else None
+    return path
+
+def write_metrics(file_path, seconds, profile):
+    # metrics of the stages run to file_path (if any), cProfile dump of the slowest one
+    names = [name for name in metrics]
+    slowest = max(names, key=lambda name: metrics[name]["seconds"]) if names else None
+    profile_path = None
+    if profile and slowest is not None:
+        profile_path = os.path.join(directory, ProfileFileName % slowest)
+        logging.info("profile of %s: %s" % (slowest, profile_path))
+        stats = pstats.Stats(metrics[slowest]["profile"])
+        stats.dump_stats(profile_path)
+        stats.sort_stats("cumulative").print_stats(15)
+    if file_path is None:
+        return True
+    report = {"seconds": seconds,
+              "peak_rss_kb": peak_rss(),
+              "slowest": slowest,
+              "profile": profile_path,
+              "stages": {name: {key: value for key, value in metrics[name].items() if key != "profile"} for name in names}}
+    logging.info("save metrics file: " + file_path)
+    try:
+        with open(file_path, "w") as file:
+            json.dump(report, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def run_stages(targets, forced, merged, jobs, memory_limit, profile=False, metrics_file=None):
+    # runs the stages of targets and their dependencies that are not up to date,
+    # as soon as their dependencies are, up to jobs at the same time and within
+    # memory_limit bytes (if not 0) of estimated memory; metrics are written to
+    # metrics_file, if given; returns True on success
+    required = required_stages(targets)
+    graph = dict()
+    for name in Stages:
+        if name in required:
+            node = PackStage if name in PackStages else name
+            graph.setdefault(node, set()).update(PackStage if depend in PackStages else depend for depend in stage_depends(name))
+    memory = {node: sum(stage_memory(name) for name in required if name == node or (node == PackStage and name in PackStages))
+              for node in graph}
+    pending, running, done = list(graph), dict(), set()
+    times, success = dict(), True
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(jobs)
+    while success and (pending or running):
+        # start the stages whose dependencies are done, in build order
+        started = True
+        while started and len(running) < jobs:
+            started = False
+            for node in pending:
+                if not graph[node] <= done:
+                    continue
+                used = sum(memory[other] for other in running.values())
+                if running and memory_limit and used + memory[node] > memory_limit:
+                    continue
+                pending.remove(node)
+                # the keys of a stage depend on the outputs of its dependencies,
+                # so it is checked once they are done
+                stages = [name for name in required if (name == node or (node == PackStage and name in PackStages))
+                          and (name in forced or not stage_fresh(name))]
+                if len(stages) == 0:
+                    logging.info("%s is up to date" % node)
+                    done.add(node)
+                else:
+                    running[executor.submit(run_scheduled_stage, node, stages, merged, times, profile)] = node
+                started = True
+                break
+        if not running:
+            if pending:
+                logging.error("stages can not be scheduled: " + ", ".join(pending))
+                success = False
+            break
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            node = running.pop(future)
+            if future.result():
+                done.add(node)
+            else:
+                success = False
+    # stages already started finish
+    executor.shutdown()
+    # critical path
+    path = critical_path(graph, times)
+    if path:
+        logging.info("critical path: " + " > ".join("%s %.2fs" % (name, times[name][1] - times[name][0]) for name in path))
+    report = {"seconds": time.perf_counter() - start,
+              "critical_path": [{"stage": name, "start": times[name][0] - start, "end": times[name][1] - start} for name in path],
+              "stages": {name: {"start": t[0] - start, "end": t[1] - start} for name, t in times.items() if t[1] is not None}}
+    try:
+        with open(os.path.join(directory, CriticalPathFileName), "w") as file:
+            json.dump(report, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
+    # metrics
+    if not write_metrics(metrics_file, report["seconds"], profile):
+        success = False
+    return success
+
+def shard_layers():
+    # layers with row-local raw data, that can be generated by shards
+    layers = {"noise": generate_noise, "topography": generate_topography}
+    if config['temperature'].get('type') in TempNoiseTypes:
+        layers["temperature"] = generate_temperature_noise
+    if config['humidity'].get('type') in HumidityNoiseTypes:
+        layers["humidity"] = generate_humidity_noise
+    return layers
+
+def tile_rows(tile, tiles):
+    return tile * size_total // tiles, (tile + 1) * size_total // tiles
+
+def do_shard(tiles, first_tile, last_tile, layer_names):
+    # raw data of the requested layers for the rows of tiles [first_tile, last_tile)
+    start, stop = tile_rows(first_tile, tiles)[0], tile_rows(last_tile - 1, tiles)[1]
+    logging.info("generate shard of tiles [%i, %i) of %i, rows [%i, %i)" % (first_tile, last_tile, tiles, start, stop))
+    shards_directory = os.path.join(directory, ShardsDirName)
+    if not os.path.exists(shards_directory):
+        try:
+            os.makedirs(shards_directory, exist_ok=True)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+    layers = shard_layers()
+    manifest = {"config": config_digest(),
+                "size_total": size_total,
+                "tiles": tiles,
+                "tile_range": [first_tile, last_tile],
+                "rows": [start, stop],
+                "layers": dict()}
+    for name in layer_names:
+        if name not in layers:
+            logging.warning("%s data depends on the whole topography, it is generated when merging" % name)
+            continue
+        file_name = ShardDataFileName % (name, start, stop)
+        file_path = os.path.join(shards_directory, file_name)
+        array = new_array((stop - start, size_total), numpy.float, file_path)
+        try:
+            layers[name](array, start)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+        valmin, valmax = reduce_minmax(array)
+        logging.info("save shard data file: " + file_name)
+        try:
+            save_array(file_path, array)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+        manifest["layers"][name] = {"file": file_name, "min": float(valmin), "max": float(valmax)}
+    file_path = os.path.join(shards_directory, ShardManifestFileName % (start, stop))
+    logging.info("save shard manifest: " + file_path)
+    try:
+        with open(file_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def do_merge(layer_names):
+    # assembles the raw data of shards; returns {name: (array, (min, max))}, or None on error
+    shards_directory = os.path.join(directory, ShardsDirName)
+    manifests = list()
+    try:
+        for file_name in sorted(os.listdir(shards_directory)):
+            if file_name.endswith(".json"):
+                with open(os.path.join(shards_directory, file_name)) as file:
+                    manifests.append(json.load(file))
+    except Exception as e:
+        logging.exception(str(e))
+        return None
+    digest = config_digest()
+    merged = dict()
+    for name in layer_names:
+        shards = [m for m in manifests if name in m["layers"] and m["config"] == digest and m["size_total"] == size_total]
+        shards.sort(key=lambda m: m["rows"][0])
+        # shards must cover every row exactly once
+        row = 0
+        for manifest in shards:
+            if manifest["rows"][0] != row:
+                break
+            row = manifest["rows"][1]
+        if row != size_total or len(shards) == 0:
+            logging.error("shards of %s data do not cover the land, rows covered up to %i of %i" % (name, row, size_total))
+            return None
+        logging.info("merge %i shards of %s data" % (len(shards), name))
+        array = new_array((size_total, size_total), numpy.float, os.path.join(shards_directory, ShardMergedFileName % name))
+        for manifest in shards:
+            start, stop = manifest["rows"]
+            try:
+                array[start:stop] = numpy.load(os.path.join(shards_directory, manifest["layers"][name]["file"]), mmap_mode='r', allow_pickle=False)
+            except Exception as e:
+                logging.exception(str(e))
+                return None
+        value_range = min(m["layers"][name]["min"] for m in shards), max(m["layers"][name]["max"] for m in shards)
+        merged[name] = (array, value_range)
+    return merged
+
+def region_layer(name, topography, shore, x0, y0, x1, y1):
+    # raw data of a layer in the rectangle [x0, x1) x [y0, y1)
+    array = new_array((x1 - x0, y1 - y0), numpy.float)
+    if name == "noise":
+        generate_noise(array, x0, y0)
+    elif name == "topography":
+        generate_topography(array, x0, y0)
+    elif name == "temperature":
+        type = config['temperature'].get('type')
+        band = numpy.array(topography[x0:x1, y0:y1])
+        shore_band = numpy.array(shore[x0:x1, y0:y1]) if type in TempShoreTypes else None
+        generate_temperature(array, band, type, x0, y0)
+        for_each_band(temperature_band, array.shape[0], band, array, type, x0, y0, shore_band, config['temperature'].getfloat('shore_range'))
+    elif name == "humidity":
+        generate_humidity(array, numpy.array(topography[x0:x1, y0:y1]), config['humidity'].get('type'), x0, y0)
+    return array
+
+def region_pixels(name, file_name, arrays, start, stop):
+    # pixels of the rows [start, stop) of an image of a stage
+    rows = slice(start, stop)
+    if name in PackStages:
+        return pack_band(rows, arrays[TopoDataFileName], arrays[NormalsDataFileName], arrays[TempDataFileName],
+                         arrays[HumidityDataFileName], arrays[NoiseDataFileName], Stages[name]["outputs"],
+                         sparse_materials())[2][file_name]
+    return image_band(rows, arrays[Stages[Stages[name]["depends"][0]]["outputs"][0]])
+
+def record_region(name, sidecars, fresh, region):
+    # updates the sidecars of the outputs of a stage edited in a region; the key is
+    # kept unless the stage was up to date, so a full build still regenerates the
+    # stages whose config changed
+    key = stage_key(name) if fresh else None
+    for file_name in Stages[name]["outputs"]:
+        file_path = os.path.join(directory, file_name)
+        sidecar = dict(sidecars[file_name])
+        try:
+            stat = os.stat(file_path)
+            sidecar.update({"hash": file_hash(file_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+            if key is not None:
+                sidecar["key"] = key
+            sidecar["regions"] = sidecar.get("regions", list()) + [list(region)]
+            with open(os.path.join(directory, SidecarFileName % file_name), "w") as file:
+                json.dump(sidecar, file, indent=1)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+    return True
+
+def do_region(targets, region):
+    # regenerates the outputs of the targets in the rectangle region=(x0, y0, x1, y1),
+    # x0 and x1 being rows, editing in place the files of a previous full build:
+    # data is normalized with the range of that build, normals, slopes and packed
+    # images are regenerated one pixel around the rectangle too, and only the
+    # bands of the images with those rows are encoded again; the stages of
+    # RegionWholeStages are generated again whole
+    x0, y0, x1, y1 = region
+    logging.info("generate region [%i, %i) x [%i, %i)" % (x0, x1, y0, y1))
+    # halo, the pixels whose normals depend on the altitudes in the rectangle
+    hx0, hy0, hx1, hy1 = max(0, x0 - 1), max(0, y0 - 1), min(size_total, x1 + 1), min(size_total, y1 + 1)
+    names = [name for name in Stages if name in targets]
+    # the files are edited in place, and the data read exact: none can be only
+    # in the container
+    for name in names:
+        file_names = [file_name for depend in stage_depends(name) for file_name in Stages[depend]["outputs"] if file_name.endswith(".npy")]
+        if name not in RegionWholeStages:
+            file_names += Stages[name]["outputs"]
+        for file_name in file_names:
+            if not os.path.exists(os.path.join(directory, file_name)):
+                logging.error("%s is missing (or only in the container), the region needs the files of a full build of %s" % (file_name, name))
+                return False
+    sidecars, fresh = dict(), dict()
+    for name in names:
+        fresh[name] = stage_fresh(name)
+        for file_name in Stages[name]["outputs"]:
+            sidecars[file_name] = read_sidecar(file_name)
+            if sidecars[file_name] is None:
+                logging.error("%s changed or missing since the last build, the region needs a full build of %s" % (file_name, name))
+                return False
+            if file_name.endswith(".npy") and name not in RegionWholeStages + ["normals"] and "value_range" not in sidecars[file_name]:
+                logging.error("no normalization range of %s, the region needs a full build of %s" % (file_name, name))
+                return False
+    # data files, edited in place
+    arrays = dict()
+    for file_name in (NoiseDataFileName, TopoDataFileName, NormalsDataFileName, ShoreDataFileName, TempDataFileName, HumidityDataFileName):
+        file_path = os.path.join(directory, file_name)
+        if os.path.exists(file_path):
+            try:
+                arrays[file_name] = shared.map_array(file_path, mode='r+')
+            except Exception as e:
+                logging.exception(str(e))
+                return False
+    band_rows = max(1, BandPixels // size_total)
+    for name in names:
+        logging.info("generate %s in region" % name)
+        # the distance to the shore, levels of detail and tiles are generated
+        # again whole, from the edited data
+        if name in RegionWholeStages:
+            if not run_stage(name, [name], dict()):
+                return False
+            if name == "shore_distance":
+                try:
+                    arrays[ShoreDataFileName] = shared.map_array(os.path.join(directory, ShoreDataFileName))
+                except Exception as e:
+                    logging.exception(str(e))
+                    return False
+            if not record_region(name, sidecars, fresh[name], region):
+                return False
+            continue
+        for file_name in Stages[name]["outputs"]:
+            if file_name.endswith(".npy") and name != "normals":
+                array = arrays[file_name]
+                try:
+                    band = region_layer(name, arrays.get(TopoDataFileName), arrays.get(ShoreDataFileName), x0, y0, x1, y1)
+                except Exception as e:
+                    logging.exception(str(e))
+                    return False
+                normalize(band, sidecars[file_name]["value_range"])
+                numpy.clip(band, 0.0, 1.0, out=band)
+                if name == "humidity" and config['humidity'].get('type') in HumidityShoreTypes:
+                    for_each_band(humidity_band, band.shape[0], band, numpy.array(arrays[ShoreDataFileName][x0:x1, y0:y1]),
+                                  config['humidity'].getfloat('shore_range'))
+                array[x0:x1, y0:y1] = band
+            elif name == "normals":
+                array = arrays[file_name]
+                band = new_array((hx1 - hx0, hy1 - hy0, 3), numpy.float32)
+                for_each_band(normals_band, band.shape[0], arrays[TopoDataFileName], band, hx0, slice(hy0, hy1))
+                array[hx0:hx1, hy0:hy1] = band
+            else:
+                rows = slice(x0, x1) if name not in PackStages else slice(hx0, hx1)
+                logging.info("save image file rows [%i, %i): %s" % (rows.start, rows.stop, file_name))
+                try:
+                    with measure("io"):
+                        pngwriter.update_png(os.path.join(directory, file_name), rows,
+                                             lambda start, stop: region_pixels(name, file_name, arrays, start, stop),
+                                             band_rows, png_level)
+                except Exception as e:
+                    logging.exception(str(e))
+                    return False
+                continue
+            logging.info("save data file: " + file_name)
+            try:
+                save_array(os.path.join(directory, file_name), array)
+            except Exception as e:
+                logging.exception(str(e))
+                return False
+        if not record_region(name, sidecars, fresh[name], region):
+            return False
+    return True
+
+def preview_band(rows, topography, normals, temperature, humidity, noise_array):
+    # composite pixels of a band of rows: colors of the terrain7 weights lit by
+    # the normals on land, and the sea darker with depth
+    slopes = generate_slopes_data(normals[rows])
+    band_topography = topography[rows]
+    weights, bad = calculate_alpha_weights(band_topography, slopes, temperature[rows], humidity[rows], noise_array[rows])
+    lod.renormalize(weights)
+    colors = numpy.zeros(len(PreviewColors) * 3).reshape((len(PreviewColors), 3))
+    for index, color in PreviewColors.items():
+        colors[index] = color
+    light = numpy.array(PreviewLight) / numpy.linalg.norm(PreviewLight)
+    shade = numpy.clip(normals[rows] @ light, 0.0, 1.0) * 0.6 + 0.4
+    land = weights @ colors * shade[..., None]
+    depth = numpy.clip(band_topography / ocean_altitude, 0.0, 1.0)[..., None] if ocean_altitude > 0 else 1.0
+    sea = numpy.array(PreviewSeaColors[0]) * (1.0 - depth) + numpy.array(PreviewSeaColors[1]) * depth
+    pixels = numpy.empty(band_topography.shape + (4,), dtype=numpy.uint8)
+    pixels[..., 0:3] = numpy.where((band_topography < ocean_altitude)[..., None], sea, land)
+    pixels[..., 3] = 255
+    return pixels
+
+def do_preview_image(topography, normals, temperature, humidity, noise_array):
+    file_path = os.path.join(directory, PreviewImageFileName)
+    logging.info("generate image: " + file_path)
+    # delete file
+    if not delete_file(file_path):
+        return False
+    # check data
+    inputs = {"topography": topography, "normals": normals, "temperature": temperature, "humidity": humidity, "noise": noise_array}
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
+    # pixels are written as their bands are generated
+    size = topography.shape[0]
+    try:
+        with measure("io"):
+            writer = pngwriter.Writer(file_path, size, size, "RGBA8", png_level)
+        try:
+            for band in map_bands(preview_band, size, topography, normals, temperature, humidity, noise_array):
+                with measure("io"):
+                    writer.write(band)
+        except:
+            writer.abort()
+            raise
+        with measure("io"):
+            writer.close()
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def dds_source_band(rows, topography, normals, shore, temperature, humidity, noise_array, shore_range):
+    # pixels of every dds texture for a band of rows; the normals are their
+    # horizontal components, the vertical one follows from them
+    pixels = {DdsTopoFileName: image_band(rows, topography), DdsShorelineFileName: shoreline_band(rows, shore, shore_range)}
+    band_normals = numpy.empty(normals[rows].shape[:2] + (2,), dtype=numpy.uint8)
+    numpy.multiply(normals[rows][..., 0::2] * 0.5 + 0.5, 255, out=band_normals, casting='unsafe')
+    pixels[DdsNormalsFileName] = band_normals
+    packed = pack_band(rows, topography, normals, temperature, humidity, noise_array,
+                       [SlopesImageFileName, THNImageFileName, ALPHAImageFileName0, ALPHAImageFileName1])[2]
+    pixels[DdsSlopesFileName] = packed[SlopesImageFileName][..., 0]
+    pixels[DdsTHNFileName] = packed[THNImageFileName]
+    pixels[DdsAlphaFileName0] = packed[ALPHAImageFileName0]
+    pixels[DdsAlphaFileName1] = packed[ALPHAImageFileName1]
+    return pixels
+
+def dds_band(rows, image, format):
+    # blocks of a band of rows of blocks of a mip level
+    return dds.encode(image[4 * rows.start:4 * rows.stop], format)
+
+def do_dds_textures(topography, normals, shore, temperature, humidity, noise_array):
+    # block compressed textures with their full mip chains: the images are
+    # generated whole from the data, every level is box filtered from the one
+    # before it, and the blocks of each level are encoded in bands of rows
+    file_paths = {file_name: os.path.join(directory, file_name) for file_name in DdsFormats}
+    logging.info("generate dds textures: " + ", ".join(file_paths.values()))
+    # delete files
+    for file_path in file_paths.values():
+        if not delete_file(file_path):
+            return False
+    # check data
+    inputs = {"topography": topography, "normals": normals, "shore distance": shore, "temperature": temperature, "humidity": humidity, "noise": noise_array}
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
+    shore_range = config['shoreline'].getfloat('range')
+    size = topography.shape[0]
+    try:
+        # images
+        logging.info("generating textures pixels...")
+        images = dict()
+        x0 = 0
+        for pixels in map_bands(dds_source_band, size, topography, normals, shore, temperature, humidity, noise_array, shore_range):
+            for file_name, band in pixels.items():
+                if file_name not in images:
+                    images[file_name] = new_array((size, size) + band.shape[2:], numpy.uint8)
+                images[file_name][x0:x0 + band.shape[0]] = band
+            x0 += band.shape[0]
+        # textures
+        for file_name, file_path in file_paths.items():
+            image = images.pop(file_name)
+            format = DdsFormats[file_name]
+            if format == "rgba":
+                format = "bc1" if (image[..., 3] == 255).all() else "bc3"
+            sizes = dds.level_sizes(size, size)
+            logging.info("save dds file: %s, %s, %i levels" % (file_path, format, len(sizes)))
+            with open(file_path, "wb") as file:
+                with measure("io"):
+                    file.write(dds.header(format, size, size, len(sizes)))
+                for level, (width, height) in enumerate(sizes):
+                    if level > 0:
+                        with measure("compute"):
+                            level_image = dds.downsample(image)
+                        image = new_array(level_image.shape, numpy.uint8)
+                        image[...] = level_image
+                        del level_image
+                    block_rows = (height + 3) // 4
+                    band_blocks = max(1, BandPixels // (4 * width))
+                    bands = [slice(b0, min(block_rows, b0 + band_blocks)) for b0 in range(0, block_rows, band_blocks)]
+                    for data in map_slices(dds_band, bands, block_rows, image, format):
+                        with measure("io"):
+                            file.write(data)
+            del image
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def open_container():
+    # container of the land, None if there is none or it changed since it was built
+    if read_sidecar(ContainerFileName) is None:
+        return None
+    try:
+        return container.Container(os.path.join(directory, ContainerFileName))
+    except Exception as e:
+        logging.exception(str(e))
+        return None
+
+def do_container():
+    # data files and images in a single file; the sidecars of the files go
+    # with them, so the files can be removed and still be read from it. the
+    # container replaces the previous one once written, the files missing are
+    # taken from that one
+    file_path = os.path.join(directory, ContainerFileName)
+    logging.info("generate container: " + file_path)
+    previous = open_container()
+    quantization = config['container'].get('quantize')
+    compression = config['container'].get('compression')
+    logging.info("quantization: %s, compression: %s" % (quantization, compression))
+    writer = None
+    try:
+        writer = container.Writer(file_path)
+        for name in stage_depends("container"):
+            for file_name in Stages[name]["outputs"]:
+                attributes = {"sidecar": read_sidecar(file_name)}
+                logging.info("add to container: " + file_name)
+                if file_name.endswith(".npy"):
+                    array = get_data(file_name)
+                    if array is None or array.ndim < 2:
+                        raise ValueError("no data: " + file_name)
+                    with measure("io"):
+                        writer.add_array(file_name, array, quantization, compression, max(1, BandPixels // size_total), attributes)
+                elif os.path.exists(os.path.join(directory, file_name)) or previous is None:
+                    with measure("io"):
+                        writer.add_file(file_name, os.path.join(directory, file_name), attributes)
+                else:
+                    with measure("io"):
+                        writer.add_bytes(file_name, previous.file(file_name), attributes)
+        with measure("io"):
+            writer.close()
     except Exception as e:
         logging.exception(str(e))
+        if writer is not None:
+            writer.abort()
         return False
     return True
 
@@ -573,88 +1828,367 @@ def do_image(array_data, file_name):
     if len(array_data) == 0:
         log.error("no data")
         return False
-    #
-    array_pxl = numpy.zeros(array_data.shape, dtype=numpy.uint8)
-    #
+    # pixels are written as their bands are generated
     size = array_data.shape[0]
-    for x in range(size):
-        for y in range(size):
-            value = array_data[x][y]
-            value *= int(255)
-            array_pxl[x][y] = value
-        progress(x, size_total)
+    counts = numpy.zeros(256, dtype=numpy.int64)
+    try:
+        with measure("io"):
+            writer = pngwriter.Writer(file_path, size, size, "L8", png_level)
+        try:
+            for band in map_bands(image_band, size, array_data):
+                counts += numpy.bincount(band.reshape(-1), minlength=256)
+                with measure("io"):
+                    writer.write(band)
+        except:
+            writer.abort()
+            raise
+        with measure("io"):
+            writer.close()
+    except Exception as e:
+        logging.exception(str(e))
+        return False
     # histogram
-    histogram(array_pxl)
-    #
-    png.from_array(array_pxl, "L;8").save(file_path)
+    histogram_pixels(counts)
     return True
 
-def do_pack_image_thn(normals, temperature, humidity, noise_array):
-    #
-    file_name = THNImageFileName
-    file_path = os.path.join(directory, file_name)
-    logging.info("generate packed image for temperature, humidity and noise: " + file_path)
-    # delete file
-    if not delete_file(file_path):
+def pack_band(rows, topography, normals, temperature, humidity, noise_array, file_names, materials=None):
+    # bands of the requested images, returns the count of bad pixels for bld and
+    # alpha, the pixels by image file name and the reconstruction error of the
+    # sparse splat map (sum and maximum per pixel, and pixels with more materials)
+    bad_bld, bad_alpha = 0, 0
+    sparse_error = (0.0, 0.0, 0)
+    slopes = generate_slopes_data(normals[rows])
+    pixels = dict()
+    for file_name in file_names:
+        channels = 1 if file_name == SlopesImageFileName else 4
+        pixels[file_name] = numpy.empty(slopes.shape + (channels,), dtype=numpy.uint8)
+    if SlopesImageFileName in pixels:
+        numpy.multiply(slopes, 255, out=pixels[SlopesImageFileName][..., 0], casting='unsafe')
+    thn = THNImageFileName in pixels
+    bld = BLDImageFileName in pixels
+    alpha = ALPHAImageFileName0 in pixels
+    sparse = SparseImageFileName in pixels
+    if not (thn or bld or alpha or sparse):
+        return bad_bld, bad_alpha, pixels, sparse_error
+    band_temperature, band_humidity, band_noise = temperature[rows], humidity[rows], noise_array[rows]
+    if bld:
+        indices, blend_factors, bad_bld = calculate_bld_data(slopes, band_temperature, band_humidity)
+        pixels_bld = pixels[BLDImageFileName]
+        pixels_bld[..., 0] = indices
+        numpy.multiply(blend_factors, 255, out=pixels_bld[..., 1], casting='unsafe')
+        numpy.multiply(slopes, 255, out=pixels_bld[..., 2], casting='unsafe')
+        numpy.multiply(band_noise, 255, out=pixels_bld[..., 3], casting='unsafe')
+    elif thn:
+        blend_factors = calculate_bld_factors(band_humidity, slopes)
+    if thn:
+        pixels_thn = pixels[THNImageFileName]
+        numpy.multiply(band_temperature, 255, out=pixels_thn[..., 0], casting='unsafe')
+        numpy.multiply(blend_factors, 255, out=pixels_thn[..., 1], casting='unsafe')
+        numpy.multiply(slopes, 255, out=pixels_thn[..., 2], casting='unsafe')
+        numpy.multiply(band_noise, 255, out=pixels_thn[..., 3], casting='unsafe')
+    if alpha or sparse:
+        weights, bad_alpha = calculate_alpha_weights(topography[rows], slopes, band_temperature, band_humidity, band_noise)
+    if alpha:
+        numpy.multiply(weights[..., 0:4], 255, out=pixels[ALPHAImageFileName0], casting='unsafe')
+        numpy.multiply(weights[..., 4:8], 255, out=pixels[ALPHAImageFileName1], casting='unsafe')
+    if sparse:
+        # pixels without weights are all zeros, indices and weights
+        indices, quantized = calculate_sparse_weights(weights, materials)
+        pixels_sparse = pixels[SparseImageFileName]
+        pixels_sparse[..., 0] = indices[..., 0] | (indices[..., 1] << 4)
+        pixels_sparse[..., 1] = indices[..., 2] if materials > 2 else 0
+        pixels_sparse[..., 2] = quantized[..., 0]
+        pixels_sparse[..., 3] = quantized[..., 1]
+        # error against the weights renormalized, as the shader blends them
+        decoded = numpy.zeros(weights.shape)
+        numpy.put_along_axis(decoded, indices, quantized / 255.0, axis=-1)
+        lod.renormalize(weights)
+        error = numpy.abs(decoded - weights).sum(axis=-1)
+        sparse_error = (float(error.sum()), float(error.max(initial=0.0)), int(numpy.count_nonzero(numpy.count_nonzero(weights, axis=-1) > materials)))
+    return bad_bld, bad_alpha, pixels, sparse_error
+
+def sparse_materials():
+    # heaviest materials per pixel of the sparse splat map, from the config
+    materials = config['sparse'].getint('materials')
+    if materials not in SparseMaterials:
+        logging.warning("materials of the sparse splat map must be one of %s, got %i and will be adjusted to %i" % (SparseMaterials, materials, SparseMaterials[-1]))
+        materials = SparseMaterials[-1]
+    return materials
+
+def do_pack_images(topography, normals, temperature, humidity, noise_array, thn, bld, alpha, slopes_image, sparse=False):
+    # slopes image and packed images in one pass over the data, only the
+    # requested outputs are generated
+    file_names = list()
+    if thn:
+        file_names.append(THNImageFileName)
+    if bld:
+        file_names.append(BLDImageFileName)
+    if alpha:
+        file_names += [ALPHAImageFileName0, ALPHAImageFileName1]
+    if sparse:
+        file_names.append(SparseImageFileName)
+    if slopes_image:
+        file_names.append(SlopesImageFileName)
+    file_paths = [os.path.join(directory, file_name) for file_name in file_names]
+    logging.info("generate images: " + ", ".join(file_paths))
+    # delete files
+    for file_path in file_paths:
+        if not delete_file(file_path):
+            return False
+    # check data
+    inputs = {"normals": normals}
+    if thn or bld or alpha or sparse:
+        inputs.update({"temperature": temperature, "humidity": humidity, "noise": noise_array})
+    if alpha or sparse:
+        inputs["topography"] = topography
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
+    # pixels are written as their bands are generated
+    size = normals.shape[0]
+    writers = dict()
+    counts = {file_name: numpy.zeros(256, dtype=numpy.int64) for file_name in file_names}
+    bad_bld, bad_alpha = 0, 0
+    materials = sparse_materials() if sparse else None
+    error_sum, error_max, dropped = 0.0, 0.0, 0
+    logging.info("generating images pixels...")
+    try:
+        for file_name, file_path in zip(file_names, file_paths):
+            logging.info("save image file: " + file_path)
+            mode = "L8" if file_name == SlopesImageFileName else "RGBA8"
+            with measure("io"):
+                writers[file_name] = pngwriter.Writer(file_path, size, size, mode, png_level)
+        for band_bld, band_alpha, pixels, band_error in map_bands(pack_band, size, topography, normals, temperature, humidity, noise_array, file_names, materials):
+            bad_bld, bad_alpha = bad_bld + band_bld, bad_alpha + band_alpha
+            error_sum, error_max, dropped = error_sum + band_error[0], max(error_max, band_error[1]), dropped + band_error[2]
+            for file_name, band in pixels.items():
+                if file_name == SlopesImageFileName or file_name == THNImageFileName:
+                    counts[file_name] += numpy.bincount(band.reshape(-1), minlength=256)
+                with measure("io"):
+                    writers[file_name].write(band)
+        for file_name in file_names:
+            with measure("io"):
+                writers.pop(file_name).close()
+    except Exception as e:
+        logging.exception(str(e))
+        for writer in writers.values():
+            writer.abort()
         return False
-    #
-    size = temperature.shape[0]
-    array_pxl = numpy.zeros((size, size * 4), dtype=numpy.uint8)
-    #
-    slopes = generate_slopes_data(normals)
-    #
-    logging.info("generating image data...")
-    for x in range(size):
-        for y in range(size):
-            y_shft = 4 * y
-            value0 = temperature[x][y]
-            value0 *= int(255)
-            value1 = calculate_bld_factor(humidity[x][y], slopes[x][y])
-            value1 *= int(255)
-            value2 = slopes[x][y]
-            value2 *= int(255)
-            value3 = noise_array[x][y]
-            value3 *= int(255)
-            array_pxl[x][y_shft + 0] = value0
-            array_pxl[x][y_shft + 1] = value1
-            array_pxl[x][y_shft + 2] = value2
-            array_pxl[x][y_shft + 3] = value3
-        progress(x, size_total)
+    if bad_bld > 0:
+        logging.error("calculate_bld_data: unexpected temperature in %i pixels" % bad_bld)
+    if bad_alpha > 0:
+        logging.error("no blend data in %i pixels" % bad_alpha)
+    if sparse:
+        logging.info("sparse splat map, %i materials: weight error mean %.5f max %.5f, %i pixels (%.2f%%) with more materials"
+                     % (materials, error_sum / (size * size), error_max, dropped, 100.0 * dropped / (size * size)))
     # histogram
-    histogram(array_pxl)
-    #
-    png.from_array(array_pxl, "RGBA").save(file_path)
+    if slopes_image:
+        histogram_pixels(counts[SlopesImageFileName])
+    if thn:
+        histogram_pixels(counts[THNImageFileName])
     return True
 
-def do_pack_image_bld(topography, normals, temperature, humidity, noise_array):
-    #
-    file_name = BLDImageFileName
-    file_path = os.path.join(directory, file_name)
-    logging.info("generate packed image for terrain indices, blend factor and noise: " + file_path)
+def level_file_name(file_name, level):
+    # image of a level of the pyramid, level 0 being the image itself
+    if level == 0:
+        return file_name
+    name, extension = os.path.splitext(file_name)
+    return "%s_%i%s" % (name, level, extension)
+
+def pyramid_band(rows, topography, normals, temperature, humidity, noise_array):
+    # level 1 of the pyramid for a band of its rows, from the rows of the land
+    # around them: average, minimum and maximum altitudes, splat channels and
+    # terrain5 indices
+    size = topography.shape[0]
+    fine = slice(max(0, 2 * rows.start - 1), min(size, 2 * rows.stop))
+    padding = (1 if rows.start == 0 else 0, 1 if fine.stop == size else 0)
+    slopes = generate_slopes_data(normals[fine])
+    band_temperature, band_humidity, band_noise = temperature[fine], humidity[fine], noise_array[fine]
+    weights, bad_alpha = calculate_alpha_weights(topography[fine], slopes, band_temperature, band_humidity, band_noise)
+    indices, blend_factors, bad_bld = calculate_bld_data(slopes, band_temperature, band_humidity)
+    splat = numpy.empty(slopes.shape + (PyramidSplatChannels,), dtype=numpy.float32)
+    splat[..., 0:8] = weights
+    for channel, values in enumerate((band_temperature, blend_factors, slopes, band_noise)):
+        splat[..., 8 + channel] = values
+    height = lod.pad(topography[fine], padding)
+    splat = lod.reduce(lod.pad(splat, padding), lod.BoxWeights)
+    lod.renormalize(splat[..., 0:8])
+    return (lod.reduce(height, lod.TentWeights), lod.extreme(height, numpy.fmin), lod.extreme(height, numpy.fmax),
+            splat, indices[2 * rows.start - fine.start::2, ::2])
+
+def pyramid_images(height, height_min, height_max, splat, indices):
+    # pixels of the images of a level, by image file name
+    size = height.shape[0]
+    pixels = {TopoImageFileName: numpy.empty((size, size), dtype=numpy.uint8)}
+    numpy.multiply(height, 255, out=pixels[TopoImageFileName], casting='unsafe')
+    bounds = numpy.empty((size, size, 4), dtype=numpy.uint8)
+    bounds[..., 0] = numpy.floor(height_min * 255)
+    bounds[..., 1] = pixels[TopoImageFileName]
+    bounds[..., 2] = numpy.ceil(height_max * 255)
+    bounds[..., 3] = 255
+    pixels[TopoBoundsImageFileName] = bounds
+    for file_name in (ALPHAImageFileName0, ALPHAImageFileName1, THNImageFileName, BLDImageFileName):
+        pixels[file_name] = numpy.empty((size, size, 4), dtype=numpy.uint8)
+    numpy.multiply(splat[..., 0:4], 255, out=pixels[ALPHAImageFileName0], casting='unsafe')
+    numpy.multiply(splat[..., 4:8], 255, out=pixels[ALPHAImageFileName1], casting='unsafe')
+    numpy.multiply(splat[..., 8:12], 255, out=pixels[THNImageFileName], casting='unsafe')
+    pixels[BLDImageFileName][..., 0] = indices
+    numpy.multiply(splat[..., 9:12], 255, out=pixels[BLDImageFileName][..., 1:4], casting='unsafe')
+    return pixels
+
+def do_pyramid(topography, normals, temperature, humidity, noise_array):
+    # levels of detail of the heightmap and the splat maps, down to PyramidMinSize:
+    # the heightmap keeps the average, minimum and maximum altitudes and the splat
+    # maps are box filtered, their alpha weights renormalized; terrain5 indices
+    # can not be averaged, they are decimated. level 1 is generated from the data
+    # in bands of rows, every other level from the level before it
+    file_path = os.path.join(directory, PyramidFileName)
+    logging.info("generate pyramid: " + file_path)
     # delete file
     if not delete_file(file_path):
         return False
-    #
+    # check data
+    inputs = {"topography": topography, "normals": normals, "temperature": temperature, "humidity": humidity, "noise": noise_array}
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
     size = topography.shape[0]
-    array_pxl = numpy.zeros((size, size * 4), dtype=numpy.uint8)
-    #
-    slopes = generate_slopes_data(normals)
-    #
-    logging.info("generating image pixels...")
-    for x in range(size):
-        for y in range(size):
-            y_shft = 4 * y
-            #
-            indices, blend_factor = calculate_data_bld(topography[x][y], slopes[x][y], temperature[x][y], humidity[x][y])
-            adj_noise = noise_array[x][y]
-            adj_noise *= int(255)
-            array_pxl[x][y_shft + 0] = indices
-            array_pxl[x][y_shft + 1] = blend_factor
-            array_pxl[x][y_shft + 2] = int(255) * slopes[x][y]
-            array_pxl[x][y_shft + 3] = adj_noise
-        progress(x, size_total)
-    #
-    png.from_array(array_pxl, "RGBA").save(file_path)
+    manifest = {"size_total": size,
+                "levels": [{"level": 0, "size": size, "files": [TopoImageFileName, ALPHAImageFileName0, ALPHAImageFileName1, THNImageFileName, BLDImageFileName]}]}
+    level_data = None
+    for level, level_size in enumerate(lod.level_sizes(size, PyramidMinSize), 1):
+        logging.info("generate pyramid level %i, size %i" % (level, level_size))
+        if level_data is None:
+            bands = for_each_band(pyramid_band, level_size, topography, normals, temperature, humidity, noise_array)
+            level_data = [numpy.concatenate([band[i] for band in bands]) for i in range(5)]
+            del bands
+        else:
+            height, height_min, height_max, splat, indices = level_data
+            level_data = [lod.reduce(lod.pad(height), lod.TentWeights),
+                          lod.extreme(lod.pad(height_min), numpy.fmin),
+                          lod.extreme(lod.pad(height_max), numpy.fmax),
+                          lod.reduce(lod.pad(splat), lod.BoxWeights),
+                          indices[::2, ::2]]
+            lod.renormalize(level_data[3][..., 0:8])
+        pixels = pyramid_images(*level_data)
+        band_rows = max(1, BandPixels // level_size)
+        files = list()
+        for file_name, image in pixels.items():
+            level_file_path = os.path.join(directory, level_file_name(file_name, level))
+            logging.info("save image file: " + level_file_path)
+            mode = "L8" if image.ndim == 2 else "RGBA8"
+            try:
+                with measure("io"):
+                    pngwriter.write_png(level_file_path, level_size, level_size, mode,
+                                        (image[x0:x0 + band_rows] for x0 in range(0, level_size, band_rows)), png_level)
+            except Exception as e:
+                logging.exception(str(e))
+                return False
+            files.append(level_file_name(file_name, level))
+        manifest["levels"].append({"level": level, "size": level_size, "files": files})
+    # manifest, written last
+    logging.info("save pyramid file: " + file_path)
+    try:
+        with open(file_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    return True
+
+def terrain_tile_band(rows, topography, normals, temperature, humidity, noise_array):
+    # pixels of every tile layer for a band of rows
+    pixels = {"topography": image_band(rows, topography)}
+    band_normals = numpy.empty(normals[rows].shape[:2] + (4,), dtype=numpy.uint8)
+    numpy.multiply(normals[rows] * 0.5 + 0.5, 255, out=band_normals[..., 0:3], casting='unsafe')
+    band_normals[..., 3] = 255
+    pixels["normals"] = band_normals
+    packed = pack_band(rows, topography, normals, temperature, humidity, noise_array,
+                       [THNImageFileName, BLDImageFileName, ALPHAImageFileName0, ALPHAImageFileName1])[2]
+    for name, file_name in (("thn", THNImageFileName), ("bld", BLDImageFileName), ("alpha0", ALPHAImageFileName0), ("alpha1", ALPHAImageFileName1)):
+        pixels[name] = packed[file_name]
+    return pixels, topography[rows].min(axis=0), topography[rows].max(axis=0)
+
+def terrain_tile_size(size):
+    # tile size, a power-of-two-plus-one number as the land size
+    tile_size = config['tiles'].getint('size')
+    tile_size_verified = min(size, int(math.pow(2, int(math.log2(max(2, tile_size - 1))))) + 1)
+    if tile_size != tile_size_verified:
+        logging.warning("tile size must be a power-of-two plus one number not over the land size, got %i and will be adjusted to %i" % (tile_size, tile_size_verified))
+        tile_size = tile_size_verified
+    return tile_size
+
+def do_terrain_tiles(topography, normals, temperature, humidity, noise_array):
+    # every layer cut in tiles of size x size vertices, adjacent tiles sharing
+    # their edge rows and columns as the patches of a terrain do; the png images
+    # of the tiles of a layer are stored one after the other in a file of its
+    # own, and the manifest has the bounds, the altitude range and the offset
+    # of every tile. a row of tiles is generated at a time from the data
+    file_path = os.path.join(directory, TilesManifestFileName)
+    logging.info("generate terrain tiles: " + file_path)
+    # delete files
+    tiles_directory = os.path.join(directory, TilesDirName)
+    layer_paths = {name: os.path.join(tiles_directory, TileLayerFileName % name) for name in TileLayers}
+    for path in [file_path] + list(layer_paths.values()):
+        if not delete_file(path):
+            return False
+    # check data
+    inputs = {"topography": topography, "normals": normals, "temperature": temperature, "humidity": humidity, "noise": noise_array}
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
+    size = topography.shape[0]
+    tile_size = terrain_tile_size(size)
+    step = tile_size - 1
+    tiles = (size - 1) // step
+    logging.info("%ix%i tiles of size %i" % (tiles, tiles, tile_size))
+    manifest = {"size_total": size,
+                "tile_size": tile_size,
+                "tiles": tiles,
+                "layers": {name: {"file": os.path.join(TilesDirName, TileLayerFileName % name), "mode": mode} for name, mode in TileLayers.items()},
+                "tile_list": list()}
+    files = dict()
+    executor = ThreadPoolExecutor(os.cpu_count() or 1)
+    try:
+        if not os.path.exists(tiles_directory):
+            os.makedirs(tiles_directory, exist_ok=True)
+        for name, path in layer_paths.items():
+            files[name] = open(path, "wb")
+        bands = [slice(i * step, i * step + tile_size) for i in range(tiles)]
+        for i, (pixels, band_min, band_max) in enumerate(map_slices(terrain_tile_band, bands, size, topography, normals, temperature, humidity, noise_array)):
+            encoded = [[executor.submit(pngwriter.encode_png, pixels[name][:, j * step:j * step + tile_size], mode, png_level)
+                        for name, mode in TileLayers.items()] for j in range(tiles)]
+            for j in range(tiles):
+                cols = slice(j * step, j * step + tile_size)
+                tile = {"tile": [i, j],
+                        "bounds": [bands[i].start, cols.start, bands[i].stop, cols.stop],
+                        "min": float(band_min[cols].min()),
+                        "max": float(band_max[cols].max()),
+                        "offsets": dict()}
+                for name, future in zip(TileLayers, encoded[j]):
+                    data = future.result()
+                    with measure("io"):
+                        tile["offsets"][name] = [files[name].tell(), len(data)]
+                        files[name].write(data)
+                manifest["tile_list"].append(tile)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
+    finally:
+        executor.shutdown()
+        for file in files.values():
+            file.close()
+    # manifest, written last
+    logging.info("save terrain tiles file: " + file_path)
+    try:
+        with open(file_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
+        return False
     return True
 
 def calculate_data_bld(altitude, slope, temperature, humidity):
@@ -700,45 +2234,6 @@ def calculate_bld_factor(humidity, slope):
     blend_factor = (humidity + slope) / 2;  # !!!
     return blend_factor
 
-def do_pack_image_alpha(topography, normals, temperature, humidity, noise_array):
-    #
-    file_name0 = ALPHAImageFileName0
-    file_name1 = ALPHAImageFileName1
-    file_path0 = os.path.join(directory, file_name0)
-    file_path1 = os.path.join(directory, file_name1)
-    logging.info("generate 2 blend maps: %s and %s" % (file_path0, file_path1))
-    # delete file2
-    if not delete_file(file_path0):
-        return False
-    if not delete_file(file_path1):
-        return False
-    #
-    size = topography.shape[0]
-    array_pxl0 = numpy.zeros((size, size * 4), dtype=numpy.uint8)
-    array_pxl1 = numpy.zeros((size, size * 4), dtype=numpy.uint8)
-    #
-    slopes = generate_slopes_data(normals)
-    #
-    logging.info("generating images pixels...")
-    for x in range(size):
-        for y in range(size):
-            y_shft = 4 * y
-            #
-            data = calculate_data_alpha(topography[x][y], slopes[x][y], temperature[x][y], humidity[x][y], noise_array[x][y])
-            array_pxl0[x][y_shft + 0] = data[0]
-            array_pxl0[x][y_shft + 1] = data[1]
-            array_pxl0[x][y_shft + 2] = data[2]
-            array_pxl0[x][y_shft + 3] = data[3]
-            array_pxl1[x][y_shft + 0] = data[4]
-            array_pxl1[x][y_shft + 1] = data[5]
-            array_pxl1[x][y_shft + 2] = data[6]
-            array_pxl1[x][y_shft + 3] = data[7]
-        progress(x, size_total)
-    #
-    png.from_array(array_pxl0, "RGBA").save(file_path0)
-    png.from_array(array_pxl1, "RGBA").save(file_path1)
-    return True
-
 def calculate_data_alpha(altitude, slope, temperature, humidity, noise):
     #
     data = numpy.array(8 * [0], dtype=numpy.float)
@@ -757,7 +2252,7 @@ def calculate_data_alpha(altitude, slope, temperature, humidity, noise):
         elif temperature > Terr7TempSandTransitionEnd:
             data[Terr7Sand] = 1.0
         else:
-            noise_blend = calculate_blend(noise, 0.4, 0.6)
+            noise_blend = calculate_blend(noise, Terr7NoiseBlendStart, Terr7NoiseBlendEnd)
             data[Terr7DryDirt] = (1.0 - hum_blend) * noise_blend
             data[Terr7WetDirt] = hum_blend * noise_blend
             data[Terr7DryGrass] = (1.0 - hum_blend) * (1.0 - noise_blend)
@@ -789,44 +2284,295 @@ def calculate_blend(value, lower_bound, upper_bound):
     else:
         return (value - lower_bound) / (upper_bound  - lower_bound)
 
-def do_slopes_image(normals):
-    logging.info("generate slopes image file")
-    file_path = os.path.join(directory, SlopesImageFileName)
-    # delete file
-    if not delete_file(file_path):
+# array versions of calculate_data_bld, calculate_bld_factor, calculate_data_alpha
+# and calculate_blend, they work over whole grids or bands of rows; the scalar
+# functions are kept as reference implementation
+
+def calculate_blends(values, lower_bound, upper_bound):
+    blends = (values - lower_bound) / (upper_bound  - lower_bound)
+    blends[values < lower_bound] = 0.0
+    blends[values > upper_bound] = 1.0
+    return blends
+
+def calculate_bld_factors(humidity, slopes):
+    return (humidity + slopes) / 2
+
+def calculate_bld_data(slopes, temperature, humidity):
+    # terrain5 indices and blend factors, and the count of pixels out of range
+    bands = [temperature < 0.20,
+             temperature < 0.40,
+             temperature < 0.60,
+             temperature < 0.80,
+             (temperature <= 1.00) & (humidity < 0.6),
+             temperature <= 1.00]
+    terrain_lower = numpy.select(bands, [TerrMudCracked, TerrDry, TerrDry, TerrMud, TerrCracked, TerrMud])
+    terrain_upper = numpy.select(bands, [TerrSnow, TerrGrassDry, TerrGrassY, TerrGrass, TerrDesert, TerrGrass])
+    terrain_vertical = numpy.select(bands, [TerrMtnDark, TerrMtnDry, TerrMtnDesert, TerrMtnGreen, TerrMtnDesert, TerrMtnDesert])
+    indices = numpy.where(slopes > SlopeTransitionStart, terrain_lower * 16 + terrain_upper, terrain_vertical * 16 + terrain_lower)
+    unexpected = ~bands[-1]
+    indices[unexpected] = 0
+    return indices, calculate_bld_factors(humidity, slopes), numpy.count_nonzero(unexpected)
+
+def calculate_sparse_weights(weights, materials):
+    # indices (..., materials) of the heaviest terrain7 materials, by decreasing
+    # weight, and their weights renormalized to sum 255; index 0 and weight 0
+    # all of them in the pixels without weights
+    heaviest = numpy.argpartition(-weights, materials - 1, axis=-1)[..., :materials]
+    top = numpy.take_along_axis(weights, heaviest, axis=-1)
+    order = numpy.argsort(-top, axis=-1, kind='stable')
+    heaviest = numpy.take_along_axis(heaviest, order, axis=-1)
+    top = numpy.take_along_axis(top, order, axis=-1)
+    total = top.sum(axis=-1, keepdims=True)
+    numpy.divide(top, total, out=top, where=total > 0)
+    quantized = numpy.rint(top * 255).astype(numpy.int32)
+    quantized[..., 1] = numpy.minimum(quantized[..., 1], 255 - quantized[..., 0])
+    quantized[..., -1] = 255 - quantized[..., :-1].sum(axis=-1)
+    empty = total[..., 0] == 0
+    heaviest[empty] = 0
+    quantized[empty] = 0
+    return heaviest.astype(numpy.uint8), quantized
+
+def calculate_alpha_weights(topography, slopes, temperature, humidity, noise_array):
+    # terrain7 weights (..., 8) in [0, 1], and the count of pixels without blend data
+    weights = numpy.zeros(topography.shape + (8,), dtype=numpy.float)
+    beach = topography < (ocean_altitude + 0.05)
+    hum_blend = calculate_blends(humidity, Terr7HumidityBlendStart, Terr7HumidityBlendEnd)
+    slope_blend = calculate_blends(slopes, SlopeTransitionStart, SlopeTransitionEnd)
+    snow_blend = calculate_blends(temperature, Terr7TempSnowTransitionStart, Terr7TempSnowTransitionEnd)
+    sand_blend = calculate_blends(temperature, Terr7TempSandTransitionStart, Terr7TempSandTransitionEnd)
+    noise_blend = calculate_blends(noise_array, Terr7NoiseBlendStart, Terr7NoiseBlendEnd)
+    # land between snow and sand
+    cold = ~beach & (temperature < Terr7TempSnowTransitionStart)
+    hot = ~beach & ~cold & (temperature > Terr7TempSandTransitionEnd)
+    mild = ~beach & ~cold & ~hot
+    snow_transition = mild & (temperature > Terr7TempSnowTransitionStart) & (temperature < Terr7TempSnowTransitionEnd)
+    sand_transition = mild & ~snow_transition & (temperature > Terr7TempSandTransitionStart) & (temperature < Terr7TempSandTransitionEnd)
+    steep = mild & (slope_blend < 1.0)
+    temp_scale = numpy.where(snow_transition, snow_blend, numpy.where(sand_transition, sand_blend, 1.0))
+    slope_scale = numpy.where(steep, slope_blend, 1.0)
+    weights[..., Terr7DryDirt] = numpy.where(mild, (1.0 - hum_blend) * noise_blend, 0.0)
+    weights[..., Terr7WetDirt] = numpy.where(mild, hum_blend * noise_blend, 0.0)
+    weights[..., Terr7DryGrass] = numpy.where(mild, (1.0 - hum_blend) * (1.0 - noise_blend), 0.0)
+    weights[..., Terr7WetGrass] = numpy.where(mild, hum_blend * (1.0 - noise_blend), 0.0)
+    weights *= temp_scale[..., None]
+    weights[..., Terr7Snow] = numpy.select([beach, cold, snow_transition], [1.0 - snow_blend, 1.0, 1.0 - snow_blend])
+    weights[..., Terr7Sand] = numpy.select([beach, hot, sand_transition], [snow_blend, 1.0, sand_blend])
+    weights *= slope_scale[..., None]
+    weights[..., Terr7MtnIce] = numpy.where(steep, 1.0 - snow_blend, 0.0)
+    weights[..., Terr7MtnWhite] = numpy.where(steep, snow_blend, 0.0)
+    return weights, numpy.count_nonzero(~weights.any(axis=-1))
+
+def biome_lut_axes(steps):
+    # (name, coordinate of the first texel, step, size) of the temperature, humidity
+    # and slope axes: a texel every 1/steps of the narrowest transition of the
+    # axis, from one before its first breakpoint to one after its last, so the
+    # breakpoints fall on texels; out of them the weights do not change
+    axes = list()
+    for name, breakpoints in (("temperature", (Terr7TempSnowTransitionStart, Terr7TempSnowTransitionEnd, Terr7TempSandTransitionStart, Terr7TempSandTransitionEnd)),
+                              ("humidity", (Terr7HumidityBlendStart, Terr7HumidityBlendEnd)),
+                              ("slope", (SlopeTransitionStart, SlopeTransitionEnd))):
+        step = min(end - start for start, end in zip(breakpoints[:-1], breakpoints[1:])) / steps
+        size = int(round((breakpoints[-1] - breakpoints[0]) / step)) + 3
+        axes.append((name, breakpoints[0] - step, step, size))
+    return axes
+
+def compile_biome_lut(axes):
+    # terrain7 weights (2, temperature, humidity, slope, 8) at the texels of the
+    # axes, off the beach and on it. the weights are multilinear between
+    # breakpoints, so a trilinear sample is exact but next to the thresholds; at
+    # a breakpoint the weights are taken just above it. the dirt and the grass
+    # channels hold the weights with a noise blend of 1 and of 0, to be scaled
+    # by the noise blend and by its complement
+    coords = [first + step * numpy.arange(size) + BiomeLutNudge for name, first, step, size in axes]
+    temperature, humidity, slopes = numpy.meshgrid(*coords, indexing='ij')
+    lut = numpy.empty((2,) + temperature.shape + (8,))
+    for beach, altitude in enumerate((1.0, 0.0)):
+        topography = numpy.full(temperature.shape, altitude)
+        dirt, bad = calculate_alpha_weights(topography, slopes, temperature, humidity, numpy.ones(temperature.shape))
+        grass, bad = calculate_alpha_weights(topography, slopes, temperature, humidity, numpy.zeros(temperature.shape))
+        lut[beach] = dirt
+        lut[beach][..., [Terr7DryGrass, Terr7WetGrass]] = grass[..., [Terr7DryGrass, Terr7WetGrass]]
+    return lut
+
+def lookup_biome_lut(lut, axes, topography, slopes, temperature, humidity, noise_array):
+    # terrain7 weights from the lut as the shader samples it: the block of the
+    # beach or of the land, filtered trilinearly and clamped to the edges, and
+    # the noise blend applied to the dirt and grass channels
+    beach = (topography < (ocean_altitude + 0.05)).astype(numpy.intp)
+    lows, fractions = list(), list()
+    for (name, first, step, size), values in zip(axes, (temperature, humidity, slopes)):
+        position = numpy.clip((values - first) / step, 0.0, size - 1)
+        low = numpy.minimum(position.astype(numpy.intp), size - 2)
+        lows.append(low)
+        fractions.append(position - low)
+    weights = numpy.zeros(topography.shape + (8,))
+    for corner in itertools.product((0, 1), repeat=3):
+        scale = numpy.ones(topography.shape)
+        for offset, fraction in zip(corner, fractions):
+            scale *= fraction if offset else 1.0 - fraction
+        weights += scale[..., None] * lut[beach, lows[0] + corner[0], lows[1] + corner[1], lows[2] + corner[2]]
+    noise_blend = calculate_blends(noise_array, Terr7NoiseBlendStart, Terr7NoiseBlendEnd)[..., None]
+    weights[..., [Terr7DryDirt, Terr7WetDirt]] *= noise_blend
+    weights[..., [Terr7DryGrass, Terr7WetGrass]] *= 1.0 - noise_blend
+    return weights
+
+def biome_lut_pixels(lut):
+    # lut in an atlas of 8 bit weights (2 * humidity, slope * temperature, 8),
+    # texel (t, h, s) of block b at x = t + s * temperature size, y = h + b * humidity size
+    blocks, sizes = lut.shape[0], lut.shape[1:4]
+    atlas = lut.transpose(0, 2, 3, 1, 4).reshape((blocks * sizes[1], sizes[2] * sizes[0], 8))
+    return numpy.rint(atlas * 255).astype(numpy.uint8)
+
+def do_biome_lut():
+    # terrain7 rules compiled into a lookup table of weights by temperature,
+    # humidity and slope, in two images of the channels of the alpha maps
+    file_path = os.path.join(directory, BiomeLutManifestFileName)
+    logging.info("generate biome lookup table: " + file_path)
+    # delete files
+    for file_name in Stages["biome_lut"]["outputs"]:
+        if not delete_file(os.path.join(directory, file_name)):
+            return False
+    axes = biome_lut_axes(config['biome_lut'].getint('steps'))
+    logging.info("lookup table size: " + " x ".join("%s %i" % (name, size) for name, first, step, size in axes))
+    pixels = biome_lut_pixels(compile_biome_lut(axes))
+    for file_name, channels in ((BiomeLutImageFileName0, slice(0, 4)), (BiomeLutImageFileName1, slice(4, 8))):
+        logging.info("save image file: " + os.path.join(directory, file_name))
+        try:
+            with measure("io"):
+                pngwriter.write_png(os.path.join(directory, file_name), pixels.shape[1], pixels.shape[0], "RGBA8",
+                                    [pixels[..., channels]], png_level)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+    # manifest, written last
+    manifest = {"axes": [{"name": name, "first": first, "step": step, "size": size} for name, first, step, size in axes],
+                "layout": "texel (t, h, s) of block b at x = t + s * temperature size, y = h + b * humidity size, texel i of an axis at first + i * step",
+                "blocks": ["land", "beach"],
+                "beach_altitude": ocean_altitude + 0.05,
+                "images": [BiomeLutImageFileName0, BiomeLutImageFileName1],
+                "channels": [["mtn_white", "mtn_ice", "dry_dirt", "wet_dirt"], ["dry_grass", "wet_grass", "snow", "sand"]],
+                "noise_blend": {"start": Terr7NoiseBlendStart, "end": Terr7NoiseBlendEnd,
+                                "scaled": ["dry_dirt", "wet_dirt"], "scaled_by_complement": ["dry_grass", "wet_grass"]}}
+    logging.info("save biome lookup table file: " + file_path)
+    try:
+        with open(file_path, "w") as file:
+            json.dump(manifest, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
         return False
-    #
-    if len(normals) == 0:
-        log.error("no normals data")
+    return True
+
+def validate_band(rows, lut, axes, topography, normals, temperature, humidity, noise_array, samples):
+    # differences between the weights of the lut and of calculate_alpha_weights in a
+    # band of rows: histogram of the largest difference of each pixel, in steps of
+    # 1/255, pixels whose heaviest terrain differs, and the largest difference with
+    # calculate_data_alpha over the sample pixels of the band
+    slopes = generate_slopes_data(normals[rows])
+    band = (topography[rows], slopes, temperature[rows], humidity[rows], noise_array[rows])
+    weights = lookup_biome_lut(lut, axes, *band)
+    reference, bad = calculate_alpha_weights(*band)
+    difference = numpy.abs(weights - reference).max(axis=-1)
+    counts = numpy.bincount(numpy.minimum(numpy.rint(difference * 255), 255).astype(numpy.intp).reshape(-1), minlength=256)
+    heaviest = numpy.count_nonzero((weights.argmax(axis=-1) != reference.argmax(axis=-1)) & reference.any(axis=-1))
+    scalar = 0.0
+    for x, y in samples:
+        if rows.start <= x < rows.stop:
+            values = [array[x - rows.start, y] for array in band]
+            scalar = max(scalar, numpy.abs(weights[x - rows.start, y] - calculate_data_alpha(*values) / 255).max())
+    return counts, heaviest, scalar
+
+def do_validate_biome_lut(topography, normals, temperature, humidity, noise_array):
+    # compares the weights of the lookup table with the ones of the classifiers
+    # over the data of the land
+    file_path = os.path.join(directory, BiomeLutValidationFileName)
+    logging.info("validate biome lookup table: " + file_path)
+    inputs = {"topography": topography, "normals": normals, "temperature": temperature, "humidity": humidity, "noise": noise_array}
+    for name, array in inputs.items():
+        if array is None or array.ndim < 2:
+            logging.error("no %s data" % name)
+            return False
+    # the table of the land description, 8 bit as in its images
+    axes = biome_lut_axes(config['biome_lut'].getint('steps'))
+    lut = biome_lut_pixels(compile_biome_lut(axes)) / 255.0
+    sizes = [size for name, first, step, size in axes]
+    lut = lut.reshape((2, sizes[1], sizes[2], sizes[0], 8)).transpose(0, 3, 1, 2, 4)
+    size = topography.shape[0]
+    rng = numpy.random.default_rng(0)
+    samples = list(zip(rng.integers(0, size, BiomeLutSamples), rng.integers(0, size, BiomeLutSamples)))
+    counts, heaviest, scalar = numpy.zeros(256, dtype=numpy.int64), 0, 0.0
+    for band_counts, band_heaviest, band_scalar in map_bands(validate_band, size, lut, axes, topography, normals, temperature, humidity, noise_array, samples):
+        counts += band_counts
+        heaviest += band_heaviest
+        scalar = max(scalar, band_scalar)
+    levels = numpy.flatnonzero(counts)
+    total = float(counts.sum())
+    report = {"pixels": int(total),
+              "max_difference": int(levels[-1]) / 255,
+              "mean_difference": float((numpy.arange(256) * counts).sum() / total) / 255,
+              "pixels_over_1": float(counts[2:].sum() / total),
+              "pixels_over_8": float(counts[9:].sum() / total),
+              "heaviest_differs": heaviest / total,
+              "scalar_samples": BiomeLutSamples,
+              "scalar_max_difference": float(scalar)}
+    logging.info("lookup table against the classifier: max difference %.4f, mean %.6f, %.4f%% of pixels over 1/255, heaviest terrain differs in %.4f%%, max difference with the scalar classifier %.4f"
+                 % (report["max_difference"], report["mean_difference"], 100 * report["pixels_over_1"], 100 * report["heaviest_differs"], scalar))
+    try:
+        with open(file_path, "w") as file:
+            json.dump(report, file, indent=1)
+    except Exception as e:
+        logging.exception(str(e))
         return False
-    #
-    array_pxl = numpy.zeros(normals.shape, dtype=numpy.uint8)
-    #
-    size = normals.shape[0]
-    for x in range(size):
-        for y in range(size):
-            normal = normals[x][y]
-            # ~ normal /= numpy.linalg.norm(normal)
-            value = int(abs(numpy.dot(normal, (0, 1, 0))) * 255)
-            array_pxl[x][y] = value
-        progress(x, size_total)
-    # histogram
-    histogram(array_pxl)
-    #
-    png.from_array(array_pxl, "L;8").save(file_path)
+    return True
+
+def configure(land_config):
+    # globals of a land from its description, its directory is created if
+    # needed; returns True on success
+    global config, directory, size_total, noise_horiz_scale, ocean_altitude
+    config = land_config
+    # name
+    land_name = config["global"].get("name")
+    logging.info("land name: " + land_name)
+    if not re.match("[_a-zA-Z][_a-zA-Z0-9]*", land_name):
+        logging.error("characters allowed for name are alphanumeric and underscore")
+        return False
+    # directory
+    if not os.path.exists(land_name):
+        logging.info("directory does not exist, create...")
+        try:
+            os.mkdir(land_name)
+        except Exception as e:
+            logging.exception(str(e))
+            return False
+    directory = land_name
+    # size
+    size_total = config['global'].getint('size_total')
+    size_verified = math.pow(2, int(math.log2(size_total))) + 1
+    if size_total != size_verified:
+        logging.warning("size must be a power-of-two plus one number, got %i and will de adjusted to %i" % (size_total, size_verified))
+        size_total = int(size_verified)
+    # noise horizontal scale
+    noise_horiz_scale = config['global'].getfloat('noise_horiz_scale')
+    # ocean height
+    ocean_altitude = config['global'].getfloat('ocean_altitude')
     return True
 
 def execute():
     print("Land Creator")
-    global config, directory, size_total, noise_horiz_scale, ocean_altitude
+    global config, directory, size_total, world_step, noise_horiz_scale, ocean_altitude, pool, out_of_core, png_level
     # log
     logging.basicConfig(level=logging.DEBUG)
-    # arguments parsing
-    argp = argparse.ArgumentParser()
+    # arguments parsing, "merge" as first argument merges shards
+    argv = sys.argv[1:]
+    merge = len(argv) > 0 and argv[0] == "merge"
+    if merge:
+        argv = argv[1:]
+    argp = argparse.ArgumentParser(usage="%(prog)s [merge] land_file [options]")
     argp.add_argument('land_file', help='land description file')
     argp.add_argument('-d', '--debug', action='store_true', help='logging.level=logging.DEBUG')
     argp.add_argument('-t', '--topography', action='store_true', help='generate topography data file')
     argp.add_argument('-i', '--topography_image', action='store_true', help='generate topography image')
+    argp.add_argument('-s', '--shore_distance', action='store_true', help='generate signed distance to the shoreline data file')
+    argp.add_argument('-x', '--shoreline_image', action='store_true', help='generate signed distance to the shoreline image file')
     argp.add_argument('-e', '--temperature', action='store_true', help='generate temperature data file')
     argp.add_argument('-p', '--temperature_image', action='store_true', help='generate temperature image file')
     argp.add_argument('-u', '--humidity', action='store_true', help='generate humidity data file')
@@ -836,9 +2582,29 @@ def execute():
     argp.add_argument('-k', '--pack_images_thn', action='store_true', help='pack temperature, humidity and noise into RGB in image file')
     argp.add_argument('-b', '--pack_images_bld', action='store_true', help='pack terrain blend data into RGBA in image file')
     argp.add_argument('-a', '--pack_images_alpha', action='store_true', help='generate 2 alpha blend maps')
+    argp.add_argument('--pack_images_sparse', action='store_true', help='pack the heaviest terrain7 materials of every pixel and their weights into RGBA in image file')
     argp.add_argument('-r', '--normals', action='store_true', help='generate normals data file')
     argp.add_argument('-l', '--slopes_image', action='store_true', help='generate slopes image file')
-    args = argp.parse_args()
+    argp.add_argument('-q', '--biome_lut', action='store_true', help='compile the terrain rules into a lookup table of terrain weights by temperature, humidity and slope')
+    argp.add_argument('--validate-lut', action='store_true', help='compare the weights of the lookup table with the ones of the classifiers over the land data')
+    argp.add_argument('-y', '--pyramid', action='store_true', help='generate levels of detail of the topography and the packed images')
+    argp.add_argument('-g', '--terrain_tiles', action='store_true', help='cut the layers in tiles with shared edges, with a manifest, to be streamed')
+    argp.add_argument('-v', '--preview_image', action='store_true', help='generate a composite image of the land')
+    argp.add_argument('--preview', type=int, metavar='K', help='generate a preview, the land sampled every K pixels (a power of two), with its composite image, in a directory of its own')
+    argp.add_argument('--dds_textures', action='store_true', help='encode the layers to block compressed dds textures with their mip chains')
+    argp.add_argument('-c', '--container', action='store_true', help='pack the data files and images into a single file, the data is read from it when the files are missing')
+    argp.add_argument('-f', '--force', action='store_true', help='regenerate the given outputs even if they are up to date')
+    argp.add_argument('-j', '--jobs', type=int, default=1, help='number of stages run at the same time')
+    argp.add_argument('--memory-limit', type=float, default=0, help='MB of estimated memory the stages run at the same time can use, 0 for no limit')
+    argp.add_argument('--profile', action='store_true', help='profile the stages, the profile of the slowest one is dumped to the land directory')
+    argp.add_argument('--metrics', metavar='FILE', help='write time per phase, bytes written and peak memory of every stage to a json file')
+    argp.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    argp.add_argument('--out-of-core', action='store_true', help='map data files in memory and work on them in place, instead of holding whole layers in memory')
+    argp.add_argument('-z', '--png_level', type=int, default=pngwriter.DefaultLevel, choices=range(10), metavar='[0-9]', help='png compression level, 0 is the fastest')
+    argp.add_argument('--region', metavar='X0,Y0,X1,Y1', help='regenerate the given outputs only in the rectangle of rows [X0, X1) and columns [Y0, Y1), editing the files of a previous full build')
+    argp.add_argument('--tiles', type=int, default=1, help='number of row tiles the land is split in for shards')
+    argp.add_argument('--tile-range', help='generate a shard with the data of tiles FIRST:LAST (LAST excluded) of -n, -t, -e and -u, to be merged')
+    args = argp.parse_args(argv)
     # land file
     land_file_path = args.land_file
     if not os.path.exists(land_file_path) or not os.path.isfile(land_file_path):
@@ -855,88 +2621,95 @@ def execute():
     except Exception as e:
         logging.exception(str(e))
         sys.exit()
-    # name
-    land_name = config["global"].get("name")
-    logging.info("land name: " + land_name)
-    if not re.match("[_a-zA-Z][_a-zA-Z0-9]*", land_name):
-        logging.error("characters allowed for name are alphanumeric and underscore")
+    if not configure(config):
         sys.exit()
-    # directory
-    if not os.path.exists(land_name):
-        logging.info("directory does not exist, create...")
+    # preview
+    if args.preview:
+        step = args.preview
+        if step < 2 or step & (step - 1) != 0 or step >= size_total - 1 or (size_total - 1) % step != 0:
+            logging.error("preview step must be a power of two dividing the land size minus one, got %i" % step)
+            sys.exit()
+        world_step = step
+        size_total = (size_total - 1) // step + 1
+        directory = os.path.join(directory, PreviewDirName % step)
+        logging.info("preview of size %i: %s" % (size_total, directory))
         try:
-            os.mkdir(land_name)
+            os.makedirs(directory, exist_ok=True)
         except Exception as e:
             logging.exception(str(e))
             sys.exit()
-    directory = land_name
-    # size
-    size_total = config['global'].getint('size_total')
-    size_verified = math.pow(2, int(math.log2(size_total))) + 1
-    if size_total != size_verified:
-        logging.warning("size must be a power-of-two plus one number, got %i and will de adjusted to %i" % (size_total, size_verified))
-        size_total = int(size_verified)
-    # noise horizontal scale
-    noise_horiz_scale = config['global'].getfloat('noise_horiz_scale')
-    # ocean height
-    ocean_altitude = config['global'].getfloat('ocean_altitude')
-    # noise
-    if args.noise:
-        if not do_noise():
-            sys.exit()
-    noise_array = load_data(NoiseDataFileName)
-    # topography
-    if args.topography:
-        if not do_topography(size_total, noise_array):
-            sys.exit()
-    topography = load_data(TopoDataFileName)
-    # normals
-    if args.normals:
-        if not do_normals(topography):
-            sys.exit()
-    normals = load_data(NormalsDataFileName)
-    # slopes
-    if args.slopes_image:
-        if not do_slopes_image(normals):
+    # png compression
+    png_level = args.png_level
+    # out-of-core
+    out_of_core = args.out_of_core
+    if out_of_core:
+        logging.info("out-of-core mode")
+    # workers
+    if args.workers > 1:
+        logging.info("workers: %i" % args.workers)
+        pool = multiprocessing.Pool(args.workers, initializer=init_worker, initargs=(worker_state(),))
+    # stages asked for, all of them but the optional ones if none is
+    targets = [name for name in Stages if getattr(args, name)]
+    if len(targets) == 0:
+        targets = default_stages()
+    if args.preview and "preview_image" not in targets:
+        targets.append("preview_image")
+    if args.validate_lut:
+        targets += [name for name in ("topography", "normals", "temperature", "humidity", "noise") if name not in targets]
+    layer_names = [name for name in ("noise", "topography", "temperature", "humidity") if name in targets]
+    # shard
+    if args.tile_range:
+        try:
+            first_tile, last_tile = [int(tile) for tile in args.tile_range.split(":")]
+        except ValueError:
+            logging.error("tile range must be FIRST:LAST, got " + args.tile_range)
             sys.exit()
-    # topography image
-    if args.topography_image:
-        if not do_image(topography, TopoImageFileName):
+        if not 0 <= first_tile < last_tile <= args.tiles:
+            logging.error("tile range %s out of %i tiles" % (args.tile_range, args.tiles))
             sys.exit()
-    # temperature
-    if args.temperature:
-        if not do_temperature(topography):
+        if not do_shard(args.tiles, first_tile, last_tile, layer_names):
             sys.exit()
-    temperature = load_data(TempDataFileName)
-    # temperature image
-    if args.temperature_image:
-        if not do_image(temperature, TempImageFileName):
+        stop_workers()
+        return
+    # region
+    if args.region:
+        try:
+            region = [int(value) for value in args.region.split(",")]
+            x0, y0, x1, y1 = region
+        except ValueError:
+            logging.error("region must be X0,Y0,X1,Y1, got " + args.region)
             sys.exit()
-    # humidity
-    if args.humidity:
-        if not do_humidity(topography):
+        if not (0 <= x0 < x1 <= size_total and 0 <= y0 < y1 <= size_total):
+            logging.error("region %s out of the land of size %i" % (args.region, size_total))
             sys.exit()
-    humidity = load_data(HumidityDataFileName)
-    # humidity image
-    if args.humidity_image:
-        if not do_image(humidity, HumidityImageFileName):
+        if merge or args.tile_range:
+            logging.error("a region can not be generated from shards")
             sys.exit()
-    # noise image
-    if args.noise_image:
-        if not do_image(noise_array, NoiseImageFileName):
+        if "topography" in targets and config['erosion'].getint('iterations') > 0:
+            logging.error("the erosion changes the whole topography, a region of it can not be generated")
             sys.exit()
-    # pack temperature, humidity and noise data into image
-    if args.pack_images_thn:
-        if not do_pack_image_thn(normals, temperature, humidity, noise_array):
+        if not do_region(targets, region):
             sys.exit()
-    # pack terrain indices, blend factor and noise into image
-    if args.pack_images_bld:
-        if not do_pack_image_bld(topography, normals, temperature, humidity, noise_array):
+        stop_workers()
+        return
+    # merge shards
+    merged = dict()
+    if merge:
+        merged = do_merge([name for name in layer_names if name in shard_layers()])
+        if merged is None:
             sys.exit()
-    # generate 2 alpha blend maps
-    if args.pack_images_alpha:
-        if not do_pack_image_alpha(topography, normals, temperature, humidity, noise_array):
+    # stages whose outputs are missing or out of date; the given ones are
+    # regenerated anyway with --force, merged ones always are
+    forced = set(merged) | (set(targets) if args.force else set())
+    if not run_stages(targets, forced, merged, max(1, args.jobs), int(args.memory_limit * 1024 * 1024), args.profile, args.metrics):
+        sys.exit()
+    # lookup table validation
+    if args.validate_lut:
+        if not do_validate_biome_lut(get_data(TopoDataFileName), get_data(NormalsDataFileName), get_data(TempDataFileName),
+                                     get_data(HumidityDataFileName), get_data(NoiseDataFileName)):
             sys.exit()
+    # workers
+    stop_workers()
 
 if __name__ == "__main__":
     execute()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# streaming PNG writer. rows are given in bands, each band is filtered and
+# deflated on a thread pool (numpy and zlib release the GIL) as an independent
+# piece of a single zlib stream, and the pieces are written in order as IDAT
+# chunks; neither the whole image nor its compressed data are held in memory.
+# since the pieces are independent, rows of an image can be encoded again
+# keeping the compressed data of the other bands (update_png).
+
+import io
+import os
+import struct
+import zlib
+import numpy
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# mode: color type, bit depth, channels, sample dtype
+Modes = {"L8": (0, 8, 1, numpy.dtype(numpy.uint8)),
+         "L16": (0, 16, 1, numpy.dtype(">u2")),
+         "RGBA8": (6, 8, 4, numpy.dtype(numpy.uint8))}
+
+DefaultLevel = 6
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# empty final deflate block, closes the stream after the last band
+_FINAL_BLOCK = b"\x03\x00"
+_ADLER_BASE = 65521
+
+
+def _adler32_combine(adler1, adler2, length2):
+    # adler32 of the concatenation of two pieces, as adler32_combine in zlib
+    rem = length2 % _ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % _ADLER_BASE
+    sum1 += (adler2 & 0xffff) + _ADLER_BASE - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + _ADLER_BASE - rem
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum1 >= _ADLER_BASE:
+        sum1 -= _ADLER_BASE
+    if sum2 >= 2 * _ADLER_BASE:
+        sum2 -= 2 * _ADLER_BASE
+    if sum2 >= _ADLER_BASE:
+        sum2 -= _ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def _mode(color_type, depth):
+    for mode, (mode_color_type, mode_depth, channels, dtype) in Modes.items():
+        if (mode_color_type, mode_depth) == (color_type, depth):
+            return mode
+    raise ValueError("unsupported png color type %i and bit depth %i" % (color_type, depth))
+
+
+def _read_chunks(file_path):
+    chunks = list()
+    with open(file_path, "rb") as file:
+        if file.read(len(_SIGNATURE)) != _SIGNATURE:
+            raise ValueError("not a png file: " + file_path)
+        while True:
+            header = file.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            data = file.read(length)
+            file.read(4)
+            chunks.append((kind, data))
+    return chunks
+
+
+def _chunk(file, kind, data):
+    file.write(struct.pack(">I", len(data)))
+    file.write(kind)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(kind))))
+
+
+def filter_rows(rows, previous, bpp, adaptive=True):
+    # rows (n, stride) of bytes and the row above them; returns (n, 1 + stride)
+    # filtered rows, the filter of each row chosen by the minimum sum of
+    # absolute differences heuristic, or no filter if not adaptive
+    n, stride = rows.shape
+    out = numpy.empty((n, stride + 1), dtype=numpy.uint8)
+    if not adaptive:
+        out[:, 0] = 0
+        out[:, 1:] = rows
+        return out
+    x = rows.astype(numpy.int16)
+    up = numpy.empty_like(x)
+    up[0] = previous
+    up[1:] = x[:-1]
+    left = numpy.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    upleft = numpy.zeros_like(x)
+    upleft[:, bpp:] = up[:, :-bpp]
+    p = left + up - upleft
+    pa, pb, pc = numpy.abs(p - left), numpy.abs(p - up), numpy.abs(p - upleft)
+    paeth = numpy.where((pa <= pb) & (pa <= pc), left, numpy.where(pb <= pc, up, upleft))
+    del p, pa, pb, pc
+    # none, sub, up, average, paeth; differences wrap modulo 256
+    candidates = numpy.stack((x, x - left, x - up, x - ((left + up) >> 1), x - paeth)).astype(numpy.uint8)
+    cost = numpy.abs(candidates.view(numpy.int8), dtype=numpy.int16).sum(axis=2, dtype=numpy.int64)
+    choice = cost.argmin(axis=0)
+    out[:, 0] = choice
+    out[:, 1:] = candidates[choice, numpy.arange(n)]
+    return out
+
+
+def _compress(rows, previous, bpp, level):
+    data = filter_rows(rows, previous, bpp, level > 0).tobytes()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), zlib.adler32(data), len(data)
+
+
+class Writer:
+
+    def __init__(self, file_path, width, height, mode, level=DefaultLevel, threads=None):
+        # file_path is a path, or a binary file that is left open
+        if mode not in Modes:
+            raise ValueError("unknown png mode " + mode)
+        color_type, depth, self.channels, self.dtype = Modes[mode]
+        self.width, self.height = width, height
+        self.bpp = self.channels * self.dtype.itemsize
+        self.level = level
+        self.rows = 0
+        self.previous = numpy.zeros(width * self.bpp, dtype=numpy.uint8)
+        self.adler = 1
+        # zlib header, for the first IDAT chunk
+        self.head = zlib.compress(b"", level)[:2]
+        threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(threads)
+        self.pending = deque()
+        self.max_pending = 2 * threads
+        self.owns_file = isinstance(file_path, str)
+        self.file = open(file_path, "wb") if self.owns_file else file_path
+        self.file.write(_SIGNATURE)
+        _chunk(self.file, b"IHDR", struct.pack(">IIBBBBB", width, height, depth, color_type, 0, 0, 0))
+
+    def write(self, band):
+        # band of rows (n, width) or (n, width, channels), values in the range of the mode
+        band = numpy.asarray(band)
+        n = band.shape[0]
+        if band.size != n * self.width * self.channels or self.rows + n > self.height:
+            raise ValueError("band of shape %s does not fit a %ix%i image at row %i" % (str(band.shape), self.width, self.height, self.rows))
+        rows = numpy.ascontiguousarray(band, dtype=self.dtype).view(numpy.uint8).reshape((n, -1))
+        self.pending.append(self.executor.submit(_compress, rows, self.previous, self.bpp, self.level))
+        self.previous = rows[-1].copy()
+        self.rows += n
+        while len(self.pending) > self.max_pending:
+            self._flush_next()
+
+    def _flush_next(self):
+        data, adler, length = self.pending.popleft().result()
+        self.adler = _adler32_combine(self.adler, adler, length)
+        if self.head:
+            data, self.head = self.head + data, None
+        _chunk(self.file, b"IDAT", data)
+
+    def close(self):
+        try:
+            while self.pending:
+                self._flush_next()
+            if self.rows != self.height:
+                raise ValueError("%i rows written of %i" % (self.rows, self.height))
+            _chunk(self.file, b"IDAT", (self.head or b"") + _FINAL_BLOCK + struct.pack(">I", self.adler))
+            _chunk(self.file, b"IEND", b"")
+        finally:
+            self.abort()
+
+    def abort(self):
+        # stops without completing the image
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown()
+        if self.owns_file:
+            self.file.close()
+
+
+def write_png(file_path, width, height, mode, bands, level=DefaultLevel, threads=None):
+    # writes the bands of rows given by an iterable
+    writer = Writer(file_path, width, height, mode, level, threads)
+    try:
+        for band in bands:
+            writer.write(band)
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def encode_png(pixels, mode, level=DefaultLevel):
+    # png file of a small image (rows, width) or (rows, width, channels), in memory
+    buffer = io.BytesIO()
+    write_png(buffer, pixels.shape[1], pixels.shape[0], mode, [pixels], level, 1)
+    return buffer.getvalue()
+
+
+def _pieces(idats, stride):
+    # compressed pieces of the bands of an image written by Writer, with their
+    # first row, row count, adler32 and filtered length; None for other images
+    if len(idats) < 2 or len(idats[-1]) != len(_FINAL_BLOCK) + 4 or not idats[-1].startswith(_FINAL_BLOCK):
+        return None
+    pieces = list()
+    row = 0
+    for i, data in enumerate(idats[:-1]):
+        if i == 0:
+            data = data[2:]
+        decompressor = zlib.decompressobj(-15)
+        try:
+            filtered = decompressor.decompress(data)
+        except zlib.error:
+            return None
+        if decompressor.eof or decompressor.unconsumed_tail or len(filtered) % (stride + 1) != 0:
+            return None
+        rows = len(filtered) // (stride + 1)
+        pieces.append([data, row, rows, zlib.adler32(filtered), len(filtered)])
+        row += rows
+    return pieces
+
+
+def update_png(file_path, rows, generate, band_rows, level=DefaultLevel, threads=None):
+    # encodes again the rows in rows (a slice) of an image written by Writer;
+    # generate(start, stop) returns the pixels of rows [start, stop). only the
+    # bands with those rows, and the band after them (whose first row is
+    # filtered with the last of them), are encoded again; images written
+    # otherwise are encoded again whole, in bands of band_rows
+    chunks = _read_chunks(file_path)
+    if len(chunks) == 0 or chunks[0][0] != b"IHDR":
+        raise ValueError("no png header: " + file_path)
+    width, height, depth, color_type = struct.unpack(">IIBB", chunks[0][1][:10])
+    mode = _mode(color_type, depth)
+    channels, dtype = Modes[mode][2], Modes[mode][3]
+    stride = width * channels * dtype.itemsize
+    idats = [data for kind, data in chunks if kind == b"IDAT"]
+    pieces = _pieces(idats, stride)
+    temp_path = file_path + ".tmp"
+    if pieces is None or sum(piece[2] for piece in pieces) != height:
+        write_png(temp_path, width, height, mode,
+                  (generate(start, min(height, start + band_rows)) for start in range(0, height, band_rows)), level, threads)
+        os.replace(temp_path, file_path)
+        return
+    # bands encoded again
+    bpp = channels * dtype.itemsize
+    executor = ThreadPoolExecutor(threads or os.cpu_count() or 1)
+    futures = dict()
+    for i, (data, start, count, adler, length) in enumerate(pieces):
+        if start < rows.stop + 1 and start + count > rows.start:
+            first = max(0, start - 1)
+            band = numpy.asarray(generate(first, start + count))
+            band = numpy.ascontiguousarray(band, dtype=dtype).view(numpy.uint8).reshape((band.shape[0], -1))
+            previous = band[0] if start > 0 else numpy.zeros(stride, dtype=numpy.uint8)
+            futures[i] = executor.submit(_compress, band[start - first:], previous, bpp, level)
+    for i, future in futures.items():
+        pieces[i][0], pieces[i][3], pieces[i][4] = future.result()
+    executor.shutdown()
+    # file written again, with the same chunks
+    adler = 1
+    for piece in pieces:
+        adler = _adler32_combine(adler, piece[3], piece[4])
+    head = idats[0][:2]
+    with open(temp_path, "wb") as file:
+        file.write(_SIGNATURE)
+        idats_written = False
+        for kind, data in chunks:
+            if kind != b"IDAT":
+                _chunk(file, kind, data)
+            elif not idats_written:
+                for i, piece in enumerate(pieces):
+                    _chunk(file, b"IDAT", head + piece[0] if i == 0 else piece[0])
+                _chunk(file, b"IDAT", _FINAL_BLOCK + struct.pack(">I", adler))
+                idats_written = True
+    os.replace(temp_path, file_path)
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# tiles of a land generated on demand, served over http on localhost or on a
+# unix socket. the land description is read once; a tile (tx, ty) of level of
+# detail n has tile_size pixels sampled every 2^n pixels of the full size land,
+# and all its layers are generated at once, from the world space noise, by a
+# pool of workers:
+#
+#   GET /tile/<layer>/<n>/<tx>/<ty>.png  png image of a layer of a tile
+#   GET /manifest                        size, tiles per level, layers and ranges
+#   GET /stats                           cache counters and latency percentiles
+#
+# the layers are normalized with fixed ranges instead of the ones of the whole
+# land: the ranges of a full build of the land if it is up to date, else the
+# ones of a pre-pass over the land sampled every few pixels, saved with the
+# cache. the tiles are kept in memory, the least recently used ones spilled to
+# the disk cache over the memory budget, in a directory of the ranges they
+# were normalized with; requests for a tile being generated
+# wait for it instead of generating it again. the distance to the shore and
+# the erosion need the whole land, their types can not be served.
+
+import logging
+import argparse
+import collections
+import configparser
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path
+import re
+import signal
+import socketserver
+import sys
+import threading
+import time
+import numpy
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import main
+import pngwriter
+
+CacheDirName = "tile_cache"
+RangesFileName = "ranges.json"
+CacheTileFileName = "%s_%i_%i_%i.png"
+# largest size of the land sampled by the pre-pass
+PrepassSize = 1025
+# latencies kept for the percentiles
+LatencySamples = 10000
+Percentiles = [50, 90, 99]
+Sources = ["memory", "disk", "generated", "coalesced"]
+
+TilePath = re.compile(r"^/tile/([a-z0-9]+)/(\d+)/(\d+)/(\d+)\.png$")
+
+# full size land and tiles, and the fixed ranges, in the workers too
+land_size = 2
+tile_size = 2
+ranges = dict()
+png_level = pngwriter.DefaultLevel
+
+
+def check_land():
+    # whether tiles of the land can be generated on their own
+    if main.config['erosion'].getint('iterations') > 0:
+        logging.error("the erosion changes the whole topography, tiles of it can not be generated on their own")
+        return False
+    if main.shore_needed():
+        logging.error("the distance to the shore needs the whole land, the *_shore types can not be served")
+        return False
+    return True
+
+
+def lod_tiles(lod):
+    # tiles per side at a level of detail
+    return (land_size - 1) // (tile_size - 1) >> lod
+
+
+def set_lod(lod):
+    # globals of main for the land sampled every 2^lod pixels
+    main.world_step = 2 ** lod
+    main.size_total = (land_size - 1) // main.world_step + 1
+
+
+def fixed_normalize(array, file_name):
+    main.normalize(array, ranges[file_name])
+    numpy.clip(array, 0.0, 1.0, out=array)
+
+
+def build_ranges():
+    # ranges of a full build of the land, None if it is not up to date
+    found = dict()
+    for name, file_name in (("topography", main.TopoDataFileName), ("temperature", main.TempDataFileName),
+                            ("humidity", main.HumidityDataFileName), ("noise", main.NoiseDataFileName)):
+        if not main.stage_fresh(name):
+            return None
+        sidecar = main.read_sidecar(file_name)
+        if sidecar is None or "value_range" not in sidecar:
+            return None
+        found[file_name] = sidecar["value_range"]
+    return found
+
+
+def prepass_ranges():
+    # ranges of the raw layers over the land sampled every power of two
+    # pixels, of size up to PrepassSize
+    lod = 0
+    while (land_size - 1) // 2 ** lod + 1 > PrepassSize:
+        lod += 1
+    set_lod(lod)
+    size = main.size_total
+    logging.info("pre-pass over the land sampled every %i pixels, size %i" % (main.world_step, size))
+    found = dict()
+    try:
+        topography = numpy.zeros((size, size), dtype=numpy.float)
+        main.generate_topography(topography, 0)
+        found[main.TopoDataFileName] = main.normalize(topography)
+        type = main.config['temperature'].get('type')
+        temperature = numpy.zeros((size, size), dtype=numpy.float)
+        main.generate_temperature(temperature, topography, type)
+        main.for_each_band(main.temperature_band, size, topography, temperature, type)
+        found[main.TempDataFileName] = main.normalize(temperature)
+        del temperature
+        humidity = numpy.zeros((size, size), dtype=numpy.float)
+        main.generate_humidity(humidity, topography, main.config['humidity'].get('type'))
+        found[main.HumidityDataFileName] = main.normalize(humidity)
+        del humidity, topography
+        noise_array = numpy.zeros((size, size), dtype=numpy.float)
+        main.generate_noise(noise_array, 0)
+        found[main.NoiseDataFileName] = main.normalize(noise_array)
+    finally:
+        set_lod(0)
+    return found
+
+
+def load_ranges(cache_directory):
+    # fixed ranges, of a full build, of a previous pre-pass or of a new one
+    found = build_ranges()
+    if found is not None:
+        logging.info("ranges of the full build of the land")
+        return found
+    file_path = os.path.join(cache_directory, RangesFileName)
+    if os.path.exists(file_path):
+        with open(file_path) as file:
+            logging.info("ranges of the pre-pass: " + file_path)
+            return json.load(file)
+    found = prepass_ranges()
+    with open(file_path, "w") as file:
+        json.dump(found, file, indent=1)
+    return found
+
+
+def ranges_digest(found):
+    # fingerprint of the ranges, the tiles normalized with others are not served
+    return hashlib.sha1(json.dumps(found, sort_keys=True).encode()).hexdigest()
+
+
+def init_worker(land_file_path, state):
+    # workers read the land description once, and are silent
+    global land_size, tile_size, ranges, png_level
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger().setLevel(logging.WARNING)
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    config.read(land_file_path)
+    main.configure(config)
+    land_size, tile_size, ranges, png_level = state
+
+
+def generate_tile(lod, tx, ty):
+    # png images of every layer of a tile, and the seconds it took
+    start = time.perf_counter()
+    set_lod(lod)
+    size = main.size_total
+    x0, y0 = tx * (tile_size - 1), ty * (tile_size - 1)
+    # the topography one pixel around the tile, the normals depend on it
+    hx0, hy0, hx1, hy1 = max(0, x0 - 1), max(0, y0 - 1), min(size, x0 + tile_size + 1), min(size, y0 + tile_size + 1)
+    halo = numpy.zeros((hx1 - hx0, hy1 - hy0), dtype=numpy.float)
+    main.generate_topography(halo, hx0, hy0)
+    fixed_normalize(halo, main.TopoDataFileName)
+    normals = numpy.zeros(halo.shape + (3,), dtype=numpy.float32)
+    main.for_each_band(main.normals_band, halo.shape[0], halo, normals)
+    inner = (slice(x0 - hx0, x0 - hx0 + tile_size), slice(y0 - hy0, y0 - hy0 + tile_size))
+    topography, normals = numpy.ascontiguousarray(halo[inner]), numpy.ascontiguousarray(normals[inner])
+    del halo
+    # the other layers
+    type = main.config['temperature'].get('type')
+    temperature = numpy.zeros(topography.shape, dtype=numpy.float)
+    main.generate_temperature(temperature, topography, type, x0, y0)
+    main.for_each_band(main.temperature_band, tile_size, topography, temperature, type, x0, y0)
+    fixed_normalize(temperature, main.TempDataFileName)
+    humidity = numpy.zeros(topography.shape, dtype=numpy.float)
+    main.generate_humidity(humidity, topography, main.config['humidity'].get('type'), x0, y0)
+    fixed_normalize(humidity, main.HumidityDataFileName)
+    noise_array = numpy.zeros(topography.shape, dtype=numpy.float)
+    main.generate_noise(noise_array, x0, y0)
+    fixed_normalize(noise_array, main.NoiseDataFileName)
+    # images
+    pixels = main.terrain_tile_band(slice(0, tile_size), topography, normals, temperature, humidity, noise_array)[0]
+    images = {name: pngwriter.encode_png(pixels[name], mode, png_level) for name, mode in main.TileLayers.items()}
+    return images, time.perf_counter() - start
+
+
+class TileCache:
+    # images by (layer, lod, tx, ty), in memory up to budget bytes, the least
+    # recently used ones spilled to files in directory
+
+    def __init__(self, directory, budget):
+        self.directory = directory
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.memory = collections.OrderedDict()
+        self.memory_bytes = 0
+        # spilled and not written yet
+        self.spilling = dict()
+        self.spilled = 0
+
+    def file_path(self, key):
+        return os.path.join(self.directory, CacheTileFileName % key)
+
+    def get(self, key):
+        # image and where it was found, None if it is not cached
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data, "memory"
+            data = self.spilling.get(key)
+        if data is None:
+            try:
+                with open(self.file_path(key), "rb") as file:
+                    data = file.read()
+            except FileNotFoundError:
+                return None, None
+        self.put({key: data})
+        return data, "disk"
+
+    def put(self, images):
+        evicted = list()
+        with self.lock:
+            for key, data in images.items():
+                if key in self.memory:
+                    self.memory_bytes -= len(self.memory.pop(key))
+                self.memory[key] = data
+                self.memory_bytes += len(data)
+            while self.memory_bytes > self.budget and len(self.memory) > 1:
+                key, data = self.memory.popitem(last=False)
+                self.memory_bytes -= len(data)
+                self.spilling[key] = data
+                evicted.append(key)
+        for key in evicted:
+            self.spill(key)
+
+    def spill(self, key):
+        # written to a temporary file first, so a file in the cache is whole
+        file_path = self.file_path(key)
+        try:
+            if not os.path.exists(file_path):
+                with open(file_path + ".tmp", "wb") as file:
+                    file.write(self.spilling[key])
+                os.replace(file_path + ".tmp", file_path)
+                self.spilled += 1
+        except Exception as e:
+            logging.exception(str(e))
+        finally:
+            with self.lock:
+                self.spilling.pop(key, None)
+
+    def flush(self):
+        # every image in memory to the disk, at shutdown
+        with self.lock:
+            keys = list(self.memory)
+            self.spilling.update(self.memory)
+        for key in keys:
+            self.spill(key)
+
+
+class TileService:
+    # tiles from the cache or generated by the pool, one generation per tile
+    # at a time, with the latencies of the requests
+
+    def __init__(self, cache, pool):
+        self.cache = cache
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.pending = dict()
+        self.counts = {source: 0 for source in Sources}
+        self.errors = 0
+        self.latencies = {source: collections.deque(maxlen=LatencySamples) for source in Sources}
+        self.generation = collections.deque(maxlen=LatencySamples)
+
+    def tile(self, layer, lod, tx, ty):
+        # image of a layer of a tile and where it came from
+        start = time.perf_counter()
+        data, source = self.cache.get((layer, lod, tx, ty))
+        if data is None:
+            with self.lock:
+                future = self.pending.get((lod, tx, ty))
+                source = "coalesced" if future is not None else "generated"
+                if future is None:
+                    # it may have been generated since
+                    data, source = self.cache.get((layer, lod, tx, ty))
+                if future is None and data is None:
+                    source = "generated"
+                    future = Future()
+                    self.pending[(lod, tx, ty)] = future
+                    self.pool.apply_async(generate_tile, (lod, tx, ty),
+                                          callback=lambda result: self.generated(lod, tx, ty, future, result),
+                                          error_callback=lambda error: self.failed(lod, tx, ty, future, error))
+            if data is None:
+                data = future.result()[layer]
+        with self.lock:
+            self.counts[source] += 1
+            self.latencies[source].append(time.perf_counter() - start)
+        return data, source
+
+    def generated(self, lod, tx, ty, future, result):
+        images, seconds = result
+        self.cache.put({(layer, lod, tx, ty): data for layer, data in images.items()})
+        with self.lock:
+            self.generation.append(seconds)
+            del self.pending[(lod, tx, ty)]
+        future.set_result(images)
+
+    def failed(self, lod, tx, ty, future, error):
+        logging.error("tile %i %i at level %i: %s" % (tx, ty, lod, error))
+        with self.lock:
+            self.errors += 1
+            del self.pending[(lod, tx, ty)]
+        future.set_exception(error)
+
+    def stats(self):
+        def milliseconds(samples):
+            if len(samples) == 0:
+                return {"count": 0}
+            values = numpy.array(samples) * 1000.0
+            summary = {"count": len(values), "max": float(values.max())}
+            for percentile, value in zip(Percentiles, numpy.percentile(values, Percentiles)):
+                summary["p%i" % percentile] = float(value)
+            return summary
+        with self.lock:
+            latencies = {source: list(samples) for source, samples in self.latencies.items()}
+            stats = {"requests": dict(self.counts),
+                     "errors": self.errors,
+                     "pending": len(self.pending),
+                     "generation_ms": milliseconds(list(self.generation))}
+        with self.cache.lock:
+            stats["memory"] = {"bytes": self.cache.memory_bytes, "budget": self.cache.budget, "images": len(self.cache.memory)}
+            stats["spilled"] = self.cache.spilled
+        stats["latency_ms"] = {source: milliseconds(samples) for source, samples in latencies.items()}
+        stats["latency_ms"]["all"] = milliseconds(sum(latencies.values(), list()))
+        return stats
+
+
+def manifest():
+    return {"size_total": land_size,
+            "tile_size": tile_size,
+            "levels": [{"lod": lod, "step": 2 ** lod, "tiles": lod_tiles(lod)} for lod in range(lod_levels())],
+            "layers": main.TileLayers,
+            "value_ranges": ranges}
+
+
+def lod_levels():
+    # levels of detail, down to a single tile
+    levels = 1
+    while lod_tiles(levels - 1) > 1:
+        levels += 1
+    return levels
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    service = None
+
+    def do_GET(self):
+        match = TilePath.match(self.path)
+        if self.path == "/stats":
+            self.reply(json.dumps(self.service.stats(), indent=1).encode(), "application/json")
+        elif self.path == "/manifest":
+            self.reply(json.dumps(manifest(), indent=1).encode(), "application/json")
+        elif match is not None:
+            layer, lod, tx, ty = match.group(1), int(match.group(2)), int(match.group(3)), int(match.group(4))
+            if layer not in main.TileLayers or lod >= lod_levels() or tx >= lod_tiles(lod) or ty >= lod_tiles(lod):
+                self.send_error(404, "no such tile")
+                return
+            try:
+                data, source = self.service.tile(layer, lod, tx, ty)
+            except Exception as e:
+                self.send_error(500, str(e))
+                return
+            self.reply(data, "image/png", {"X-Tile-Source": source})
+        else:
+            self.send_error(404)
+
+    def reply(self, data, content_type, headers=dict()):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def execute():
+    print("Land Creator tile server")
+    global land_size, tile_size, ranges, png_level
+    logging.basicConfig(level=logging.INFO)
+    argp = argparse.ArgumentParser()
+    argp.add_argument('land_file', help='land description file')
+    argp.add_argument('--host', default="127.0.0.1", help='address to listen on')
+    argp.add_argument('--port', type=int, default=8080, help='port to listen on')
+    argp.add_argument('--socket', help='unix socket to listen on, instead of the port')
+    argp.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes generating tiles')
+    argp.add_argument('--memory', type=float, default=256, help='MB of tile images kept in memory')
+    argp.add_argument('-z', '--png_level', type=int, default=pngwriter.DefaultLevel, choices=range(10), metavar='[0-9]', help='png compression level, 0 is the fastest')
+    argp.add_argument('-d', '--debug', action='store_true', help='log every request')
+    args = argp.parse_args()
+    if args.debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    # land file
+    land_file_path = args.land_file
+    if not os.path.isfile(land_file_path):
+        land_file_path += ".ini"
+        if not os.path.isfile(land_file_path):
+            logging.error("land file does not exist: " + land_file_path)
+            sys.exit(1)
+    logging.info("file: " + land_file_path)
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    try:
+        config.read(land_file_path)
+    except Exception as e:
+        logging.exception(str(e))
+        sys.exit(1)
+    if not main.configure(config) or not check_land():
+        sys.exit(1)
+    land_size = main.size_total
+    tile_size = main.terrain_tile_size(land_size)
+    png_level = args.png_level
+    # cache, of this land description
+    cache_directory = os.path.join(main.directory, CacheDirName, main.config_digest())
+    try:
+        os.makedirs(cache_directory, exist_ok=True)
+        ranges = load_ranges(cache_directory)
+        tiles_directory = os.path.join(cache_directory, ranges_digest(ranges))
+        os.makedirs(tiles_directory, exist_ok=True)
+    except Exception as e:
+        logging.exception(str(e))
+        sys.exit(1)
+    logging.info("%i levels of detail, %ix%i tiles of size %i at level 0" % (lod_levels(), lod_tiles(0), lod_tiles(0), tile_size))
+    pool = multiprocessing.Pool(max(1, args.workers), initializer=init_worker,
+                                initargs=(land_file_path, (land_size, tile_size, ranges, png_level)))
+    cache = TileCache(tiles_directory, int(args.memory * 1024 * 1024))
+    Handler.service = TileService(cache, pool)
+    # server
+    try:
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+            server = UnixHTTPServer(args.socket, Handler)
+            logging.info("listening on " + args.socket)
+        else:
+            server = ThreadingHTTPServer((args.host, args.port), Handler)
+            server.daemon_threads = True
+            logging.info("listening on http://%s:%i" % (args.host, args.port))
+    except Exception as e:
+        logging.exception(str(e))
+        pool.terminate()
+        sys.exit(1)
+    # stopped by ctrl-c or by a terminate signal, the cache is flushed then
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+        pool.terminate()
+        logging.info("spill the tiles in memory to the cache")
+        cache.flush()
+
+
+if __name__ == "__main__":
+    execute()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# numpy arrays backed by shared memory or by memory mapped .npy files, so pool
+# workers write their bands of rows straight into the final grids. an array is
+# pickled by the name of its shared memory block, or by its file, and attached
+# again (not copied) by the worker.
+
+import atexit
+import os.path
+import numpy
+from multiprocessing import shared_memory
+
+# blocks created by this process, unlinked at exit
+_created = list()
+# blocks attached by this process, by name
+_attached = dict()
+
+
+class SharedArray(numpy.ndarray):
+
+    def __reduce__(self):
+        # only the arrays returned by the functions of this module own a block
+        # or a file, views and derived arrays are pickled by value
+        shm = getattr(self, "_shm", None)
+        if shm is not None:
+            return (attach_array, (shm.name, self.shape, self.dtype.str))
+        mapping = getattr(self, "_mapping", None)
+        if mapping is not None:
+            return (attach_mapped_array, mapping + (self.shape, self.dtype.str))
+        return super().__reduce__()
+
+
+def _wrap(shm, shape, dtype):
+    array = numpy.ndarray(shape, dtype=dtype, buffer=shm.buf).view(SharedArray)
+    array._shm = shm
+    return array
+
+
+def new_array(shape, dtype):
+    # zero filled array in a new shared memory block
+    size = max(1, int(numpy.prod(shape)) * numpy.dtype(dtype).itemsize)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    if len(_created) == 0:
+        atexit.register(release)
+    _created.append(shm)
+    array = _wrap(shm, shape, dtype)
+    array.fill(0)
+    return array
+
+
+def copy_array(source):
+    array = new_array(source.shape, source.dtype)
+    array[...] = source
+    return array
+
+
+def attach_array(name, shape, dtype):
+    shm = _attached.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached[name] = shm
+    return _wrap(shm, shape, numpy.dtype(dtype))
+
+
+def map_array(file_path, shape=None, dtype=None, mode='r'):
+    # .npy file mapped in memory; mode 'w+' creates it with shape and dtype
+    if mode == 'w+':
+        memmap = numpy.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=shape)
+    else:
+        memmap = numpy.load(file_path, mmap_mode=mode, allow_pickle=False)
+    array = memmap.view(SharedArray)
+    array._memmap = memmap
+    array._mapping = (os.path.abspath(file_path), memmap.offset, 'r' if mode == 'r' else 'r+')
+    return array
+
+
+def attach_mapped_array(file_path, offset, mode, shape, dtype):
+    memmap = numpy.memmap(file_path, dtype=numpy.dtype(dtype), mode=mode, offset=offset, shape=shape)
+    array = memmap.view(SharedArray)
+    array._memmap = memmap
+    return array
+
+
+def mapped_file(array):
+    # path of the file array is mapped to, or None
+    mapping = getattr(array, "_mapping", None)
+    return None if mapping is None else mapping[0]
+
+
+def flush(array):
+    memmap = getattr(array, "_memmap", None)
+    if memmap is not None:
+        memmap.flush()
+
+
+def release():
+    while len(_created) > 0:
+        shm = _created.pop()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            shm.close()
+        except BufferError:
+            # arrays still use it, the mapping goes away with the process
+            pass
+
+
+def block_names(arrays):
+    # names of the blocks of the arrays owning one
+    return [array._shm.name for array in arrays if getattr(array, "_shm", None) is not None]
+
+
+def detach(keep=()):
+    # closes the blocks attached but the ones named in keep; arrays still using
+    # a block keep its mapping until they go
+    for name in [name for name in _attached if name not in keep]:
+        shm = _attached.pop(name)
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+def release_all():
+    # release, and the blocks attached too, between lands
+    release()
+    detach()
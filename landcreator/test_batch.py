@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import configparser
+import os
+import numpy
+import batch
+import main
+
+
+def shared_blocks():
+    return len([name for name in os.listdir("/dev/shm") if name.startswith("psm_")])
+
+
+def test_shared_memory_released_between_lands(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    base = configparser.ConfigParser()
+    base.read_dict(main._defaul_config)
+    base.read_dict({"global": {"name": "land", "size_total": "65", "noise_horiz_scale": "1.0"}})
+    grid = {("topography", "perlin_seed"): ["0.1", "0.2"]}
+    before = shared_blocks()
+    counts, pools = list(), list()
+    for row in batch.run_lands(base, "land", grid, ["noise", "topography", "normals"], 2, 1):
+        assert row is not None
+        counts.append(shared_blocks())
+        pools.append(main.pool)
+    assert counts == [before, before]
+    # one pool for all the lands
+    assert pools[0] is not None and pools[0] is pools[1]
+    assert main.pool is None
+    # the lands were generated by the workers anyway
+    assert not numpy.array_equal(numpy.load("land_000/topography.npy"), numpy.load("land_001/topography.npy"))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import configparser
+import json
+import os
+import numpy
+import container
+import main
+
+
+def test_write_and_read(tmp_path):
+    rng = numpy.random.default_rng(0)
+    heights = rng.random((37, 29)) * 3.0 - 1.0
+    normals = rng.random((37, 29, 3)).astype(numpy.float32)
+    file_path = str(tmp_path / "land.pack")
+    writer = container.Writer(file_path)
+    writer.add_array("exact", heights, band_rows=5, attributes={"sidecar": {"hash": "h"}})
+    writer.add_array("zlib", normals, compression="zlib", band_rows=8)
+    writer.add_array("uint16", heights, quantization="uint16", compression="zlib", band_rows=4)
+    writer.add_array("uint8", heights, quantization="uint8")
+    writer.add_bytes("image.png", b"not an image")
+    writer.close()
+    assert not os.path.exists(file_path + ".tmp")
+    land = container.Container(file_path)
+    assert all(entry["offset"] % container.Alignment == 0 for entry in land.layers.values())
+    assert land.layers["exact"]["attributes"] == {"sidecar": {"hash": "h"}}
+    # exact layers, whole or a sub-rectangle
+    assert numpy.array_equal(land.read("exact"), heights)
+    assert land.read("exact").dtype == heights.dtype
+    assert numpy.array_equal(land.read("exact", slice(3, 20), slice(7, 8)), heights[3:20, 7:8])
+    assert numpy.array_equal(land.read("zlib"), normals)
+    assert numpy.array_equal(land.read("zlib", slice(30, None), slice(None, 4)), normals[30:, :4])
+    # quantized layers, within half a step of the range and exact at its ends
+    for name, qmax in (("uint16", 65535), ("uint8", 255)):
+        values = land.read(name)
+        assert values.dtype == heights.dtype
+        assert numpy.abs(values - heights).max() <= 0.5 * (heights.max() - heights.min()) / qmax + 1e-12
+        assert numpy.isclose(values.min(), heights.min()) and numpy.isclose(values.max(), heights.max())
+        assert numpy.array_equal(land.read(name, slice(10, 12), slice(3, 9)), values[10:12, 3:9])
+    assert land.read("uint16", dtype=numpy.float32).dtype == numpy.float32
+    assert land.file("image.png") == b"not an image"
+
+
+def build(tmp_path, monkeypatch, quantize):
+    # a land and its container, of the data files as they were
+    monkeypatch.chdir(tmp_path)
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    config.read_dict({"global": {"name": "land", "size_total": "65", "noise_horiz_scale": "1.0"},
+                      "container": {"quantize": quantize}})
+    assert main.configure(config)
+    main.pool = None
+    main.loaded.clear()
+    main.value_ranges.clear()
+    assert main.run_stages(["container"], set(), dict(), 1, 0)
+    return {file_name: numpy.load(os.path.join(main.directory, file_name))
+            for file_name in (main.TopoDataFileName, main.NormalsDataFileName, main.TempDataFileName)}
+
+
+def test_load_data_from_container(tmp_path, monkeypatch):
+    arrays = build(tmp_path, monkeypatch, "none")
+    for file_name, array in arrays.items():
+        os.remove(os.path.join(main.directory, file_name))
+        assert numpy.array_equal(main.load_data(file_name), array)
+    # the stages of the files in the container are up to date
+    assert main.stage_fresh("topography") and main.stage_fresh("normals")
+
+
+def test_stages_from_quantized_data(tmp_path, monkeypatch):
+    arrays = build(tmp_path, monkeypatch, "uint16")
+    topography_path = os.path.join(main.directory, main.TopoDataFileName)
+    os.rename(topography_path, topography_path + ".kept")
+    os.rename(topography_path + ".hash", topography_path + ".hash.kept")
+    topography = main.load_data(main.TopoDataFileName)
+    assert numpy.abs(topography - arrays[main.TopoDataFileName]).max() <= 0.5 / 65535 + 1e-12
+    # a region can not edit the data in the container
+    assert not main.do_region(["temperature"], (0, 0, 8, 8))
+    # normals generated again from it are marked, and stale once the exact file is back
+    assert main.run_stages(["normals"], {"normals"}, dict(), 1, 0)
+    with open(os.path.join(main.directory, main.SidecarFileName % main.NormalsDataFileName)) as file:
+        assert json.load(file)["source"] == "container"
+    assert main.stage_fresh("normals")
+    os.rename(topography_path + ".kept", topography_path)
+    os.rename(topography_path + ".hash.kept", topography_path + ".hash")
+    assert main.stage_fresh("topography")
+    assert not main.stage_fresh("normals")
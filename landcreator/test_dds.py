@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import configparser
+import os
+import struct
+import numpy
+import dds
+import main
+
+
+def decode_bc1(block):
+    # (16, 3) colors of an 8 byte bc1 block, in 4 color mode
+    c0, c1, bits = struct.unpack("<HHI", bytes(block))
+    e0, e1 = dds._expand565(numpy.array([c0, c1], dtype=numpy.uint32))
+    assert c0 > c1 or (c0 == c1 and bits == 0)
+    palette = [e0, e1, (2 * e0 + e1) / 3, (e0 + 2 * e1) / 3]
+    indices = [(bits >> (2 * i)) & 3 for i in range(16)]
+    return numpy.array([palette[i] for i in indices]), indices
+
+
+def decode_bc4(block):
+    # 16 values of an 8 byte bc4 block, in 8 level mode
+    a0, a1 = int(block[0]), int(block[1])
+    bits = int.from_bytes(bytes(block[2:]), "little")
+    assert a0 > a1 or (a0 == a1 and bits == 0)
+    levels = [a0, a1] + [((8 - code) * a0 + (code - 1) * a1) / 7 for code in range(2, 8)]
+    codes = [(bits >> (3 * i)) & 7 for i in range(16)]
+    return numpy.array([levels[code] for code in codes]), codes
+
+
+def test_bc1_endpoints_and_indices():
+    # two colors exact in 565, red the larger endpoint
+    red, blue = [255, 0, 0], [0, 0, 255]
+    pattern = numpy.array([0, 1, 1, 0, 1, 0, 0, 1, 0, 0, 1, 1, 1, 1, 0, 0])
+    colors = numpy.array([[red, blue][i] for i in pattern], dtype=numpy.uint8)
+    block = dds.encode_bc1(colors[None])[0]
+    c0, c1 = struct.unpack("<HH", bytes(block[:4]))
+    assert (c0, c1) == (0xf800, 0x001f)
+    decoded, indices = decode_bc1(block)
+    assert indices == list(pattern)
+    assert numpy.array_equal(decoded, colors)
+    # the 4 steps of the line between the endpoints are indices 0, 2, 3 and 1
+    steps = numpy.array([0, 1, 2, 3] * 4)
+    colors = numpy.array([[255 - 85 * step, 0, 0] for step in steps], dtype=numpy.uint8)
+    decoded, indices = decode_bc1(dds.encode_bc1(colors[None])[0])
+    assert indices == [[0, 2, 3, 1][step] for step in steps]
+    assert numpy.abs(decoded - colors).max() <= 8
+    # a single color
+    colors = numpy.full((16, 3), [24, 130, 200], dtype=numpy.uint8)
+    decoded, indices = decode_bc1(dds.encode_bc1(colors[None])[0])
+    assert indices == [0] * 16
+    assert numpy.abs(decoded - colors).max() <= 4
+
+
+def test_bc4_endpoints_and_codes():
+    # the 8 levels between 20 and 230, level 7 the maximum (code 0) and level 0
+    # the minimum (code 1)
+    levels = numpy.array([0, 7, 1, 2, 3, 4, 5, 6, 7, 6, 5, 4, 3, 2, 1, 0])
+    values = (20 + 30 * levels).astype(numpy.uint8)
+    block = dds.encode_bc4(values[None])[0]
+    assert (block[0], block[1]) == (230, 20)
+    decoded, codes = decode_bc4(block)
+    assert codes == [0 if level == 7 else 1 if level == 0 else 8 - level for level in levels]
+    assert numpy.array_equal(decoded, values)
+    # a single value
+    decoded, codes = decode_bc4(dds.encode_bc4(numpy.full((1, 16), 99, dtype=numpy.uint8))[0])
+    assert codes == [0] * 16 and (decoded == 99).all()
+
+
+def test_encode_layouts():
+    # blocks of a 6x5 image, the last row and column repeated, bc3 alpha first
+    rng = numpy.random.default_rng(0)
+    pixels = rng.integers(0, 256, (6, 5, 4), dtype=numpy.uint8)
+    blocks = dds.blocks(pixels)
+    assert blocks.shape == (4, 16, 4)
+    assert numpy.array_equal(blocks[3].reshape(4, 4, 4)[3, 3], pixels[5, 4])
+    data = numpy.frombuffer(dds.encode(pixels, "bc3"), dtype=numpy.uint8).reshape(4, 16)
+    assert numpy.array_equal(data[:, :8], dds.encode_bc4(blocks[..., 3]))
+    assert numpy.array_equal(data[:, 8:], dds.encode_bc1(blocks[..., 0:3]))
+    data = numpy.frombuffer(dds.encode(pixels[..., 0:2], "bc5"), dtype=numpy.uint8).reshape(4, 16)
+    assert numpy.array_equal(data[:, :8], dds.encode_bc4(blocks[..., 0]))
+    assert numpy.array_equal(data[:, 8:], dds.encode_bc4(blocks[..., 1]))
+    assert len(dds.encode(pixels[..., 0], "bc4")) == 4 * 8
+    assert len(dds.encode(pixels[..., 0:3], "bc1")) == 4 * 8
+
+
+def test_header_and_mip_levels():
+    sizes = dds.level_sizes(37, 9)
+    assert sizes == [(37, 9), (18, 4), (9, 2), (4, 1), (2, 1), (1, 1)]
+    for format, (fourcc, block_bytes, channels) in dds.Formats.items():
+        header = dds.header(format, 37, 9, len(sizes))
+        assert len(header) == 128
+        fields = struct.unpack("<4s7I44x2I4s5I5I", header)
+        magic, size, flags, height, width, linear_size, depth, levels = fields[:8]
+        assert (magic, size, height, width, depth, levels) == (b"DDS ", 124, 9, 37, 0, 6)
+        assert linear_size == 10 * 3 * block_bytes
+        assert flags & 0x20000 and flags & 0x80000
+        assert fields[8:11] == (32, 0x4, fourcc)
+        assert fields[16] & 0x400000 and fields[16] & 0x8
+    # a level is the box filter of the one before
+    image = numpy.arange(5 * 3, dtype=numpy.uint8).reshape(5, 3) * 10
+    assert numpy.array_equal(dds.downsample(image), [[20], [80]])
+
+
+def test_textures_have_their_mip_levels(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    config.read_dict({"global": {"name": "land", "size_total": "65", "noise_horiz_scale": "1.0"}})
+    assert main.configure(config)
+    main.pool = None
+    main.loaded.clear()
+    assert main.run_stages(["dds_textures"], set(), dict(), 1, 0)
+    formats = {fourcc: (format, block_bytes) for format, (fourcc, block_bytes, channels) in dds.Formats.items()}
+    for file_name in main.DdsFormats:
+        with open(os.path.join(main.directory, file_name), "rb") as file:
+            data = file.read()
+        fields = struct.unpack("<4s7I44x2I4s5I5I", data[:128])
+        height, width, levels, fourcc = fields[3], fields[4], fields[7], fields[10]
+        format, block_bytes = formats[fourcc]
+        assert (width, height, levels) == (65, 65, 7)
+        sizes = dds.level_sizes(width, height)
+        assert len(sizes) == levels
+        assert len(data) == 128 + sum(((w + 3) // 4) * ((h + 3) // 4) * block_bytes for w, h in sizes)
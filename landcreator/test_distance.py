@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+import distance
+
+
+def brute_force(features):
+    # distance of every pixel to every feature, the nearest one
+    points = numpy.argwhere(features)
+    rows, cols = numpy.indices(features.shape)
+    squared = (rows[..., None] - points[:, 0]) ** 2 + (cols[..., None] - points[:, 1]) ** 2
+    return numpy.sqrt(squared.min(axis=-1))
+
+
+def test_transform_matches_brute_force():
+    rng = numpy.random.default_rng(0)
+    for shape in ((1, 1), (1, 9), (9, 1), (7, 7), (13, 29), (32, 17)):
+        for density in (0.01, 0.1, 0.5, 0.9):
+            features = rng.random(shape) < density
+            features[rng.integers(shape[0]), rng.integers(shape[1])] = True
+            assert numpy.array_equal(distance.transform(features), brute_force(features))
+
+
+def test_transform_of_uniform_grids():
+    # all the pixels features, as an all land or all ocean grid, or none of them
+    for shape in ((1, 1), (5, 8), (16, 16)):
+        assert not distance.transform(numpy.ones(shape, dtype=bool)).any()
+        assert (distance.transform(numpy.zeros(shape, dtype=bool)) == sum(shape)).all()
@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+import pytest
+import fbm
+
+
+def test_snoise2_matches_noise_package():
+    noise = pytest.importorskip("noise")
+    xs = numpy.linspace(-37.3, 291.7, 23)
+    ys = numpy.linspace(-5.1, 1043.9, 29)
+    for repeat, base, freq in ((32, 0, 1.0), (1024, 0.634, 256.0), (97, 3.25, 16.0), (1024, 17, 0.37)):
+        values = fbm.snoise2(xs / freq, ys / freq, repeat, base)
+        assert values.shape == (len(xs), len(ys))
+        expected = numpy.array([[noise.snoise2(x / freq, y / freq, 1, 0.5, 2.0, repeatx=repeat, repeaty=repeat, base=base) for y in ys] for x in xs])
+        assert numpy.abs(values - expected).max() <= fbm.NoiseTolerance
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+import lod
+
+
+def test_level_sizes():
+    assert lod.level_sizes(33, 5) == [17, 9, 5]
+    assert lod.level_sizes(3, 1) == [2]
+    assert lod.level_sizes(32, 1) == []
+
+
+def test_reductions_keep_the_grid():
+    rng = numpy.random.default_rng(0)
+    for size in (3, 5, 9, 17, 33):
+        height = rng.random((size, size))
+        padded = lod.pad(height)
+        average = lod.reduce(padded, lod.TentWeights)
+        low, high = lod.extreme(padded, numpy.fmin), lod.extreme(padded, numpy.fmax)
+        # vertex (i, j) is vertex (2i, 2j) of the level before
+        for level in (average, low, high):
+            assert level.shape == ((size - 1) // 2 + 1,) * 2
+            assert not numpy.isnan(level).any()
+        kept = height[::2, ::2]
+        assert (low <= average).all() and (average <= high).all()
+        assert (low <= kept).all() and (kept <= high).all()
+        # the 3x3 vertices around the kept one, the ones in the grid
+        for i, j in ((0, 0), (0, size // 2), (size // 4, size // 4), ((size - 1) // 2, (size - 1) // 2)):
+            around = height[max(0, 2 * i - 1):2 * i + 2, max(0, 2 * j - 1):2 * j + 2]
+            assert low[i, j] == around.min() and high[i, j] == around.max()
+        # a constant grid stays constant at the edges too
+        assert numpy.allclose(lod.reduce(lod.pad(numpy.full((size, size), 0.3)), lod.TentWeights), 0.3)
+
+
+def test_box_filtered_weights_sum_to_255():
+    rng = numpy.random.default_rng(1)
+    for size in (3, 9, 33):
+        weights = lod.renormalize(rng.random((size, size, 8)) * (rng.random((size, size, 8)) < 0.4))
+        level = lod.reduce(lod.pad(weights), lod.BoxWeights)
+        lod.renormalize(level)
+        assert level.shape == ((size - 1) // 2 + 1, (size - 1) // 2 + 1, 8)
+        assert numpy.allclose(255 * level.sum(axis=-1), 255)
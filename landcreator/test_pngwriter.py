@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import struct
+import zlib
+import numpy
+import png
+import pngwriter
+
+
+def image(mode, rows=53, width=37, seed=0):
+    # smooth and noisy areas, so every filter gets chosen somewhere
+    rng = numpy.random.default_rng(seed)
+    channels, dtype = pngwriter.Modes[mode][2], pngwriter.Modes[mode][3]
+    top = numpy.iinfo(dtype).max
+    ramp = (numpy.add.outer(numpy.arange(rows), numpy.arange(width)) * (top // (rows + width))).astype(numpy.int64)
+    pixels = numpy.repeat(ramp[..., None], channels, axis=2)
+    pixels[rows // 2:] = rng.integers(0, top + 1, (rows - rows // 2, width, channels))
+    pixels = pixels.astype(dtype.newbyteorder("="))
+    return pixels[..., 0] if channels == 1 else pixels
+
+
+def bands(pixels, band_rows):
+    return [pixels[start:start + band_rows] for start in range(0, pixels.shape[0], band_rows)]
+
+
+def idat_data(data):
+    # concatenated IDAT chunks of a png file in memory
+    offset, idat = 8, b""
+    while offset < len(data):
+        length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        if kind == b"IDAT":
+            idat += data[offset + 8:offset + 8 + length]
+        offset += 12 + length
+    return idat
+
+
+def test_adler32_combine():
+    rng = numpy.random.default_rng(0)
+    for length1, length2 in ((0, 5), (7, 0), (1, 1), (4000, 70000), (65521, 65521 * 3 + 11)):
+        piece1, piece2 = rng.bytes(length1), rng.bytes(length2)
+        combined = pngwriter._adler32_combine(zlib.adler32(piece1), zlib.adler32(piece2), length2)
+        assert combined == zlib.adler32(piece1 + piece2)
+
+
+def test_round_trip():
+    for mode in pngwriter.Modes:
+        pixels = image(mode)
+        channels = pngwriter.Modes[mode][2]
+        for level in (0, 1, 6):
+            for band_rows in (1, 7, 100):
+                buffer = io.BytesIO()
+                pngwriter.write_png(buffer, pixels.shape[1], pixels.shape[0], mode, bands(pixels, band_rows), level, 2)
+                data = buffer.getvalue()
+                # a single zlib stream, its adler32 checked by zlib
+                filtered = zlib.decompress(idat_data(data))
+                stride = 1 + pixels.shape[1] * channels * pixels.dtype.itemsize
+                assert len(filtered) == pixels.shape[0] * stride
+                # none, sub, up, average and paeth all chosen, or none at level 0
+                assert set(filtered[::stride]) == ({0, 1, 2, 3, 4} if level > 0 else {0})
+                width, height, rows, info = png.Reader(bytes=data).read()
+                decoded = numpy.array([numpy.array(row) for row in rows]).reshape(pixels.shape)
+                assert (width, height) == (pixels.shape[1], pixels.shape[0])
+                assert numpy.array_equal(decoded, pixels)
+
+
+def test_encode_png():
+    pixels = image("RGBA8", 9, 5)
+    width, height, rows, info = png.Reader(bytes=pngwriter.encode_png(pixels, "RGBA8")).read()
+    assert numpy.array_equal(numpy.array([numpy.array(row) for row in rows]).reshape(pixels.shape), pixels)
+
+
+def test_update_png_matches_full_encoding(tmp_path):
+    for mode in pngwriter.Modes:
+        before, after = image(mode, seed=1), image(mode, seed=1)
+        after[20:38, 5:11] = image(mode, seed=2)[20:38, 5:11]
+        updated, full = str(tmp_path / "updated.png"), str(tmp_path / "full.png")
+        pngwriter.write_png(updated, before.shape[1], before.shape[0], mode, bands(before, 16))
+        pngwriter.update_png(updated, slice(20, 38), lambda start, stop: after[start:stop], 16)
+        pngwriter.write_png(full, after.shape[1], after.shape[0], mode, bands(after, 16))
+        with open(updated, "rb") as file_updated, open(full, "rb") as file_full:
+            assert file_updated.read() == file_full.read()
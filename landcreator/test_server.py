@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import configparser
+import json
+import os
+import threading
+import main
+import server
+
+
+def configure(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = configparser.ConfigParser()
+    config.read_dict(main._defaul_config)
+    config.read_dict({"global": {"name": "land", "size_total": "129", "noise_horiz_scale": "1.0"},
+                      "tiles": {"size": "33"}})
+    assert main.configure(config)
+    main.pool = None
+    main.loaded.clear()
+    main.value_ranges.clear()
+
+
+def test_tiles_match_terrain_tiles(tmp_path, monkeypatch):
+    configure(tmp_path, monkeypatch)
+    assert main.run_stages(["terrain_tiles"], set(), dict(), 1, 0)
+    monkeypatch.setattr(server, "land_size", main.size_total)
+    monkeypatch.setattr(server, "tile_size", main.terrain_tile_size(main.size_total))
+    monkeypatch.setattr(server, "ranges", server.build_ranges())
+    monkeypatch.setattr(server, "png_level", main.png_level)
+    with open(os.path.join(main.directory, main.TilesManifestFileName)) as file:
+        manifest = json.load(file)
+    assert manifest["tiles"] == server.lod_tiles(0) == 4
+    for tile in manifest["tile_list"]:
+        images, seconds = server.generate_tile(0, *tile["tile"])
+        for name, (offset, length) in tile["offsets"].items():
+            with open(os.path.join(main.directory, manifest["layers"][name]["file"]), "rb") as file:
+                file.seek(offset)
+                assert images[name] == file.read(length)
+
+
+class Pending(dict):
+    # pending generations of a service, telling when a second request looked for one
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+        self.second = threading.Event()
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        if self.lookups == 2:
+            self.second.set()
+        return super().get(key, default)
+
+
+class Pool:
+    # runs generate_tile only when released
+    def __init__(self):
+        self.calls = list()
+
+    def apply_async(self, function, args, callback, error_callback):
+        self.calls.append((args, callback))
+
+
+def test_requests_of_a_tile_being_generated_are_coalesced(tmp_path):
+    service = server.TileService(server.TileCache(str(tmp_path), 1 << 20), Pool())
+    service.pending = Pending()
+    results = dict()
+
+    def request(name):
+        results[name] = service.tile("topography", 0, 1, 2)
+
+    first = threading.Thread(target=request, args=("first",))
+    first.start()
+    second = threading.Thread(target=request, args=("second",))
+    second.start()
+    assert service.pending.second.wait(10)
+    # a single generation, for both requests
+    assert len(service.pool.calls) == 1
+    args, callback = service.pool.calls[0]
+    assert args == (0, 1, 2)
+    callback(({"topography": b"image", "normals": b"normals"}, 0.1))
+    first.join(10)
+    second.join(10)
+    assert sorted(results.values()) == [(b"image", "coalesced"), (b"image", "generated")]
+    # and then from the cache
+    assert service.tile("normals", 0, 1, 2) == (b"normals", "memory")
+    assert service.counts == {"memory": 1, "disk": 0, "generated": 1, "coalesced": 1}
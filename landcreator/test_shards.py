@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+MainPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+
+def run(directory, *args):
+    subprocess.run([sys.executable, MainPath] + list(args), cwd=directory, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def test_merged_shards_match_single_build(tmp_path):
+    for name in ("single", "sharded"):
+        os.mkdir(tmp_path / name)
+        with open(tmp_path / name / "land.ini", "w") as file:
+            file.write("[global]\nname = land\nsize_total = 129\nnoise_horiz_scale = 1.0\n")
+    run(tmp_path / "single", "land.ini")
+    # shards of uneven tile ranges, generated apart and merged
+    run(tmp_path / "sharded", "land.ini", "--tiles", "3", "--tile-range", "0:1")
+    run(tmp_path / "sharded", "land.ini", "--tiles", "3", "--tile-range", "1:3")
+    run(tmp_path / "sharded", "merge", "land.ini", "--tiles", "3")
+    single, sharded = tmp_path / "single" / "land", tmp_path / "sharded" / "land"
+    file_names = [file_name for file_name in sorted(os.listdir(single)) if file_name.endswith((".npy", ".png"))]
+    assert "topography.npy" in file_names and "land_data_alpha0.png" in file_names
+    for file_name in file_names:
+        with open(single / file_name, "rb") as file_single, open(sharded / file_name, "rb") as file_sharded:
+            assert file_single.read() == file_sharded.read(), file_name
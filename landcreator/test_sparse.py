@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+import main
+
+
+def test_sparse_weights_of_pixel_without_weights():
+    weights = numpy.zeros((2, 8))
+    weights[0, [2, 5, 6]] = [0.5, 0.3, 0.2]
+    for materials in (2, 3):
+        indices, quantized = main.calculate_sparse_weights(weights.copy(), materials)
+        assert indices[0, 0] == 2 and indices[0, 1] == 5
+        assert quantized[0].sum() == 255
+        assert not indices[1].any()
+        assert not quantized[1].any()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy
+import main
+
+
+def layers(count):
+    # random values, and the breakpoints of the classification among them
+    rng = numpy.random.default_rng(0)
+    breakpoints = numpy.array([0.0, 0.2, 0.4, 0.6, 0.8, 1.0, main.ocean_altitude + 0.05, main.SlopeTransitionStart, main.SlopeTransitionEnd,
+                               main.Terr7HumidityBlendStart, main.Terr7HumidityBlendEnd, main.Terr7NoiseBlendStart, main.Terr7NoiseBlendEnd,
+                               main.Terr7TempSnowTransitionStart, main.Terr7TempSnowTransitionEnd,
+                               main.Terr7TempSandTransitionStart, main.Terr7TempSandTransitionEnd])
+    values = rng.random((5, count))
+    picked = rng.random((5, count)) < 0.2
+    values[picked] = rng.choice(breakpoints, numpy.count_nonzero(picked))
+    return values
+
+
+def test_bld_data_matches_scalar():
+    altitude, slope, temperature, humidity, noise = layers(5000)
+    indices, blend_factors, unexpected = main.calculate_bld_data(slope, temperature, humidity)
+    assert unexpected == 0
+    factors = numpy.zeros(len(indices), dtype=numpy.uint8)
+    numpy.multiply(blend_factors, 255, out=factors, casting='unsafe')
+    for i in range(len(indices)):
+        assert main.calculate_data_bld(altitude[i], slope[i], temperature[i], humidity[i]) == (indices[i], factors[i])
+
+
+def test_alpha_weights_match_scalar():
+    altitude, slope, temperature, humidity, noise = layers(5000)
+    weights, bad = main.calculate_alpha_weights(altitude, slope, temperature, humidity, noise)
+    for i in range(len(weights)):
+        assert numpy.array_equal(main.calculate_data_alpha(altitude[i], slope[i], temperature[i], humidity[i], noise[i]), 255 * weights[i])